@@ -3,6 +3,16 @@ ASGI config for KokkoSofter project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The Server-Sent Events endpoint (``/api/events/``) holds connections open and
+is only served when running under an ASGI server, e.g.::
+
+    uvicorn KokkoSofter.asgi:application --port 8001
+
+Events are published from the WSGI workers and delivered through
+``settings.EVENT_BROKER``, so this process refuses to start unless
+``EVENT_BROKER`` is ``core.events.RedisBroker`` and ``EVENT_BROKER_URL`` is set.
+Pages only connect to the endpoint when ``EVENT_STREAM_ENABLED`` is true.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
@@ -14,3 +24,7 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'KokkoSofter.settings')
 
 application = get_asgi_application()
+
+from core.events import check_asgi_broker  # noqa: E402
+
+check_asgi_broker()
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 import os
 from pathlib import Path
+from urllib.parse import urlparse
 from decouple import config
 import dj_database_url
 
@@ -84,10 +85,12 @@ MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # 静的ファイル配信
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'core.middleware.SessionRefreshMiddleware',  # セッション有効期限の間引き延長
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'core.middleware.UpdateLastSeenMiddleware',  # オンラインユーザー追跡
+    'core.middleware.ProfileMiddleware',  # request.profile / request.capabilities
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -105,6 +108,8 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'accounts.context_processors.capabilities',
+                'core.context_processors.live_events',
             ],
         },
     },
@@ -112,13 +117,89 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'KokkoSofter.wsgi.application'
 
+# テストは外部のキャッシュサーバーに依存せずプロセス内メモリで実行する
+TEST_RUNNER = 'KokkoSofter.test_runner.TestRunner'
+
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
 # デフォルトはSQLite、本番環境ではPostgreSQLを推奨
 default_db_url = f"sqlite:///{BASE_DIR / 'db.sqlite3'}"
 DATABASES = {
-    'default': dj_database_url.config(default=default_db_url)
+    'default': dj_database_url.config(
+        default=default_db_url,
+        conn_max_age=config('DB_CONN_MAX_AGE', default=60, cast=int),  # 接続を使い回す秒数（0でリクエストごとに切断）
+        conn_health_checks=config('DB_CONN_HEALTH_CHECKS', default=True, cast=bool),  # 再利用前に接続の生存確認を行う
+    )
+}
+
+if DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+    # psycopg 3 のコネクションプール（psycopg[binary,pool] が必要。psycopg2 では使用不可）
+    if config('DB_POOL', default=False, cast=bool):
+        DATABASES['default']['CONN_MAX_AGE'] = 0  # プール使用時は永続接続と併用できない
+        DATABASES['default'].setdefault('OPTIONS', {})['pool'] = {
+            'min_size': config('DB_POOL_MIN_SIZE', default=2, cast=int),
+            'max_size': config('DB_POOL_MAX_SIZE', default=10, cast=int),
+            'timeout': config('DB_POOL_TIMEOUT', default=10, cast=int),
+        }
+elif DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # WALモードで読み込みと書き込みを並行させ、ロック待ちによる "database is locked" を防ぐ
+    DATABASES['default'].setdefault('OPTIONS', {}).update({
+        'init_command': (
+            'PRAGMA journal_mode=WAL;'
+            'PRAGMA synchronous=NORMAL;'
+            'PRAGMA temp_store=MEMORY;'
+            'PRAGMA cache_size=-20000;'
+            'PRAGMA mmap_size=134217728;'
+        ),
+        'transaction_mode': 'IMMEDIATE',
+        'timeout': 20,
+    })
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+def cache_from_url(url):
+    """
+    CACHE_URL からキャッシュ設定を作成
+
+    locmem://            プロセス内メモリ（開発用、ワーカー間で共有されない）
+    file:///path/to/dir  ファイルキャッシュ（add / incr が不可分でないため共有キャッシュとしては扱わない）
+    redis://host:6379/0  Redis（本番推奨、redis パッケージが必要）
+    memcached://host:11211  Memcached（pymemcache パッケージが必要）
+    """
+    parsed = urlparse(url)
+    backends = {
+        'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+        'file': 'django.core.cache.backends.filebased.FileBasedCache',
+        'redis': 'django.core.cache.backends.redis.RedisCache',
+        'rediss': 'django.core.cache.backends.redis.RedisCache',
+        'memcached': 'django.core.cache.backends.memcached.PyMemcacheCache',
+        'dummy': 'django.core.cache.backends.dummy.DummyCache',
+    }
+    if parsed.scheme not in backends:
+        raise ValueError(f'未対応のCACHE_URLです: {url}')
+
+    if parsed.scheme == 'file':
+        location = parsed.path
+    elif parsed.scheme == 'memcached':
+        location = parsed.netloc
+    elif parsed.scheme in ('redis', 'rediss'):
+        location = url
+    else:
+        location = parsed.netloc or 'kokkosofter'
+
+    return {
+        'BACKEND': backends[parsed.scheme],
+        'LOCATION': location,
+        'KEY_PREFIX': 'kokkosofter',
+        'TIMEOUT': config('CACHE_DEFAULT_TIMEOUT', default=300, cast=int),
+    }
+
+# 本番環境は gunicorn の全ワーカーで共有するため、既定でローカルの Redis を使う
+# （Memcached などは CACHE_URL で指定）。開発環境の既定はプロセス内メモリ
+CACHES = {
+    'default': cache_from_url(config('CACHE_URL', default='locmem://' if DEBUG else 'redis://localhost:6379/0')),
 }
 
 # Password validation
@@ -220,17 +301,69 @@ if not DEBUG:
     LOGGING['loggers']['django']['handlers'].append('file')
 
 # セッション設定
+# 読み込みはキャッシュ、書き込みはキャッシュとDBの両方（cached_db）。Cookieのみで持つ場合は
+# django.contrib.sessions.backends.signed_cookies を指定
+SESSION_ENGINE = config('SESSION_ENGINE', default='django.contrib.sessions.backends.cached_db')
 SESSION_COOKIE_AGE = 60 * 60 * 24 * 7  # 1週間
-SESSION_SAVE_EVERY_REQUEST = True
+# 毎リクエストの書き込みはせず、SessionRefreshMiddleware で間引いて有効期限を延長する
+SESSION_SAVE_EVERY_REQUEST = False
+SESSION_REFRESH_FRACTION = config('SESSION_REFRESH_FRACTION', default=0.1, cast=float)  # 有効期限の延長間隔（SESSION_COOKIE_AGEに対する割合）
 SESSION_EXPIRE_AT_BROWSER_CLOSE = False
 
+# タイムライン設定
+FEED_PAGE_SIZE = config('FEED_PAGE_SIZE', default=20, cast=int)  # 1ページあたりの投稿数
+POST_CARD_CACHE_TIMEOUT = config('POST_CARD_CACHE_TIMEOUT', default=60 * 60 * 24, cast=int)  # 投稿カードの描画結果をキャッシュする秒数
+PROFILE_CACHE_TIMEOUT = config('PROFILE_CACHE_TIMEOUT', default=300, cast=int)  # request.profile 用にプロフィールをキャッシュする秒数（共有キャッシュ使用時のみ）
+DASHBOARD_STATS_CACHE_TIMEOUT = config('DASHBOARD_STATS_CACHE_TIMEOUT', default=60, cast=int)  # 管理ダッシュボードの集計値をキャッシュする秒数
+
+# 最終アクセス時刻の記録設定
+LAST_SEEN_WRITE_THRESHOLD = config('LAST_SEEN_WRITE_THRESHOLD', default=60, cast=int)  # 同一ユーザーの再記録を抑止する秒数
+LAST_SEEN_FLUSH_INTERVAL = config('LAST_SEEN_FLUSH_INTERVAL', default=30, cast=int)  # データベースへ一括書き込みする間隔（秒）
+
+# オンラインユーザー（プレゼンス）設定
+# 'core.presence.RedisPresenceBackend' を指定する場合は PRESENCE_REDIS_URL も設定
+PRESENCE_BACKEND = config('PRESENCE_BACKEND', default='core.presence.CachePresenceBackend')
+PRESENCE_REDIS_URL = config('PRESENCE_REDIS_URL', default='')
+PRESENCE_ONLINE_WINDOW = config('PRESENCE_ONLINE_WINDOW', default=300, cast=int)  # オンラインとみなす秒数
+
+# リアルタイム配信（Server-Sent Events）設定
+# ASGIサーバー（/api/events/）を起動する場合は 'core.events.RedisBroker' と EVENT_BROKER_URL が必須
+EVENT_STREAM_ENABLED = config('EVENT_STREAM_ENABLED', default=False, cast=bool)  # /api/events/ をASGIサーバーで提供している場合のみTrue（Falseならクライアントは接続せずポーリングのみ）
+EVENT_BROKER = config('EVENT_BROKER', default='core.events.InProcessBroker')
+EVENT_BROKER_URL = config('EVENT_BROKER_URL', default='')
+EVENT_STREAM_KEEPALIVE = 25  # キープアライブ送信間隔（秒）
+EVENT_STREAM_RETRY_MS = 5000  # クライアントの再接続待ち時間（ミリ秒）
+EVENT_STREAM_QUEUE_SIZE = 100  # 購読者ごとの未送信イベントの上限
+
 # ファイルアップロード設定
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
+# 一括ロール変更フォームはユーザー1人につき2項目を送るため、既定の1000項目では足りない
+DATA_UPLOAD_MAX_NUMBER_FIELDS = config('DATA_UPLOAD_MAX_NUMBER_FIELDS', default=5000, cast=int)
+
+# 投稿画像のレンディション幅（px）。WebP/JPEG を各幅で生成し srcset で配信
+POST_IMAGE_RENDITION_WIDTHS = (320, 640, 1280)
+
+# ジョブキュー設定（manage.py run_worker で処理）
+TASK_QUEUE_EAGER = config('TASK_QUEUE_EAGER', default=False, cast=bool)  # Trueならワーカーを使わずコミット後にその場で実行（DEBUG とは連動しない）
+TASK_MAX_ATTEMPTS = config('TASK_MAX_ATTEMPTS', default=3, cast=int)  # 失敗時の最大試行回数
+TASK_RETRY_BACKOFF = config('TASK_RETRY_BACKOFF', default=30, cast=int)  # 再試行までの基準待機秒数（試行ごとに倍増）
+TASK_VISIBILITY_TIMEOUT = config('TASK_VISIBILITY_TIMEOUT', default=300, cast=int)  # 実行中ジョブを再取得するまでの秒数
 
 # 外部API設定
 # OpenWeatherMap API
 OPENWEATHER_API_KEY = config(
     'OPENWEATHER_API_KEY', 
     default='40c2e9c8a8ea9c1bba456b9fa3e8b7dd'  # 開発用デフォルトキー（本番では環境変数で設定）
-)
\ No newline at end of file
+)
+
+# 天気情報キャッシュ設定
+WEATHER_CACHE_GRID = config('WEATHER_CACHE_GRID', default=0.05, cast=float)  # キャッシュキーに使う座標の丸め単位（度）
+WEATHER_CACHE_TTL = config('WEATHER_CACHE_TTL', default=60 * 10, cast=int)  # 天気情報の鮮度（秒）
+WEATHER_STALE_TTL = config('WEATHER_STALE_TTL', default=60 * 30, cast=int)  # 期限切れ後もstale値として返す時間（秒）
+GEOCODE_USE_NOMINATIM = config('GEOCODE_USE_NOMINATIM', default=False, cast=bool)  # 同梱データに加えてNominatimで地名を補完するか
+GEOCODE_CACHE_TTL = config('GEOCODE_CACHE_TTL', default=60 * 60 * 24 * 30, cast=int)  # 地名情報の鮮度（秒）
+WEATHER_REFRESH_LOCK_TIMEOUT = 30  # バックグラウンド再取得の重複防止ロック（秒）
+WEATHER_SINGLE_FLIGHT_WAIT = 15  # 同時リクエストが先行呼び出しを待つ上限（秒）
+WEATHER_REQUEST_DEADLINE = config('WEATHER_REQUEST_DEADLINE', default=4.0, cast=float)  # 1リクエストで上流APIに使える合計時間（秒）
+WEATHER_CONNECT_TIMEOUT = 3.0  # 上流APIへの接続タイムアウト（秒）
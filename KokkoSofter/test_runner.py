@@ -0,0 +1,35 @@
+"""
+テストランナー
+
+- CACHE_URL の設定（本番の既定は Redis）に関係なく、テスト中のキャッシュは
+  プロセス内メモリに置き換える
+- ユーザー作成時のアバター生成などのファイルが実際の media/ に残らないよう、
+  MEDIA_ROOT を一時ディレクトリに置き換え、終了時に削除する
+"""
+import shutil
+import tempfile
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'kokkosofter-test',
+        'KEY_PREFIX': 'kokkosofter',
+    },
+}
+
+
+class TestRunner(DiscoverRunner):
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._media_root = tempfile.mkdtemp(prefix='kokkosofter-test-media-')
+        self._settings_override = override_settings(CACHES=TEST_CACHES, MEDIA_ROOT=self._media_root)
+        self._settings_override.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._settings_override.disable()
+        shutil.rmtree(self._media_root, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
@@ -0,0 +1,120 @@
+"""
+アバター画像の処理と自動生成
+
+保存するファイル名は内容のハッシュにするため、同じURLの中身が変わることはなく、
+nginx で長期キャッシュ（immutable）を指定して配信できる
+"""
+import hashlib
+import random
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.templatetags.static import static
+from PIL import Image, ImageDraw, ImageOps
+
+from core.imaging import encode, open_normalized
+
+AVATAR_SIZES = {
+    'large': 256,  # プロフィール設定など大きく表示する場所
+    'small': 128,  # タイムライン・サイドバー（w-16 まで）
+}
+PROCESSED_DIR = 'avatars/processed'
+GENERATED_DIR = 'avatars/generated'
+DEFAULT_AVATAR = 'images/default-avatar.png'
+
+IDENTICON_GRID = 5
+IDENTICON_BACKGROUND = (240, 240, 240)
+
+
+def _save_content_addressed(name, data):
+    """同名ファイルがあれば内容も同じなので、書き込まずにそのまま使う"""
+    if not default_storage.exists(name):
+        name = default_storage.save(name, ContentFile(data))
+    return name
+
+
+def _digest(data):
+    return hashlib.sha256(data).hexdigest()[:20]
+
+
+def sized_avatar_name(name, size):
+    """処理済みアバターのファイル名から指定サイズ版のファイル名を求める"""
+    if not name.startswith(PROCESSED_DIR + '/'):
+        return None
+    return name.replace(f"-{AVATAR_SIZES['large']}.", f"-{AVATAR_SIZES[size]}.")
+
+
+def process_avatar(profile):
+    """
+    アップロードされたアバターを正方形に切り抜き、固定サイズの JPEG で置き換える
+
+    大きいサイズの内容ハッシュを共通のファイル名に使い、
+    avatars/processed/<hash>-256.jpg と <hash>-128.jpg を保存する
+    """
+    if not profile.avatar:
+        return
+
+    original_name = profile.avatar.name
+    if sized_avatar_name(original_name, 'large'):
+        return  # 処理済み
+
+    image = open_normalized(profile.avatar)
+    side = min(image.width, image.height)
+    square = ImageOps.fit(image, (side, side))
+
+    encoded = {
+        size: encode(square.resize((pixels, pixels), Image.Resampling.LANCZOS), 'jpeg')
+        for size, pixels in AVATAR_SIZES.items()
+    }
+    digest = _digest(encoded['large'])
+    names = {
+        size: _save_content_addressed(f'{PROCESSED_DIR}/{digest}-{AVATAR_SIZES[size]}.jpg', data)
+        for size, data in encoded.items()
+    }
+    default_storage.delete(original_name)
+
+    profile.avatar.name = names['large']
+    profile.save(update_fields=['avatar'])
+
+
+def render_identicon(seed, size=AVATAR_SIZES['large']):
+    """シード文字列から左右対称のアイデンティコン（PNG）を生成する"""
+    digest = hashlib.sha256(seed.encode()).digest()
+    rng = random.Random(digest)
+    color = (64 + digest[0] % 160, 64 + digest[1] % 160, 64 + digest[2] % 160)
+
+    cell = size // (IDENTICON_GRID + 1)
+    margin = (size - cell * IDENTICON_GRID) // 2
+    image = Image.new('P', (size, size))
+    image.putpalette(IDENTICON_BACKGROUND + color)
+    draw = ImageDraw.Draw(image)
+
+    half = (IDENTICON_GRID + 1) // 2
+    for row in range(IDENTICON_GRID):
+        for col in range(half):
+            if rng.random() < 0.5:
+                continue
+            for x in {col, IDENTICON_GRID - 1 - col}:
+                left = margin + x * cell
+                top = margin + row * cell
+                draw.rectangle([left, top, left + cell - 1, top + cell - 1], fill=1)
+
+    buffer = BytesIO()
+    image.save(buffer, 'PNG', optimize=True)
+    return buffer.getvalue()
+
+
+def generate_default_avatar(profile):
+    """アップロード画像のないユーザー用のアバターを生成して保存する"""
+    data = render_identicon(f'user:{profile.user_id}')
+    name = _save_content_addressed(f'{GENERATED_DIR}/{_digest(data)}.png', data)
+    if profile.generated_avatar != name:
+        # 保存中のインスタンスにも反映し、後続の save() で上書きされないようにする
+        profile.generated_avatar = name
+        profile.save(update_fields=['generated_avatar'])
+    return name
+
+
+def default_avatar_url():
+    return static(DEFAULT_AVATAR)
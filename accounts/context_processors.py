@@ -0,0 +1,14 @@
+from .permissions import load_profile
+
+
+def capabilities(request):
+    """
+    テンプレートから権限（capabilities）を参照できるようにする
+
+    ページ描画時はテンプレートが user.profile を何度も参照するため、
+    先に（共有キャッシュがあればキャッシュから）読み込んで user に紐付けておく
+    """
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        load_profile(user)
+    return {'capabilities': getattr(request, 'capabilities', None)}
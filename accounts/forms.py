@@ -153,11 +153,7 @@ class AdminUserCreateForm(UserCreationForm):
         user.is_active = self.cleaned_data['is_active']
         if commit:
             user.save()
-            # ユーザープロフィールを自動作成（デフォルトロール: member）
-            profile, created = UserProfile.objects.get_or_create(user=user)
-            if created:
-                profile.role = 'member'
-                profile.save()
+            # プロフィールは User の post_save で作成される（デフォルトロール: member）
         return user
 
 class AdminUserCreateFormWithRole(UserCreationForm):
@@ -244,10 +240,10 @@ class AdminUserCreateFormWithRole(UserCreationForm):
         user.is_active = self.cleaned_data['is_active']
         if commit:
             user.save()
-            # ユーザープロフィールを作成してロールを設定
+            # post_save で作成されたプロフィールにロールを設定
             profile, created = UserProfile.objects.get_or_create(user=user)
             profile.role = self.cleaned_data['role']
-            profile.save()
+            profile.save_if_changed()
         return user
 
 class AdminUserEditForm(forms.ModelForm):
@@ -0,0 +1,139 @@
+"""
+最終アクセス時刻（UserProfile.last_seen）の間引き・一括書き込み
+
+リクエストごとにUPDATEを発行する代わりに、アクティビティをキャッシュに記録し、
+一定間隔で溜まった時刻を1回のUPDATEでまとめてデータベースへ反映する。
+
+記録は1件ごとに別のキー（世代:連番）へ書き込むため、複数のワーカーが同時に
+記録しても互いの記録を上書きしない。連番はキャッシュの incr で採番する。
+フラッシュ時は世代番号を incr で進めて（以降の記録は次の世代に入る）
+閉じた世代の記録を読み出す。世代を切り替える直前に書き込まれた記録も
+失われないよう、直前の世代は次回のフラッシュでもう一度確認する
+"""
+from django.conf import settings
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils import timezone
+
+from core.cache import CacheNamespace
+
+GENERATION_KEY = 'generation'
+FLUSH_LOCK_KEY = 'flush_lock'
+FLUSHING_KEY = 'flushing'
+FLUSH_BATCH_SIZE = 500
+ENTRY_TIMEOUT = 60 * 60 * 24  # 取り残された記録が消えるまでの秒数
+
+last_seen_cache = CacheNamespace('last_seen', timeout=ENTRY_TIMEOUT)
+
+
+def _recorded_key(user_id):
+    return f'recorded:{user_id}'
+
+
+def _count_key(generation):
+    return f'count:{generation}'
+
+
+def _done_key(generation):
+    return f'done:{generation}'
+
+
+def _slot_key(generation, number):
+    return f'slot:{generation}:{number}'
+
+
+def _current_generation():
+    generation = last_seen_cache.get(GENERATION_KEY)
+    if generation is None:
+        last_seen_cache.add(GENERATION_KEY, 1, timeout=None)
+        generation = last_seen_cache.get(GENERATION_KEY, 1)
+    return generation
+
+
+def _incr(key):
+    """キーがなければ0で作成してから加算する"""
+    try:
+        return last_seen_cache.incr(key)
+    except ValueError:
+        last_seen_cache.add(key, 0)
+        return last_seen_cache.incr(key)
+
+
+def record_activity(user_id, now=None):
+    """
+    ユーザーのアクティビティを記録する
+
+    前回の記録から LAST_SEEN_WRITE_THRESHOLD 秒以内であれば何もしない。
+    記録した場合は True を返す
+    """
+    now = now or timezone.now()
+
+    # cache.add はキーが存在しない場合のみ成功するため、閾値内の再記録を原子的に防げる
+    if not last_seen_cache.add(_recorded_key(user_id), now, timeout=settings.LAST_SEEN_WRITE_THRESHOLD):
+        return False
+
+    generation = _current_generation()
+    number = _incr(_count_key(generation))
+    last_seen_cache.set(_slot_key(generation, number), (user_id, now))
+
+    # 前回のフラッシュから一定時間経過していればこのリクエストで書き込む
+    if last_seen_cache.add(FLUSH_LOCK_KEY, True, timeout=settings.LAST_SEEN_FLUSH_INTERVAL):
+        flush_pending()
+    return True
+
+
+def _collect(generation):
+    """世代内の未処理の記録を {user_id: 最新の時刻} で返し、処理済みの位置を進める"""
+    count = last_seen_cache.get(_count_key(generation), 0)
+    done = last_seen_cache.get(_done_key(generation), 0)
+    if count <= done:
+        return {}
+
+    numbers = range(done + 1, count + 1)
+    found = last_seen_cache.get_many([_slot_key(generation, number) for number in numbers])
+
+    pending = {}
+    for number in numbers:
+        entry = found.get(_slot_key(generation, number))
+        if entry is None:
+            # 採番直後でまだ書き込まれていない記録。次回のフラッシュで読む
+            break
+        user_id, seen_at = entry
+        if user_id not in pending or pending[user_id] < seen_at:
+            pending[user_id] = seen_at
+        done = number
+
+    last_seen_cache.set(_done_key(generation), done)
+    last_seen_cache.delete_many([_slot_key(generation, number) for number in range(numbers.start, done + 1)])
+    return pending
+
+
+def flush_pending():
+    """溜まっている最終アクセス時刻を一括でデータベースに書き込み、更新件数を返す"""
+    from .models import UserProfile
+
+    # 同時に複数のプロセスがフラッシュしないようにする
+    if not last_seen_cache.add(FLUSHING_KEY, True, timeout=60):
+        return 0
+    try:
+        # 世代を進めて以降の記録を次の世代に振り分け、閉じた世代と直前の世代を読み出す
+        closed = _incr(GENERATION_KEY) - 1
+        pending = {}
+        for generation in (closed - 1, closed):
+            for user_id, seen_at in _collect(generation).items():
+                if user_id not in pending or pending[user_id] < seen_at:
+                    pending[user_id] = seen_at
+    finally:
+        last_seen_cache.delete(FLUSHING_KEY)
+
+    items = list(pending.items())
+    updated = 0
+    for i in range(0, len(items), FLUSH_BATCH_SIZE):
+        batch = items[i:i + FLUSH_BATCH_SIZE]
+        last_seen = Case(
+            *[When(user_id=user_id, then=Value(seen_at)) for user_id, seen_at in batch],
+            output_field=DateTimeField(),
+        )
+        updated += UserProfile.objects.filter(
+            user_id__in=[user_id for user_id, _ in batch]
+        ).update(last_seen=last_seen)
+    return updated
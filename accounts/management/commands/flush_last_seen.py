@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.last_seen import flush_pending
+from core.cache import is_shared_cache
+
+
+class Command(BaseCommand):
+    help = 'キャッシュに溜まっている最終アクセス時刻をデータベースへ一括で書き込みます'
+
+    def handle(self, *args, **options):
+        # プロセス内キャッシュでは Web ワーカーの記録がこのプロセスから見えない
+        if not is_shared_cache():
+            raise CommandError('共有キャッシュ（CACHE_URL に redis:// など）を設定してください')
+        updated = flush_pending()
+        self.stdout.write(self.style.SUCCESS(f'{updated}件のプロフィールの最終アクセス時刻を更新しました'))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from accounts.avatars import PROCESSED_DIR, generate_default_avatar, process_avatar
+from accounts.models import UserProfile
+
+
+class Command(BaseCommand):
+    help = '自動生成アバターの作成と、未処理のアップロードアバターの変換を行います（既存データの移行用）'
+
+    def handle(self, *args, **options):
+        generated = 0
+        for profile in UserProfile.objects.filter(generated_avatar='').iterator():
+            generate_default_avatar(profile)
+            generated += 1
+
+        processed = 0
+        uploads = (
+            UserProfile.objects.exclude(avatar='').exclude(avatar__isnull=True)
+            .exclude(avatar__startswith=PROCESSED_DIR + '/')
+        )
+        for profile in uploads.iterator():
+            try:
+                process_avatar(profile)
+                processed += 1
+            except Exception as e:
+                self.stderr.write(f'{profile.user_id} のアバター処理に失敗しました: {e}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'アバターを{generated}件生成し、アップロード画像を{processed}件変換しました'
+        ))
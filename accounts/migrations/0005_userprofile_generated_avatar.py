@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_userprofile_last_seen'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='generated_avatar',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:39
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_userprofile_generated_avatar'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        # auth_user を変更する標準マイグレーションの後に索引を作成する（SQLiteではテーブル再作成で消えるため）
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userprofile',
+            index=models.Index(fields=['-last_seen'], name='accounts_profile_last_seen_idx'),
+        ),
+        # auth_user は標準モデルのため Meta で指定できない。管理画面の新規ユーザー一覧（date_joined の降順）用
+        migrations.RunSQL(
+            'CREATE INDEX IF NOT EXISTS accounts_auth_user_date_joined_idx ON auth_user (date_joined DESC);',
+            'DROP INDEX IF EXISTS accounts_auth_user_date_joined_idx;',
+        ),
+    ]
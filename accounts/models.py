@@ -2,8 +2,11 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 from django.dispatch import receiver
+from django.core.files.storage import default_storage
 from django.utils import timezone
 
+from . import avatars
+
 class UserProfile(models.Model):
     # ロール選択肢（簡素化）
     ROLE_CHOICES = [
@@ -14,6 +17,8 @@ class UserProfile(models.Model):
     
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     avatar = models.ImageField(upload_to='avatars/', null=True, blank=True, verbose_name='アバター画像')
+    # アップロード画像がない場合に表示する自動生成アバター（accounts.avatars）
+    generated_avatar = models.CharField(max_length=255, blank=True, editable=False)
     bio = models.TextField(max_length=500, blank=True, verbose_name='自己紹介')
     role = models.CharField(
         max_length=20, 
@@ -25,15 +30,71 @@ class UserProfile(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # オンラインユーザーの範囲検索（last_seen >= 一定時刻前）
+            models.Index(fields=['-last_seen'], name='accounts_profile_last_seen_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.username}のプロフィール"
 
-    def get_avatar_url(self):
-        """アバター画像のURLを取得（デフォルト画像を含む）"""
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # 変更のあった項目だけを保存できるよう、読み込んだ時点の値を控えておく
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            saved = [field.attname for field in self._meta.concrete_fields if field.attname in self.__dict__]
+        else:
+            saved = [self._meta.get_field(name).attname for name in update_fields]
+        loaded = getattr(self, '_loaded_values', {})
+        loaded.update({attname: self._get_raw_value(attname) for attname in saved})
+        self._loaded_values = loaded
+
+    def _get_raw_value(self, attname):
+        value = getattr(self, attname)
+        # FieldFile は保存されているファイル名で比較する
+        return getattr(value, 'name', value)
+
+    def get_dirty_fields(self):
+        """読み込み後に値が変わった項目名のリスト（未保存のインスタンスは全項目）"""
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None or self._state.adding:
+            return [field.attname for field in self._meta.concrete_fields if not field.primary_key]
+        return [
+            attname for attname, value in loaded.items()
+            if attname in self.__dict__ and self._get_raw_value(attname) != value
+        ]
+
+    def save_if_changed(self):
+        """変更された項目だけを保存する。保存したかどうかを返す"""
+        if self._state.adding:
+            self.save()
+            return True
+        dirty = self.get_dirty_fields()
+        if not dirty:
+            return False
+        self.save(update_fields=[*dirty, 'updated_at'])
+        return True
+
+    def get_avatar_url(self, size='large'):
+        """アバター画像のURLを取得（自動生成・デフォルト画像を含む）"""
         if self.avatar:
-            return self.avatar.url
-        # デフォルトのアバター画像URLを返す
-        return f"https://i.pravatar.cc/150?u={self.user.username}"
+            sized_name = avatars.sized_avatar_name(self.avatar.name, size)
+            return default_storage.url(sized_name) if sized_name else self.avatar.url
+        if self.generated_avatar:
+            return default_storage.url(self.generated_avatar)
+        return avatars.default_avatar_url()
+
+    def get_avatar_small_url(self):
+        """タイムラインやサイドバー向けの小さいアバター画像のURL"""
+        return self.get_avatar_url('small')
     
     def get_role_display_with_icon(self):
         """ロールをアイコン付きで表示"""
@@ -71,15 +132,16 @@ class UserProfile(models.Model):
         self.last_seen = timezone.now()
         self.save(update_fields=['last_seen'])
 
-# ユーザー作成時に自動でプロフィールを作成
+# ユーザー作成時にプロフィールを作成し、以降の保存では変更があった場合だけ書き込む
 @receiver(post_save, sender=User)
-def create_user_profile(sender, instance, created, **kwargs):
+def sync_user_profile(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
     if created:
-        UserProfile.objects.create(user=instance)
-
-@receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    if hasattr(instance, 'profile'):
-        instance.profile.save()
-    else:
-        UserProfile.objects.create(user=instance)
+        # 作成フォームなどが先に作っている場合もあるため get_or_create で重複を防ぐ
+        UserProfile.objects.get_or_create(user=instance)
+        return
+    # ログイン時の last_login 更新などでは、読み込み済みのプロフィールに変更がない限り何もしない
+    profile = instance._state.fields_cache.get('profile')
+    if profile is not None:
+        profile.save_if_changed()
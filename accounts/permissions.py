@@ -0,0 +1,72 @@
+"""
+リクエスト中のユーザーのプロフィールと権限
+
+ProfileMiddleware が request.profile / request.capabilities を遅延評価で設定する。
+プロフィールの読み込みは1リクエストにつき1回（1クエリ）で、権限の判定も1回だけ行う。
+
+全ワーカーで共有するキャッシュ（Redis など）がある場合はプロフィールをユーザーごとに
+キャッシュし（保存・削除・ロール一括変更時に破棄）、データベースを参照しない。
+プロセス内メモリのキャッシュでは破棄が他のワーカーに伝わらず、降格したユーザーの
+権限が有効期限まで残るため、キャッシュしない
+"""
+from django.conf import settings
+from django.utils.functional import cached_property
+
+from core.cache import CacheNamespace, is_shared_cache
+from .models import UserProfile
+
+profile_cache = CacheNamespace('profile')
+
+
+def load_profile(user):
+    """ユーザーのプロフィールを返し、user.profile からも参照できるようにする（未作成なら作成）"""
+    profile = user._state.fields_cache.get('profile')
+    if profile is not None:
+        return profile
+
+    use_cache = is_shared_cache()
+    profile = profile_cache.get(user.pk) if use_cache else None
+    if profile is None:
+        profile, created = UserProfile.objects.get_or_create(user=user)
+        if use_cache:
+            # ユーザー本体は毎回リクエストのものを紐付けるため、キャッシュには含めない
+            profile._state.fields_cache.pop('user', None)
+            profile_cache.set(user.pk, profile, timeout=settings.PROFILE_CACHE_TIMEOUT)
+    user.profile = profile
+    return profile
+
+
+def invalidate_profile(user_id):
+    profile_cache.delete(user_id)
+
+
+def invalidate_profiles(user_ids):
+    profile_cache.delete_many(user_ids)
+
+
+class RoleCapabilities:
+    """ユーザーのロールから決まる権限（各項目は最初に参照したときに一度だけ判定する）"""
+
+    def __init__(self, user, profile=None):
+        self.user = user
+        self.profile = profile
+
+    @cached_property
+    def role(self):
+        return self.profile.role if self.profile is not None else None
+
+    @cached_property
+    def is_management_role(self):
+        return self.profile is not None and self.profile.is_management_role()
+
+    @cached_property
+    def can_manage_users(self):
+        """管理ダッシュボード・ユーザー管理を利用できるか"""
+        if not self.user.is_authenticated:
+            return False
+        return self.user.is_staff or self.user.is_superuser or self.profile.can_manage_users()
+
+    @cached_property
+    def can_assign_owner(self):
+        """他のユーザーにオーナーロールを設定できるか"""
+        return self.user.is_superuser or self.role == 'owner'
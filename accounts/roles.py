@@ -0,0 +1,88 @@
+"""
+ロールの一括変更
+"""
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from .avatars import generate_default_avatar
+from .models import UserProfile
+from .signals import roles_changed
+
+VALID_ROLES = dict(UserProfile.ROLE_CHOICES)
+
+
+def bulk_update_roles(user_roles):
+    """
+    {user_id: 新しいロール} をまとめて適用し、ユーザーごとの結果を返す
+
+    対象プロフィールを1クエリで取得して差分を求め、変更分のみを
+    1トランザクション内の bulk_update で書き込む。結果の status は
+    updated / unchanged / invalid_role / not_found のいずれか
+    """
+    requested = {}
+    for user_id, role in user_roles.items():
+        try:
+            requested[int(user_id)] = role
+        except (TypeError, ValueError):
+            continue
+
+    results = []
+    changed = []
+    with transaction.atomic():
+        profiles = {
+            profile.user_id: profile
+            for profile in UserProfile.objects.select_for_update()
+            .select_related('user').filter(user_id__in=requested)
+        }
+
+        # プロフィール未作成のユーザーはまとめて作成する
+        # bulk_create では post_save が送られないため、アバターはコミット後にここで生成する
+        # （ロック中に画像を描画しない・ロールバック時に画像ファイルを残さない）
+        created = []
+        missing_ids = requested.keys() - profiles.keys()
+        if missing_ids:
+            created = UserProfile.objects.bulk_create([
+                UserProfile(user=user) for user in User.objects.filter(id__in=missing_ids)
+            ])
+            transaction.on_commit(lambda: _generate_default_avatars(created))
+            profiles.update({profile.user_id: profile for profile in created})
+
+        now = timezone.now()
+        for user_id, role in requested.items():
+            profile = profiles.get(user_id)
+            if profile is None:
+                results.append({'user_id': user_id, 'username': None, 'status': 'not_found'})
+                continue
+
+            result = {
+                'user_id': user_id,
+                'username': profile.user.username,
+                'old_role': profile.role,
+                'new_role': role,
+            }
+            if role not in VALID_ROLES:
+                result['status'] = 'invalid_role'
+            elif profile.role == role:
+                result['status'] = 'unchanged'
+            else:
+                profile.role = role
+                profile.updated_at = now
+                changed.append(profile)
+                result['status'] = 'updated'
+            results.append(result)
+
+        if changed:
+            UserProfile.objects.bulk_update(changed, ['role', 'updated_at'], batch_size=500)
+
+        # bulk_create / bulk_update は post_save を送らないため、キャッシュの無効化用に通知する
+        changed_ids = sorted({profile.user_id for profile in changed} | {profile.user_id for profile in created})
+        if changed_ids:
+            transaction.on_commit(lambda: roles_changed.send(sender=UserProfile, user_ids=changed_ids))
+
+    return results
+
+
+def _generate_default_avatars(profiles):
+    for profile in profiles:
+        generate_default_avatar(profile)
@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# ロールが一括変更されたときに送信される（sender=UserProfile, user_ids）
+# bulk_update では post_save が送られないため、キャッシュの無効化に使う
+roles_changed = Signal()
@@ -0,0 +1,12 @@
+from core.jobs import task
+
+from .avatars import process_avatar
+from .models import UserProfile
+
+
+@task
+def process_avatar_image(profile_id):
+    """アップロードされたアバター画像を正規化"""
+    profile = UserProfile.objects.filter(pk=profile_id).first()
+    if profile is not None and profile.avatar:
+        process_avatar(profile)
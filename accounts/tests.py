@@ -1,3 +1,514 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from core import cache as cache_module
+from core.middleware import ProfileMiddleware
+from posts import fragments
+from posts.models import Post
+from . import avatars, last_seen, roles
+from .models import UserProfile
+from .permissions import RoleCapabilities, load_profile, profile_cache
+from .signals import roles_changed
+from .views import _filter_admin_users
+
+WRITE_PREFIXES = ('INSERT', 'UPDATE', 'DELETE')
+
+
+def use_shared_cache(test_case):
+    """
+    テスト中のキャッシュ（locmem）を、ワーカー間で共有されるキャッシュとして扱わせる
+
+    locmem はプロセス内では add / incr が不可分なので、Redis / Memcached の代わりになる
+    """
+    patcher = mock.patch.object(cache_module, 'SHARED_CACHE_BACKENDS', (LocMemCache,))
+    patcher.start()
+    test_case.addCleanup(patcher.stop)
+    cache.clear()
+    test_case.addCleanup(cache.clear)
+
+
+def profile_writes(queries):
+    return [
+        query['sql'] for query in queries
+        if query['sql'].startswith(WRITE_PREFIXES) and '"accounts_userprofile"' in query['sql']
+    ]
+
+
+class UserProfileSignalTests(TestCase):
+    """User 保存時のプロフィール作成・保存を確認"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('alice', password='password123')
+
+    def test_profile_created_once(self):
+        self.assertEqual(UserProfile.objects.filter(user=self.user).count(), 1)
+
+        # 既存ユーザーの再保存ではプロフィールを作り直さない
+        self.user.first_name = 'Alice'
+        self.user.save()
+        self.assertEqual(UserProfile.objects.filter(user=self.user).count(), 1)
+
+    def test_login_does_not_write_profile(self):
+        """ログイン（last_login の更新）でプロフィールへの書き込みが発生しない"""
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse('accounts:login'), {
+                'username': 'alice',
+                'password': 'password123',
+            })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(profile_writes(ctx.captured_queries), [])
+
+    def test_user_save_does_not_write_unchanged_profile(self):
+        user = User.objects.select_related('profile').get(pk=self.user.pk)
+        with CaptureQueriesContext(connection) as ctx:
+            user.is_staff = True
+            user.save()
+        self.assertEqual(profile_writes(ctx.captured_queries), [])
+
+    def test_user_save_writes_changed_profile_fields(self):
+        user = User.objects.select_related('profile').get(pk=self.user.pk)
+        user.profile.bio = 'こんにちは'
+        with CaptureQueriesContext(connection) as ctx:
+            user.save()
+
+        writes = profile_writes(ctx.captured_queries)
+        self.assertEqual(len(writes), 1)
+        self.assertNotIn('"role"', writes[0])
+        self.assertEqual(UserProfile.objects.get(user=self.user).bio, 'こんにちは')
+
+    def test_test_runner_uses_temporary_media_root(self):
+        # テスト中に作成したユーザーのアバターが実際の media/ に書き込まれない
+        self.assertFalse(default_storage.path('').startswith(str(settings.BASE_DIR / 'media')))
+
+
+@override_settings(LAST_SEEN_WRITE_THRESHOLD=60, LAST_SEEN_FLUSH_INTERVAL=30)
+class LastSeenTests(TestCase):
+    """最終アクセス時刻の記録（間引き）と一括書き込みを確認"""
+
+    def setUp(self):
+        cache.clear()
+        self.users = [User.objects.create_user(f'user{i}') for i in range(3)]
+        self.now = timezone.now().replace(microsecond=0)
+        # 記録時のフラッシュは個別に確認するため、ここでは抑止しておく
+        last_seen.last_seen_cache.add(last_seen.FLUSH_LOCK_KEY, True)
+
+    def last_seen_of(self, user):
+        return UserProfile.objects.get(user=user).last_seen
+
+    def test_record_is_throttled(self):
+        self.assertTrue(last_seen.record_activity(self.users[0].pk, now=self.now))
+        self.assertFalse(last_seen.record_activity(self.users[0].pk, now=self.now + timedelta(seconds=10)))
+        self.assertTrue(last_seen.record_activity(self.users[1].pk, now=self.now))
+
+    def test_flush_writes_all_users_in_one_update(self):
+        for user in self.users:
+            last_seen.record_activity(user.pk, now=self.now)
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(last_seen.flush_pending(), 3)
+        self.assertEqual(len(profile_writes(ctx.captured_queries)), 1)
+        for user in self.users:
+            self.assertEqual(self.last_seen_of(user), self.now)
+
+        # 書き込んだ記録は再度書き込まない
+        self.assertEqual(last_seen.flush_pending(), 0)
+
+    def test_flush_coalesces_same_user(self):
+        later = self.now + timedelta(minutes=5)
+        last_seen.record_activity(self.users[0].pk, now=later)
+        cache.delete(last_seen.last_seen_cache.key(last_seen._recorded_key(self.users[0].pk)))
+        last_seen.record_activity(self.users[0].pk, now=self.now)
+
+        self.assertEqual(last_seen.flush_pending(), 1)
+        self.assertEqual(self.last_seen_of(self.users[0]), later)
+
+    def test_records_around_flush_are_not_lost(self):
+        last_seen.record_activity(self.users[0].pk, now=self.now)
+        generation = last_seen._current_generation()
+        # 採番済みだがまだ書き込まれていない記録（別ワーカーの書き込み途中）
+        number = last_seen._incr(last_seen._count_key(generation))
+
+        self.assertEqual(last_seen.flush_pending(), 1)
+        # 世代の切り替え後に書き込まれた記録と、次の世代への記録
+        last_seen.last_seen_cache.set(last_seen._slot_key(generation, number), (self.users[1].pk, self.now))
+        last_seen.record_activity(self.users[2].pk, now=self.now)
+
+        self.assertEqual(last_seen.flush_pending(), 2)
+        self.assertEqual(self.last_seen_of(self.users[1]), self.now)
+        self.assertEqual(self.last_seen_of(self.users[2]), self.now)
+
+    def test_record_flushes_after_interval(self):
+        last_seen.last_seen_cache.delete(last_seen.FLUSH_LOCK_KEY)
+        last_seen.record_activity(self.users[0].pk, now=self.now)
+        self.assertEqual(self.last_seen_of(self.users[0]), self.now)
+
+    def test_command_requires_shared_cache(self):
+        with self.assertRaises(CommandError):
+            call_command('flush_last_seen', stdout=StringIO())
+
+    def test_command_flushes_with_shared_cache(self):
+        use_shared_cache(self)
+        last_seen.last_seen_cache.add(last_seen.FLUSH_LOCK_KEY, True)
+        last_seen.record_activity(self.users[0].pk, now=self.now)
+        out = StringIO()
+        call_command('flush_last_seen', stdout=out)
+        self.assertIn('1件', out.getvalue())
+        self.assertEqual(self.last_seen_of(self.users[0]), self.now)
+
+
+class AvatarTests(TestCase):
+    """アイデンティコンの生成とアバターの内容アドレス化（ハッシュ名での保存）を確認"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+
+    def upload(self, color):
+        buffer = BytesIO()
+        Image.new('RGB', (400, 300), color).save(buffer, 'PNG')
+        return SimpleUploadedFile('avatar.png', buffer.getvalue())
+
+    def test_identicon_is_deterministic_and_symmetric(self):
+        data = avatars.render_identicon('user:1')
+        self.assertEqual(data, avatars.render_identicon('user:1'))
+        self.assertNotEqual(data, avatars.render_identicon('user:2'))
+
+        image = Image.open(BytesIO(data))
+        self.assertEqual(image.size, (256, 256))
+        self.assertEqual(image.tobytes(), image.transpose(Image.Transpose.FLIP_LEFT_RIGHT).tobytes())
+
+    def test_generated_on_profile_creation(self):
+        user = User.objects.create_user('alice')
+        name = user.profile.generated_avatar
+        self.assertRegex(name, r'^avatars/generated/[0-9a-f]{20}\.png$')
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(user.profile.get_avatar_url(), default_storage.url(name))
+
+        # 同じユーザーなら同じ内容・同じファイル名になり、再度書き込まない
+        self.assertEqual(avatars.generate_default_avatar(user.profile), name)
+        self.assertEqual(len(default_storage.listdir('avatars/generated')[1]), 1)
+
+    def test_uploaded_avatar_is_resized_and_content_addressed(self):
+        alice = User.objects.create_user('alice').profile
+        bob = User.objects.create_user('bob').profile
+        for profile in (alice, bob):
+            profile.avatar = self.upload((10, 120, 200))
+            profile.save()
+            avatars.process_avatar(profile)
+
+        # 同じ画像は同じファイル名になり、アップロードされた原本は削除される
+        self.assertEqual(alice.avatar.name, bob.avatar.name)
+        self.assertRegex(alice.avatar.name, r'^avatars/processed/[0-9a-f]{20}-256\.jpg$')
+        self.assertEqual(default_storage.listdir('avatars')[1], [])
+
+        small = avatars.sized_avatar_name(alice.avatar.name, 'small')
+        self.assertTrue(small.endswith('-128.jpg'))
+        with default_storage.open(small) as f:
+            self.assertEqual(Image.open(f).size, (128, 128))
+        self.assertEqual(alice.get_avatar_small_url(), default_storage.url(small))
+
+        # 処理済みのアバターは再処理しない
+        name = alice.avatar.name
+        avatars.process_avatar(alice)
+        self.assertEqual(alice.avatar.name, name)
+
+
+class AdminUsersViewTests(TestCase):
+    """管理者用ユーザー一覧の検索・並び替え・ページ分割を確認"""
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser('zadmin', password='password123')
+        self.alice = User.objects.create_user('alice')
+        self.albert = User.objects.create_user('albert', is_staff=True)
+        self.alicia = User.objects.create_user('Alicia', is_active=False)
+        self.bob = User.objects.create_user('bob')
+        UserProfile.objects.filter(user=self.bob).update(role='admin')
+        self.client.force_login(self.admin)
+
+    def usernames(self, **params):
+        response = self.client.get(reverse('accounts:admin_users'), params)
+        self.assertEqual(response.status_code, 200)
+        return [user.username for user in response.context['users']]
+
+    def test_username_prefix_is_case_sensitive(self):
+        self.assertEqual(self.usernames(q='al', sort='username'), ['albert', 'alice'])
+        self.assertEqual(self.usernames(q='Al'), ['Alicia'])
+        self.assertEqual(self.usernames(q='alic'), ['alice'])
+        self.assertEqual(self.usernames(q='x'), [])
+
+    def test_username_prefix_uses_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite の実行計画のみ確認する')
+        plan = _filter_admin_users({'q': 'al'}).explain()
+        self.assertIn('SEARCH auth_user USING INDEX', plan)
+        self.assertIn('username>? AND username<?', plan)
+
+    def test_filters(self):
+        self.assertEqual(self.usernames(role='admin'), ['bob'])
+        self.assertEqual(self.usernames(active='0'), ['Alicia'])
+        self.assertEqual(self.usernames(staff='1', sort='username'), ['albert', 'zadmin'])
+        # 不正な値は無視する
+        self.assertEqual(len(self.usernames(role='unknown', active='yes')), 5)
+
+    def test_sort(self):
+        self.assertEqual(self.usernames(sort='username'), ['Alicia', 'albert', 'alice', 'bob', 'zadmin'])
+        self.assertEqual(self.usernames(sort='oldest'), ['zadmin', 'alice', 'albert', 'Alicia', 'bob'])
+        self.assertEqual(self.usernames(sort='newest'), ['bob', 'Alicia', 'albert', 'alice', 'zadmin'])
+        self.assertEqual(self.usernames(sort='invalid'), self.usernames(sort='newest'))
+
+    def test_pagination_and_post_count(self):
+        Post.objects.create(author=self.alice, content='投稿1')
+        Post.objects.create(author=self.alice, content='投稿2')
+
+        with mock.patch('accounts.views.ADMIN_USERS_PAGE_SIZE', 2):
+            response = self.client.get(reverse('accounts:admin_users'), {'sort': 'username', 'page': 2})
+            self.assertEqual([user.username for user in response.context['users']], ['alice', 'bob'])
+            self.assertEqual(response.context['page_obj'].paginator.num_pages, 3)
+            self.assertEqual(response.context['users'][0].post_count, 2)
+            self.assertEqual(response.context['users'][1].post_count, 0)
+
+            # 範囲外のページは最後のページを表示する
+            response = self.client.get(reverse('accounts:admin_users'), {'sort': 'username', 'page': 10})
+            self.assertEqual([user.username for user in response.context['users']], ['zadmin'])
+
+        self.assertEqual(response.context['stats'], {'total': 5, 'active': 4, 'staff': 2, 'superusers': 1})
+
+    def test_requires_permission(self):
+        self.client.force_login(self.alice)
+        response = self.client.get(reverse('accounts:admin_users'))
+        self.assertRedirects(response, '/', fetch_redirect_response=False)
+
+
+class BulkRoleUpdateTests(TestCase):
+    """ロールの一括変更と、roles_changed によるキャッシュの無効化を確認"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+        self.users = [User.objects.create_user(f'user{i}') for i in range(3)]
+
+    def capture_roles_changed(self):
+        received = []
+
+        def receiver(sender, user_ids, **kwargs):
+            received.append(user_ids)
+
+        roles_changed.connect(receiver)
+        self.addCleanup(roles_changed.disconnect, receiver)
+        return received
+
+    def test_results_and_single_write(self):
+        alice, bob, carol = self.users
+        with CaptureQueriesContext(connection) as queries:
+            results = roles.bulk_update_roles({
+                str(alice.pk): 'admin', bob.pk: 'member', carol.pk: 'superhero', 99999: 'admin', 'x': 'admin',
+            })
+
+        self.assertEqual({r['user_id']: r['status'] for r in results}, {
+            alice.pk: 'updated', bob.pk: 'unchanged', carol.pk: 'invalid_role', 99999: 'not_found',
+        })
+        self.assertEqual(
+            dict(UserProfile.objects.values_list('user__username', 'role')),
+            {'user0': 'admin', 'user1': 'member', 'user2': 'member'},
+        )
+        self.assertEqual(len(profile_writes(queries.captured_queries)), 1)
+
+    def test_roles_changed_sent_after_commit(self):
+        received = self.capture_roles_changed()
+        alice, bob, _ = self.users
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            roles.bulk_update_roles({alice.pk: 'admin', bob.pk: 'member'})
+            self.assertEqual(received, [])
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(received, [[alice.pk]])
+
+        # 変更がなければ通知しない
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            roles.bulk_update_roles({alice.pk: 'admin'})
+        self.assertEqual(callbacks, [])
+
+    def test_roles_changed_invalidates_caches(self):
+        use_shared_cache(self)
+        alice = self.users[0]
+        load_profile(User.objects.get(pk=alice.pk))
+        self.assertIsNotNone(profile_cache.get(alice.pk))
+        fragments.bump_user(alice.pk)
+        version = fragments.versions_cache.get(f'user:{alice.pk}')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            roles.bulk_update_roles({alice.pk: 'admin'})
+
+        self.assertIsNone(profile_cache.get(alice.pk))
+        self.assertGreater(fragments.versions_cache.get(f'user:{alice.pk}'), version)
+        self.assertEqual(load_profile(User.objects.get(pk=alice.pk)).role, 'admin')
+
+    def test_missing_profile_created_with_avatar(self):
+        received = self.capture_roles_changed()
+        alice, bob, _ = self.users
+        UserProfile.objects.filter(user__in=[alice, bob]).delete()
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            results = roles.bulk_update_roles({alice.pk: 'admin', bob.pk: 'member'})
+
+        self.assertEqual([r['status'] for r in results], ['updated', 'unchanged'])
+        # アバターはトランザクション内（ロック中）ではなくコミット後に生成する
+        self.assertFalse(UserProfile.objects.filter(user__in=[alice, bob]).exclude(generated_avatar='').exists())
+        for callback in callbacks:
+            callback()
+        for user in (alice, bob):
+            profile = UserProfile.objects.get(user=user)
+            self.assertTrue(profile.generated_avatar)
+            self.assertTrue(default_storage.exists(profile.generated_avatar))
+        # 作成しただけのプロフィールも無効化の対象にする
+        self.assertEqual(received, [sorted([alice.pk, bob.pk])])
+
+    def test_rollback_leaves_no_generated_avatar(self):
+        alice = self.users[0]
+        UserProfile.objects.filter(user=alice).delete()
+
+        with mock.patch.object(roles, 'generate_default_avatar') as generate:
+            with self.captureOnCommitCallbacks(execute=True):
+                with mock.patch.object(UserProfile.objects, 'bulk_update', side_effect=RuntimeError):
+                    with self.assertRaises(RuntimeError):
+                        roles.bulk_update_roles({alice.pk: 'admin'})
+
+        generate.assert_not_called()
+        self.assertFalse(UserProfile.objects.filter(user=alice).exists())
+
+    def test_view(self):
+        admin = User.objects.create_superuser('admin', password='password123')
+        self.client.force_login(admin)
+        alice, bob, _ = self.users
+        response = self.client.post(reverse('accounts:admin_bulk_role_management'), {
+            f'role_{alice.pk}': 'admin', f'role_{bob.pk}': 'unknown',
+        })
+        self.assertRedirects(response, reverse('accounts:admin_bulk_role_management'), fetch_redirect_response=False)
+        self.assertEqual(UserProfile.objects.get(user=alice).role, 'admin')
+        self.assertEqual(UserProfile.objects.get(user=bob).role, 'member')
+
+
+class ProfileMiddlewareTests(TestCase):
+    """request.profile / request.capabilities の遅延読み込みとプロフィールのキャッシュを確認"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('alice')
+        self.factory = RequestFactory()
+
+    def make_request(self, user):
+        request = self.factory.get('/')
+        # 別リクエストとして、プロフィールを紐付けていないユーザーを使う
+        request.user = User.objects.get(pk=user.pk) if user.is_authenticated else user
+        ProfileMiddleware(lambda request: None).process_request(request)
+        return request
+
+    def test_lazy_single_query(self):
+        request = self.make_request(self.user)
+        with self.assertNumQueries(1):
+            self.assertEqual(request.profile.role, 'member')
+            self.assertFalse(request.capabilities.can_manage_users)
+            self.assertEqual(request.user.profile.bio, '')
+
+    def test_not_loaded_when_unused(self):
+        with self.assertNumQueries(1):  # ユーザーの取得のみ
+            self.make_request(self.user)
+
+    def test_anonymous(self):
+        request = self.make_request(AnonymousUser())
+        self.assertIsNone(request.profile)
+        self.assertFalse(request.capabilities.can_manage_users)
+        self.assertFalse(request.capabilities.can_assign_owner)
+
+    def test_not_cached_without_shared_cache(self):
+        # プロセス内メモリのキャッシュは他のワーカーで破棄されないため使わない
+        self.make_request(self.user).profile.role
+        self.assertIsNone(profile_cache.get(self.user.pk))
+        request = self.make_request(self.user)
+        with self.assertNumQueries(1):
+            request.profile.role
+
+    def test_cached_with_shared_cache(self):
+        use_shared_cache(self)
+        self.make_request(self.user).profile.role
+        request = self.make_request(self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(request.profile.role, 'member')
+            self.assertEqual(request.user.profile.user, request.user)
+
+    def test_demotion_invalidates_cached_profile(self):
+        use_shared_cache(self)
+        UserProfile.objects.filter(user=self.user).update(role='admin')
+        self.assertTrue(self.make_request(self.user).capabilities.can_manage_users)
+
+        profile = UserProfile.objects.get(user=self.user)
+        profile.role = 'member'
+        profile.save()
+        self.assertIsNone(profile_cache.get(self.user.pk))
+        self.assertFalse(self.make_request(self.user).capabilities.can_manage_users)
+
+
+class RoleCapabilitiesTests(TestCase):
+    """ロール・スタッフ権限から決まる capabilities を確認"""
+
+    def capabilities(self, username, role='member', **extra):
+        user = User.objects.create_user(username, **extra)
+        UserProfile.objects.filter(user=user).update(role=role)
+        return RoleCapabilities(user, UserProfile.objects.get(user=user))
+
+    def test_roles(self):
+        member = self.capabilities('member')
+        self.assertEqual(member.role, 'member')
+        self.assertFalse(member.is_management_role)
+        self.assertFalse(member.can_manage_users)
+        self.assertFalse(member.can_assign_owner)
+
+        admin = self.capabilities('admin', role='admin')
+        self.assertTrue(admin.is_management_role)
+        self.assertTrue(admin.can_manage_users)
+        self.assertFalse(admin.can_assign_owner)
+
+        owner = self.capabilities('owner', role='owner')
+        self.assertTrue(owner.can_manage_users)
+        self.assertTrue(owner.can_assign_owner)
+
+    def test_staff_and_superuser(self):
+        staff = self.capabilities('staff', is_staff=True)
+        self.assertTrue(staff.can_manage_users)
+        self.assertFalse(staff.can_assign_owner)
+
+        superuser = self.capabilities('superuser', is_superuser=True)
+        self.assertTrue(superuser.can_manage_users)
+        self.assertTrue(superuser.can_assign_owner)
+
+    def test_evaluated_once(self):
+        capabilities = self.capabilities('admin', role='admin')
+        self.assertTrue(capabilities.can_manage_users)
+        capabilities.profile.role = 'member'
+        self.assertTrue(capabilities.can_manage_users)
@@ -1,5 +1,5 @@
 from .views import (
-    CustomLoginView, profile_settings, admin_dashboard, admin_users,
+    CustomLoginView, profile_settings, admin_dashboard, admin_dashboard_activity, admin_users,
     admin_create_user, admin_toggle_user_status, admin_toggle_staff_status,
     admin_edit_user, admin_delete_user, admin_change_user_role, admin_bulk_role_management
 )
@@ -16,6 +16,7 @@ urlpatterns = [
     
     # 管理者専用URL
     path('admin-dashboard/', admin_dashboard, name='admin_dashboard'),
+    path('admin-dashboard/activity/', admin_dashboard_activity, name='admin_dashboard_activity'),
     path('admin-users/', admin_users, name='admin_users'),
     path('admin-create-user/', admin_create_user, name='admin_create_user'),
     path('admin-edit-user/<int:user_id>/', admin_edit_user, name='admin_edit_user'),
@@ -5,10 +5,15 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import UserCreationForm
-from django.db.models import Count
+from django.core.paginator import Paginator
+from django.db.models import Count, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST
 from functools import wraps
+from core import dashboard, jobs
+from . import tasks
+from .roles import bulk_update_roles
 from .models import UserProfile
 from .forms import UserProfileForm, UserUpdateForm, AdminUserCreateForm, AdminUserEditForm, AdminUserProfileForm
 
@@ -19,11 +24,8 @@ def role_management_required(view_func):
         if not request.user.is_authenticated:
             return redirect('login')
         
-        # プロフィールがない場合は作成
-        profile, created = UserProfile.objects.get_or_create(user=request.user)
-        
-        # 管理者権限またはロール管理権限をチェック
-        if not (request.user.is_staff or profile.can_manage_users()):
+        # 管理者権限またはロール管理権限をチェック（ProfileMiddleware が1リクエストに1度だけ判定）
+        if not request.capabilities.can_manage_users:
             messages.error(request, 'この機能を利用する権限がありません。')
             return redirect('/')
         
@@ -45,7 +47,9 @@ def profile_settings(request):
         
         if user_form.is_valid() and profile_form.is_valid():
             user_form.save()
-            profile_form.save()
+            profile = profile_form.save()
+            if 'avatar' in profile_form.changed_data and profile.avatar:
+                jobs.enqueue(tasks.process_avatar_image, profile.pk)
             messages.success(request, 'プロフィールが更新されました。')
             return redirect('accounts:profile_settings')
     else:
@@ -59,48 +63,115 @@ def profile_settings(request):
     }
     return render(request, 'accounts/profile_settings.html', context)
 
+DASHBOARD_ACTIVITY_DAYS = 14  # ダッシュボードに表示する日別アクティビティの日数
+
+
 @role_management_required
 def admin_dashboard(request):
     """管理者用ダッシュボード"""
-    # 統計情報を取得
-    total_users = User.objects.count()
-    active_users = User.objects.filter(is_active=True).count()
-    staff_users = User.objects.filter(is_staff=True).count()
-    superusers = User.objects.filter(is_superuser=True).count()
-    
-    # 投稿数も取得（postsアプリが存在する場合）
-    try:
-        from posts.models import Post
-        total_posts = Post.objects.count()
-        recent_posts = Post.objects.order_by('-created_at')[:5]
-    except ImportError:
-        total_posts = 0
-        recent_posts = []
-    
+    from posts.models import Post
+
+    # 件数の統計は1回の集計でまとめて求め、短時間キャッシュする
+    stats = dashboard.get_stats()
+
+    recent_posts = Post.objects.select_related('author__profile').order_by('-created_at', '-id')[:5]
     # 最近登録されたユーザー
-    recent_users = User.objects.order_by('-date_joined')[:5]
-    
+    recent_users = User.objects.select_related('profile').order_by('-date_joined')[:5]
+
     context = {
-        'total_users': total_users,
-        'active_users': active_users,
-        'staff_users': staff_users,
-        'superusers': superusers,
-        'total_posts': total_posts,
+        **stats,
         'recent_posts': recent_posts,
         'recent_users': recent_users,
+        'daily_activity': dashboard.get_daily_activity(DASHBOARD_ACTIVITY_DAYS),
     }
     return render(request, 'accounts/admin_dashboard.html', context)
 
+@role_management_required
+def admin_dashboard_activity(request):
+    """日別の新規登録数・投稿数（JSON）。?days= で期間を指定（最大365日）"""
+    try:
+        days = min(max(int(request.GET.get('days', DASHBOARD_ACTIVITY_DAYS)), 1), 365)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': '期間の指定が正しくありません'}, status=400)
+
+    activity = [
+        {**row, 'date': row['date'].isoformat()}
+        for row in dashboard.get_daily_activity(days)
+    ]
+    return JsonResponse({'success': True, 'days': activity})
+
+ADMIN_USERS_PAGE_SIZE = 50
+
+# 並び順の選択肢（キー: (表示名, order_by の引数)）
+ADMIN_USER_SORTS = {
+    'newest': ('登録日が新しい順', ('-date_joined', '-id')),
+    'oldest': ('登録日が古い順', ('date_joined', 'id')),
+    'username': ('ユーザー名順', ('username',)),
+    'last_login': ('最終ログインが新しい順', ('-last_login', '-id')),
+}
+
+
+def _filter_admin_users(params):
+    """検索条件（ユーザー名の前方一致・ロール・状態・スタッフ）を適用したクエリセットを返す"""
+    users = User.objects.all()
+
+    username = params.get('q', '').strip()
+    if username:
+        # SQLite の LIKE は大文字・小文字を区別せず索引を使えないため、範囲条件で索引を絞り込み、
+        # 前方一致で確定させる（どちらのデータベースでも大文字・小文字を区別した前方一致になる）
+        upper = username[:-1] + chr(ord(username[-1]) + 1)
+        users = users.filter(username__gte=username, username__lt=upper, username__startswith=username)
+
+    role = params.get('role')
+    if role in dict(UserProfile.ROLE_CHOICES):
+        users = users.filter(profile__role=role)
+
+    for param, field in (('active', 'is_active'), ('staff', 'is_staff')):
+        value = params.get(param)
+        if value in ('1', '0'):
+            users = users.filter(**{field: value == '1'})
+
+    return users
+
+
 @role_management_required
 def admin_users(request):
-    """管理者用ユーザー管理ページ"""
-    users = User.objects.annotate(
-        post_count=Count('post')
-    ).order_by('-date_joined')
-    
+    """管理者用ユーザー管理ページ（検索・並び替え・ページ分割はサーバー側で行う）"""
+    from posts.models import Post
+
+    sort = request.GET.get('sort', 'newest')
+    if sort not in ADMIN_USER_SORTS:
+        sort = 'newest'
+
+    # 投稿数は相関サブクエリにし、JOIN + GROUP BY で全ユーザー分を集計しないようにする
+    post_counts = (
+        Post.objects.filter(author_id=OuterRef('pk'))
+        .values('author_id').annotate(total=Count('*')).values('total')
+    )
+    users = (
+        _filter_admin_users(request.GET)
+        .select_related('profile')
+        .annotate(post_count=Coalesce(Subquery(post_counts, output_field=IntegerField()), 0))
+        .order_by(*ADMIN_USER_SORTS[sort][1])
+    )
+    paginator = Paginator(users, ADMIN_USERS_PAGE_SIZE)
+    page = paginator.get_page(request.GET.get('page'))
+
+    # 統計は全ユーザーを対象に1回の集計クエリで求める
+    stats = User.objects.aggregate(
+        total=Count('id'),
+        active=Count('id', filter=Q(is_active=True)),
+        staff=Count('id', filter=Q(is_staff=True)),
+        superusers=Count('id', filter=Q(is_superuser=True)),
+    )
+
     context = {
-        'users': users,
+        'users': page.object_list,
+        'page_obj': page,
+        'stats': stats,
         'role_choices': UserProfile.ROLE_CHOICES,
+        'sort_choices': [(key, label) for key, (label, _) in ADMIN_USER_SORTS.items()],
+        'current_sort': sort,
     }
     return render(request, 'accounts/admin_users.html', context)
 
@@ -132,7 +203,7 @@ def admin_toggle_user_status(request, user_id):
         return redirect('accounts:admin_users')
     
     user.is_active = not user.is_active
-    user.save()
+    user.save(update_fields=['is_active'])
     
     status = "有効" if user.is_active else "無効"
     messages.success(request, f'ユーザー「{user.username}」を{status}にしました。')
@@ -152,7 +223,7 @@ def admin_toggle_staff_status(request, user_id):
         return redirect('accounts:admin_users')
     
     user.is_staff = not user.is_staff
-    user.save()
+    user.save(update_fields=['is_staff'])
     
     status = "付与" if user.is_staff else "削除"
     messages.success(request, f'ユーザー「{user.username}」のスタッフ権限を{status}しました。')
@@ -177,7 +248,9 @@ def admin_edit_user(request, user_id):
         
         if form.is_valid() and profile_form.is_valid():
             form.save()
-            profile_form.save()
+            profile = profile_form.save()
+            if 'avatar' in profile_form.changed_data and profile.avatar:
+                jobs.enqueue(tasks.process_avatar_image, profile.pk)
             messages.success(request, f'ユーザー「{edit_user.username}」を更新しました。')
             return redirect('accounts:admin_users')
     else:
@@ -230,8 +303,7 @@ def admin_change_user_role(request, user_id):
             return JsonResponse({'success': False, 'error': '無効なロールです。'}, status=400)
         
         # オーナーロールの制限（現在のユーザーがオーナーでない場合）
-        current_user_profile, _ = UserProfile.objects.get_or_create(user=request.user)
-        if new_role == 'owner' and current_user_profile.role != 'owner' and not request.user.is_superuser:
+        if new_role == 'owner' and not request.capabilities.can_assign_owner:
             return JsonResponse({'success': False, 'error': 'オーナーロールの設定権限がありません。'}, status=403)
         
         # 自分自身のロールを下げることの防止
@@ -241,7 +313,7 @@ def admin_change_user_role(request, user_id):
         # ロール変更
         old_role = profile.get_role_display_with_icon()
         profile.role = new_role
-        profile.save()
+        profile.save_if_changed()
         
         new_role_display = profile.get_role_display_with_icon()
         
@@ -258,36 +330,38 @@ def admin_change_user_role(request, user_id):
 @role_management_required
 def admin_bulk_role_management(request):
     """管理者用一括ロール管理ページ"""
-    users = User.objects.select_related('profile').order_by('username')
-    
     if request.method == 'POST':
-        # 一括ロール変更処理
+        # 一括ロール変更処理（差分のみを1トランザクションでまとめて更新）
         user_roles = {}
         for key, value in request.POST.items():
             if key.startswith('role_'):
                 user_id = key.replace('role_', '')
                 user_roles[user_id] = value
-        
-        updated_count = 0
-        for user_id, new_role in user_roles.items():
-            try:
-                user = User.objects.get(id=user_id)
-                profile, created = UserProfile.objects.get_or_create(user=user)
-                
-                # ロールの妥当性チェック
-                valid_roles = [choice[0] for choice in UserProfile.ROLE_CHOICES]
-                if new_role in valid_roles and profile.role != new_role:
-                    profile.role = new_role
-                    profile.save()
-                    updated_count += 1
-            except User.DoesNotExist:
-                continue
-        
-        messages.success(request, f'{updated_count}人のユーザーロールを更新しました。')
+
+        results = bulk_update_roles(user_roles)
+        updated = [r for r in results if r['status'] == 'updated']
+        invalid = [r for r in results if r['status'] == 'invalid_role']
+        not_found = [r for r in results if r['status'] == 'not_found']
+
+        messages.success(request, f'{len(updated)}人のユーザーロールを更新しました。')
+        if invalid:
+            names = '、'.join(r['username'] for r in invalid)
+            messages.warning(request, f'無効なロールが指定されたため変更しませんでした: {names}')
+        if not_found:
+            messages.warning(request, f'{len(not_found)}件のユーザーが見つかりませんでした。')
         return redirect('accounts:admin_bulk_role_management')
-    
+
+    users = User.objects.select_related('profile').order_by('username')
+    # ロール別の人数（テンプレート側で全ユーザーを走査しないよう集計しておく）
+    role_counts = dict(
+        UserProfile.objects.values_list('role').annotate(count=Count('id')).order_by()
+    )
+
     context = {
         'users': users,
         'role_choices': UserProfile.ROLE_CHOICES,
+        'role_stats': [
+            (role, label, role_counts.get(role, 0)) for role, label in UserProfile.ROLE_CHOICES
+        ],
     }
-    return render(request, 'accounts/admin_bulk_role_management.html', context)
\ No newline at end of file
+    return render(request, 'accounts/admin_bulk_role_management.html', context)
@@ -0,0 +1,158 @@
+"""
+プロジェクト共通のキャッシュ層
+
+用途ごとに CacheNamespace を定義して使う。
+
+- キーは「名前空間:v<バージョン>:識別子」の形式。保存する値の形式を変えたときは
+  バージョンを上げれば、古い形式のエントリを読まずに済む
+- 名前空間ごとに既定の有効期限（TTL）を持つ
+- get / get_many のヒット・ミスを名前空間ごとに数え、共有キャッシュへ定期的に
+  書き出す（manage.py cache_stats で確認できる）
+"""
+import threading
+from collections import defaultdict
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.memcached import BaseMemcachedCache
+from django.core.cache.backends.redis import RedisCache
+
+DEFAULT = object()  # timeout 未指定を表す（None は「無期限」の意味で使われるため）
+
+STATS_KEY_PREFIX = 'cache_stats'
+STATS_FLUSH_EVERY = 50  # この回数の参照ごとにプロセス内の集計を共有キャッシュへ書き出す
+
+_namespaces = {}
+_stats_lock = threading.Lock()
+_pending_stats = defaultdict(lambda: {'hits': 0, 'misses': 0})
+
+
+# プロセス間で共有され、add / incr が不可分（アトミック）なバックエンド
+# （ファイルキャッシュは共有されるが add / incr が読み取り→書き込みのため含めない）
+SHARED_CACHE_BACKENDS = (RedisCache, BaseMemcachedCache)
+
+
+def is_shared_cache():
+    """キャッシュが全ワーカーで共有され、add / incr を不可分に実行できるか"""
+    return isinstance(caches['default'], SHARED_CACHE_BACKENDS)
+
+
+class CacheNamespace:
+    """用途ごとのキャッシュ（キーの組み立て・既定TTL・ヒット率計測）"""
+
+    def __init__(self, name, timeout=300, version=1):
+        self.name = name
+        self.timeout = timeout
+        self.version = version
+        _namespaces[name] = self
+
+    def key(self, ident=''):
+        if isinstance(ident, (tuple, list)):
+            ident = ':'.join(str(part) for part in ident)
+        return f'{self.name}:v{self.version}:{ident}'
+
+    def _timeout(self, timeout):
+        return self.timeout if timeout is DEFAULT else timeout
+
+    def get(self, ident='', default=None):
+        value = cache.get(self.key(ident), DEFAULT)
+        if value is DEFAULT:
+            _record(self.name, hits=0, misses=1)
+            return default
+        _record(self.name, hits=1, misses=0)
+        return value
+
+    def get_many(self, idents):
+        """識別子 → 値 の辞書を返す（キャッシュにない識別子は含まれない）"""
+        keys = {self.key(ident): ident for ident in idents}
+        found = cache.get_many(keys)
+        _record(self.name, hits=len(found), misses=len(keys) - len(found))
+        return {keys[key]: value for key, value in found.items()}
+
+    def set(self, ident, value, timeout=DEFAULT):
+        cache.set(self.key(ident), value, timeout=self._timeout(timeout))
+
+    def set_many(self, mapping, timeout=DEFAULT):
+        cache.set_many(
+            {self.key(ident): value for ident, value in mapping.items()},
+            timeout=self._timeout(timeout),
+        )
+
+    def add(self, ident, value, timeout=DEFAULT):
+        """キーが存在しない場合のみ保存し、保存できたかを返す（簡易ロックにも使う）"""
+        return cache.add(self.key(ident), value, timeout=self._timeout(timeout))
+
+    def incr(self, ident, delta=1):
+        """値を加算する（キーがなければ ValueError）"""
+        return cache.incr(self.key(ident), delta)
+
+    def delete(self, ident=''):
+        cache.delete(self.key(ident))
+
+    def delete_many(self, idents):
+        cache.delete_many([self.key(ident) for ident in idents])
+
+
+def _record(name, hits, misses):
+    with _stats_lock:
+        stats = _pending_stats[name]
+        stats['hits'] += hits
+        stats['misses'] += misses
+        if stats['hits'] + stats['misses'] < STATS_FLUSH_EVERY:
+            return
+        flushed = dict(stats)
+        stats['hits'] = stats['misses'] = 0
+    _write_stats(name, flushed)
+
+
+def _write_stats(name, stats):
+    for field, count in stats.items():
+        if not count:
+            continue
+        key = f'{STATS_KEY_PREFIX}:{name}:{field}'
+        try:
+            cache.incr(key, count)
+        except ValueError:
+            if not cache.add(key, count, timeout=None):
+                cache.incr(key, count)
+
+
+def flush_stats():
+    """プロセス内に溜まっている集計をすべて共有キャッシュへ書き出す"""
+    with _stats_lock:
+        pending = {name: dict(stats) for name, stats in _pending_stats.items()}
+        _pending_stats.clear()
+    for name, stats in pending.items():
+        _write_stats(name, stats)
+
+
+def get_stats():
+    """名前空間ごとの {'hits', 'misses', 'hit_rate'} を返す"""
+    flush_stats()
+    keys = [
+        f'{STATS_KEY_PREFIX}:{name}:{field}'
+        for name in _namespaces
+        for field in ('hits', 'misses')
+    ]
+    values = cache.get_many(keys)
+
+    stats = {}
+    for name in sorted(_namespaces):
+        hits = values.get(f'{STATS_KEY_PREFIX}:{name}:hits', 0)
+        misses = values.get(f'{STATS_KEY_PREFIX}:{name}:misses', 0)
+        total = hits + misses
+        stats[name] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / total if total else None,
+        }
+    return stats
+
+
+def reset_stats():
+    with _stats_lock:
+        _pending_stats.clear()
+    cache.delete_many([
+        f'{STATS_KEY_PREFIX}:{name}:{field}'
+        for name in _namespaces
+        for field in ('hits', 'misses')
+    ])
@@ -0,0 +1,6 @@
+from django.conf import settings
+
+
+def live_events(request):
+    """リアルタイム配信（/api/events/）に接続するかをテンプレートに渡す"""
+    return {'event_stream_enabled': settings.EVENT_STREAM_ENABLED}
@@ -0,0 +1,101 @@
+"""
+管理ダッシュボードの集計
+
+- 件数の統計は1回の条件付き集計で求めて短時間キャッシュし、User / Post の
+  保存・削除シグナルで破棄する
+- 日別の新規登録数・投稿数は DailyActivity に加算しておき、時系列表示では
+  元の行を走査せずにこの集計表だけを読む
+"""
+import datetime
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .cache import CacheNamespace
+from .models import DailyActivity
+
+stats_cache = CacheNamespace('dashboard:stats')
+
+ACTIVITY_FIELDS = ('signups', 'posts')
+
+
+def get_stats():
+    """ユーザー数（全体・有効・スタッフ・スーパーユーザー）と投稿数を返す"""
+    stats = stats_cache.get()
+    if stats is None:
+        from posts.models import Post
+
+        stats = User.objects.aggregate(
+            total_users=Count('id'),
+            active_users=Count('id', filter=Q(is_active=True)),
+            staff_users=Count('id', filter=Q(is_staff=True)),
+            superusers=Count('id', filter=Q(is_superuser=True)),
+        )
+        stats['total_posts'] = Post.objects.count()
+        stats_cache.set('', stats, timeout=settings.DASHBOARD_STATS_CACHE_TIMEOUT)
+    return stats
+
+
+def invalidate_stats():
+    stats_cache.delete()
+
+
+def record_activity(field, when, delta=1):
+    """when（日時）の属する日の集計に delta を加える"""
+    day = timezone.localdate(when) if timezone.is_aware(when) else when.date()
+    values = {field: F(field) + delta, 'updated_at': timezone.now()}
+    if DailyActivity.objects.filter(date=day).update(**values):
+        return
+    with transaction.atomic():
+        # 同じ日の行を別のリクエストが先に作った場合に備え、作成後にも加算で反映する
+        DailyActivity.objects.get_or_create(date=day)
+        DailyActivity.objects.filter(date=day).update(**values)
+
+
+def get_daily_activity(days=30):
+    """直近 days 日分の [{'date', 'signups', 'posts'}] を古い順に返す（記録のない日は0）"""
+    today = timezone.localdate()
+    start = today - datetime.timedelta(days=days - 1)
+    rows = {
+        row['date']: row
+        for row in DailyActivity.objects.filter(date__gte=start, date__lte=today).values('date', *ACTIVITY_FIELDS)
+    }
+
+    activity = []
+    for offset in range(days):
+        day = start + datetime.timedelta(days=offset)
+        row = rows.get(day, {})
+        activity.append({
+            'date': day,
+            **{field: row.get(field, 0) for field in ACTIVITY_FIELDS},
+        })
+    return activity
+
+
+def rebuild_daily_activity():
+    """元データ（ユーザー・投稿）から日別の集計を作り直す"""
+    from posts.models import Post
+
+    tzinfo = timezone.get_current_timezone() if settings.USE_TZ else None
+    counts = {}
+    for field, queryset, date_field in (
+        ('signups', User.objects.all(), 'date_joined'),
+        ('posts', Post.objects.all(), 'created_at'),
+    ):
+        rows = (
+            queryset.annotate(day=TruncDate(date_field, tzinfo=tzinfo))
+            .values('day').annotate(count=Count('id')).order_by()
+        )
+        for row in rows:
+            counts.setdefault(row['day'], dict.fromkeys(ACTIVITY_FIELDS, 0))[field] = row['count']
+
+    with transaction.atomic():
+        DailyActivity.objects.all().delete()
+        DailyActivity.objects.bulk_create([
+            DailyActivity(date=day, **values) for day, values in sorted(counts.items())
+        ])
+    return len(counts)
@@ -0,0 +1,186 @@
+"""
+サーバープッシュ用のイベントブローカー
+
+同期ビュー（いいね・通知・プレゼンス更新）から publish されたイベントを、
+ASGI上で動く Server-Sent Events エンドポイントの購読者へ配信する。
+既定はプロセス内ブローカー（WSGIのみで運用する場合、publish は何もしない）。
+イベントは WSGI ワーカーから publish され、別プロセスの ASGI サーバーで配信されるため、
+ASGI サーバーを起動する場合は RedisBroker が必須（check_asgi_broker で確認する）
+"""
+import asyncio
+import json
+import threading
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+BROADCAST_CHANNEL = 'broadcast'
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
+
+
+class BaseBroker:
+    """イベントブローカーの基底クラス"""
+
+    def publish(self, channel, event, data):
+        """同期コードからイベントを送信する（購読者がいなければ何もしない）"""
+        raise NotImplementedError
+
+    async def subscribe(self, channels):
+        """channels を購読する Subscription を返す"""
+        raise NotImplementedError
+
+
+class Subscription:
+    """購読中のイベントを1件ずつ取り出すためのハンドル"""
+
+    async def get(self, timeout=None):
+        """次のイベントを返す。timeout 秒以内に届かなければ None"""
+        raise NotImplementedError
+
+    async def close(self):
+        raise NotImplementedError
+
+
+class InProcessSubscription(Subscription):
+    def __init__(self, broker, channels, loop):
+        self.broker = broker
+        self.channels = channels
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=settings.EVENT_STREAM_QUEUE_SIZE)
+
+    def deliver(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # 受信が追いつかないクライアントのイベントは捨てる（次回の再取得で整合する）
+            pass
+
+    async def get(self, timeout=None):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def close(self):
+        self.broker._unsubscribe(self)
+
+
+class InProcessBroker(BaseBroker):
+    """
+    プロセス内のpub/subブローカー
+
+    publish はどのスレッドからでも呼べ、各購読者のイベントループへ
+    call_soon_threadsafe で受け渡す。単一プロセスのASGIサーバー向け
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def publish(self, channel, event, data):
+        message = {'event': event, 'data': data}
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, message)
+            except RuntimeError:
+                # イベントループが既に閉じている
+                self._unsubscribe(subscription)
+
+    async def subscribe(self, channels):
+        subscription = InProcessSubscription(self, channels, asyncio.get_running_loop())
+        with self._lock:
+            for channel in channels:
+                self._subscribers[channel].add(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                self._subscribers[channel].discard(subscription)
+                if not self._subscribers[channel]:
+                    del self._subscribers[channel]
+
+
+class RedisSubscription(Subscription):
+    def __init__(self, client, pubsub):
+        self.client = client
+        self.pubsub = pubsub
+
+    async def get(self, timeout=None):
+        message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+        if message is None:
+            return None
+        return json.loads(message['data'])
+
+    async def close(self):
+        await self.pubsub.aclose()
+        await self.client.aclose()
+
+
+class RedisBroker(BaseBroker):
+    """Redis の PUBLISH/SUBSCRIBE を使うブローカー（複数プロセス・複数サーバー構成向け）"""
+
+    def __init__(self):
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured('RedisBroker を使用するには redis パッケージが必要です')
+        if not settings.EVENT_BROKER_URL:
+            raise ImproperlyConfigured('RedisBroker を使用するには EVENT_BROKER_URL を設定してください')
+        self.url = settings.EVENT_BROKER_URL
+        self._client = redis.Redis.from_url(self.url)
+
+    def publish(self, channel, event, data):
+        self._client.publish(channel, json.dumps({'event': event, 'data': data}))
+
+    async def subscribe(self, channels):
+        import redis.asyncio
+
+        client = redis.asyncio.Redis.from_url(self.url)
+        pubsub = client.pubsub()
+        await pubsub.subscribe(*channels)
+        return RedisSubscription(client, pubsub)
+
+
+def check_asgi_broker():
+    """
+    ASGIサーバーの起動時に呼び、別プロセスからのイベントを受け取れる設定か確認する
+
+    InProcessBroker では WSGI ワーカーで publish したイベントが届かないため
+    ImproperlyConfigured を送出して起動させない
+    """
+    if not issubclass(import_string(settings.EVENT_BROKER), RedisBroker):
+        raise ImproperlyConfigured(
+            'ASGIサーバーでイベントを配信するには EVENT_BROKER に core.events.RedisBroker を指定してください'
+        )
+    # パッケージと EVENT_BROKER_URL の有無はインスタンス化時に確認される
+    get_broker()
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    return import_string(settings.EVENT_BROKER)()
+
+
+def publish(channel, event, data):
+    """イベントを送信する。配信の失敗がリクエスト処理を妨げないよう例外は握りつぶす"""
+    try:
+        get_broker().publish(channel, event, data)
+    except Exception as e:
+        print(f"Event publish error: {e}")
+
+
+def broadcast(event, data):
+    publish(BROADCAST_CHANNEL, event, data)
+
+
+def send_to_user(user_id, event, data):
+    publish(user_channel(user_id), event, data)
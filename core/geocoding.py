@@ -0,0 +1,131 @@
+"""
+オフライン逆ジオコーディング
+
+同梱の市区町村データ（core/data/jp_municipalities.csv）から k-d 木を構築し、
+緯度経度に最も近い市区町村を外部APIを使わずに求める
+
+データは全市町村・東京23区・政令指定都市の各区（2020年1月1日時点）の
+役所・役場の位置で、政令指定都市は区単位で収録している。
+出典: ROIS-DS人文学オープンデータ共同利用センター「歴史的行政区域データセットβ版地名辞書」
+（CC BY 4.0, https://geonlp.ex.nii.ac.jp/dictionary/geoshape-city/）を加工して作成
+"""
+import csv
+import math
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+DATA_FILE = Path(__file__).resolve().parent / 'data' / 'jp_municipalities.csv'
+
+# 最寄りの役所・役場がこれより遠い場合は国内と判断しない（km）
+MAX_DISTANCE_KM = 120.0
+EARTH_RADIUS_KM = 6371.0
+
+
+def _to_xyz(lat: float, lon: float) -> Tuple[float, float, float]:
+    """
+    地球を球とみなした3次元の直交座標（km）に変換
+
+    2点間の直線距離（弦の長さ）は球面上の距離と大小関係が一致するため、
+    平面に投影したときのような歪みなしに最近傍を求められる
+    """
+    phi, lam = math.radians(lat), math.radians(lon)
+    return (
+        EARTH_RADIUS_KM * math.cos(phi) * math.cos(lam),
+        EARTH_RADIUS_KM * math.cos(phi) * math.sin(lam),
+        EARTH_RADIUS_KM * math.sin(phi),
+    )
+
+
+def _chord_to_km(chord: float) -> float:
+    """弦の長さを球面上の距離（大円距離, km）に変換"""
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / (2 * EARTH_RADIUS_KM)))
+
+
+class KDTree:
+    """k-d 木（最近傍探索専用の最小実装。次元数は点の座標の数）"""
+
+    def __init__(self, points: List[Tuple[float, ...]]):
+        self.points = points
+        self.dimensions = len(points[0]) if points else 0
+        # ノードは (点のインデックス, 分割軸, 左部分木, 右部分木)
+        self.root = self._build(list(range(len(points))), 0)
+
+    def _build(self, indices, depth):
+        if not indices:
+            return None
+        axis = depth % self.dimensions
+        indices.sort(key=lambda i: self.points[i][axis])
+        median = len(indices) // 2
+        return (
+            indices[median],
+            axis,
+            self._build(indices[:median], depth + 1),
+            self._build(indices[median + 1:], depth + 1),
+        )
+
+    def nearest(self, target: Tuple[float, ...]) -> Tuple[Optional[int], float]:
+        """最も近い点のインデックスと距離を返す"""
+        best = [None, math.inf]
+
+        def search(node):
+            if node is None:
+                return
+            index, axis, left, right = node
+            point = self.points[index]
+            distance = math.dist(point, target)
+            if distance < best[1]:
+                best[0], best[1] = index, distance
+
+            diff = target[axis] - point[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            search(near)
+            # 分割面までの距離が現在の最良より近い場合のみ反対側も探索
+            if abs(diff) < best[1]:
+                search(far)
+
+        search(self.root)
+        return best[0], best[1]
+
+
+class MunicipalityIndex:
+    """市区町村の役所・役場の位置の空間インデックス"""
+
+    def __init__(self, rows: List[Dict[str, str]]):
+        self.prefectures = [row['prefecture'] for row in rows]
+        self.cities = [row['city'] for row in rows]
+        self.tree = KDTree([_to_xyz(float(row['lat']), float(row['lon'])) for row in rows])
+
+    @classmethod
+    def from_csv(cls, path: Path = DATA_FILE) -> 'MunicipalityIndex':
+        with open(path, encoding='utf-8', newline='') as f:
+            return cls(list(csv.DictReader(f)))
+
+    def lookup(self, lat: float, lon: float) -> Optional[Dict[str, str]]:
+        """最寄り（大円距離）の市区町村を返す（国外と判断した場合は None）"""
+        index, chord = self.tree.nearest(_to_xyz(lat, lon))
+        if index is None or _chord_to_km(chord) > MAX_DISTANCE_KM:
+            return None
+        return {
+            'prefecture': self.prefectures[index],
+            'city': self.cities[index],
+        }
+
+
+_index: Optional[MunicipalityIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> MunicipalityIndex:
+    """プロセス内で1度だけデータを読み込んでインデックスを構築"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = MunicipalityIndex.from_csv()
+    return _index
+
+
+def reverse_geocode(lat: float, lon: float) -> Optional[Dict[str, str]]:
+    """緯度経度から都道府県・市区町村を求める"""
+    return get_index().lookup(lat, lon)
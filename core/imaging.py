@@ -0,0 +1,49 @@
+"""
+画像処理の共通ヘルパー
+
+投稿画像（posts.images）とアバター（accounts.avatars）の両方で使うため、
+どちらのアプリにも依存しない場所に置く
+"""
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+RENDITION_FORMATS = {
+    # フォーマット: (Pillowの保存形式, 拡張子, 保存オプション)
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def open_normalized(file):
+    """画像を開き、EXIFの回転情報を反映した RGB（透過がある場合は RGBA）画像を返す"""
+    file.open('rb')
+    try:
+        image = Image.open(file)
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    finally:
+        file.close()
+
+    if image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info):
+        return image.convert('RGBA')
+    return image.convert('RGB')
+
+
+def flatten(image):
+    """透過部分を白背景に合成した RGB 画像を返す（JPEG 出力用）"""
+    if image.mode != 'RGBA':
+        return image
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.split()[-1])
+    return background
+
+
+def encode(image, fmt):
+    pil_format, _, options = RENDITION_FORMATS[fmt]
+    if pil_format == 'JPEG':
+        image = flatten(image)
+    buffer = BytesIO()
+    # exif を渡さないことでメタデータ（位置情報等）を除去する
+    image.save(buffer, pil_format, **options)
+    return buffer.getvalue()
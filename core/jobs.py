@@ -0,0 +1,144 @@
+"""
+データベースを使った軽量ジョブキュー
+
+外部ブローカーなしで重い処理をリクエストの外へ逃がすための仕組み。
+各アプリの tasks.py で @task を付けた関数を登録し、enqueue() で Job 行を
+作成すると、manage.py run_worker がそれを取り出して実行する。
+
+- 取得は条件付き UPDATE で行うため、複数ワーカーを起動しても二重実行しない
+- 実行中のまま TASK_VISIBILITY_TIMEOUT を過ぎたジョブは再取得される
+- 失敗したジョブは指数バックオフで再試行し、上限を超えたら failed にする
+- TASK_QUEUE_EAGER が有効な場合はコミット後にその場で実行する（開発・テスト用）
+"""
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+_registry = {}
+
+
+class UnknownTask(LookupError):
+    """登録されていないタスク名が指定された場合の例外"""
+
+
+def task(func=None, *, name=None):
+    """関数をジョブキューのタスクとして登録するデコレーター"""
+    def register(f):
+        task_name = name or f'{f.__module__}.{f.__name__}'
+        _registry[task_name] = f
+        f.task_name = task_name
+        return f
+
+    if func is not None:
+        return register(func)
+    return register
+
+
+def get_task(name):
+    try:
+        return _registry[name]
+    except KeyError:
+        raise UnknownTask(name) from None
+
+
+def enqueue(func, *args, delay=None, max_attempts=None, **kwargs):
+    """
+    タスクをキューに追加して Job を返す
+
+    引数は JSON に保存されるため、モデルインスタンスではなく主キーを渡すこと。
+    トランザクション内で呼ばれた場合、ワーカーが実行するのはコミット後になる
+    """
+    task_name = getattr(func, 'task_name', func)
+    get_task(task_name)  # 未登録のタスクは追加時点でエラーにする
+
+    job = Job.objects.create(
+        task=task_name,
+        args=list(args),
+        kwargs=kwargs,
+        max_attempts=max_attempts or settings.TASK_MAX_ATTEMPTS,
+        run_at=timezone.now() + (delay or timedelta()),
+    )
+
+    if settings.TASK_QUEUE_EAGER:
+        transaction.on_commit(lambda: _run_eager(job.pk))
+    return job
+
+
+def _run_eager(job_id):
+    job = claim(job_id)
+    if job is not None:
+        run_job(job)
+
+
+def _claimable(now):
+    return Q(status='pending', run_at__lte=now) | Q(status='running', locked_until__lt=now)
+
+
+def claim(job_id, now=None):
+    """
+    ジョブを実行中に切り替えて取得する（他のワーカーが先に取得していれば None）
+
+    SELECT FOR UPDATE を使わず条件付き UPDATE の件数で判定するため、
+    SQLite と PostgreSQL のどちらでも同じように動作する
+    """
+    now = now or timezone.now()
+    claimed = Job.objects.filter(_claimable(now), pk=job_id).update(
+        status='running',
+        attempts=F('attempts') + 1,
+        locked_until=now + timedelta(seconds=settings.TASK_VISIBILITY_TIMEOUT),
+    )
+    if not claimed:
+        return None
+    return Job.objects.get(pk=job_id)
+
+
+def claim_batch(limit=10, now=None):
+    """実行可能なジョブを最大 limit 件取得する"""
+    now = now or timezone.now()
+    candidate_ids = Job.objects.filter(_claimable(now)).order_by('run_at', 'id').values_list('pk', flat=True)[:limit]
+    jobs = []
+    for job_id in candidate_ids:
+        job = claim(job_id, now)
+        if job is not None:
+            jobs.append(job)
+    return jobs
+
+
+def run_job(job):
+    """取得済みのジョブを実行し、結果に応じて状態を更新する。成功したら True を返す"""
+    try:
+        func = get_task(job.task)
+        func(*job.args, **job.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        print(f"ジョブ実行エラー ({job.task} #{job.pk}): {error}")
+        if job.attempts >= job.max_attempts:
+            Job.objects.filter(pk=job.pk).update(
+                status='failed', locked_until=None, last_error=error, updated_at=timezone.now()
+            )
+        else:
+            backoff = settings.TASK_RETRY_BACKOFF * (2 ** (job.attempts - 1))
+            Job.objects.filter(pk=job.pk).update(
+                status='pending',
+                locked_until=None,
+                last_error=error,
+                run_at=timezone.now() + timedelta(seconds=backoff),
+                updated_at=timezone.now(),
+            )
+        return False
+
+    Job.objects.filter(pk=job.pk).update(status='done', locked_until=None, updated_at=timezone.now())
+    return True
+
+
+def purge_finished(older_than):
+    """完了から older_than 以上経過したジョブを削除し、削除件数を返す"""
+    cutoff = timezone.now() - older_than
+    deleted, _ = Job.objects.filter(status='done', updated_at__lt=cutoff).delete()
+    return deleted
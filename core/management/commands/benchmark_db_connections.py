@@ -0,0 +1,56 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import connection
+
+
+class Command(BaseCommand):
+    help = 'リクエストごとのDB接続コストを、毎回切断する場合と接続を使い回す場合で比較します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='模擬リクエスト数')
+        parser.add_argument(
+            '--max-age', type=int, default=None,
+            help='使い回す場合の CONN_MAX_AGE（省略時は現在の設定値、0なら600）',
+        )
+
+    def simulate(self, conn_max_age, count):
+        """request_started/finished シグナルを送り、実際のリクエストと同じ接続管理を再現する"""
+        connection.close()
+        original = connection.settings_dict['CONN_MAX_AGE']
+        connection.settings_dict['CONN_MAX_AGE'] = conn_max_age
+        try:
+            start = time.perf_counter()
+            for _ in range(count):
+                request_started.send(sender=self.__class__)
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                    cursor.fetchone()
+                request_finished.send(sender=self.__class__)
+            elapsed = time.perf_counter() - start
+        finally:
+            connection.settings_dict['CONN_MAX_AGE'] = original
+            connection.close()
+        return elapsed / count * 1000
+
+    def handle(self, *args, **options):
+        count = options['requests']
+        max_age = options['max_age']
+        if max_age is None:
+            max_age = connection.settings_dict['CONN_MAX_AGE'] or 600
+
+        self.stdout.write(f"データベース: {connection.vendor} ({connection.settings_dict['NAME']})")
+        if connection.settings_dict.get('OPTIONS', {}).get('pool'):
+            # プールは永続接続と併用できないため、現在の設定のみ計測する
+            pooled = self.simulate(0, count)
+            self.stdout.write(f'コネクションプール使用時: {pooled:.3f} ms/リクエスト')
+            return
+
+        per_request = self.simulate(0, count)
+        persistent = self.simulate(max_age, count)
+
+        self.stdout.write(f'毎回接続（CONN_MAX_AGE=0）: {per_request:.3f} ms/リクエスト')
+        self.stdout.write(f'接続を再利用（CONN_MAX_AGE={max_age}）: {persistent:.3f} ms/リクエスト')
+        if persistent > 0:
+            self.stdout.write(self.style.SUCCESS(f'接続コストの削減: {per_request - persistent:.3f} ms（{per_request / persistent:.1f}倍）'))
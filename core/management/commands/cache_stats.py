@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from core import cache as project_cache
+
+# 名前空間を定義しているモジュールを読み込み、集計対象として登録する
+import accounts.last_seen  # noqa: F401
+import accounts.permissions  # noqa: F401
+import core.dashboard  # noqa: F401
+import core.notifications  # noqa: F401
+import core.presence  # noqa: F401
+import core.weather  # noqa: F401
+import posts.fragments  # noqa: F401
+import posts.timeline  # noqa: F401
+
+
+class Command(BaseCommand):
+    help = 'キャッシュの名前空間ごとのヒット率を表示します'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='表示後に集計をリセットする')
+
+    def handle(self, *args, **options):
+        for name, stats in project_cache.get_stats().items():
+            rate = '-' if stats['hit_rate'] is None else f"{stats['hit_rate']:.1%}"
+            self.stdout.write(f"{name:<24} hits={stats['hits']:<8} misses={stats['misses']:<8} hit_rate={rate}")
+
+        if options['reset']:
+            project_cache.reset_stats()
+            self.stdout.write(self.style.SUCCESS('集計をリセットしました'))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from core import dashboard
+
+
+class Command(BaseCommand):
+    help = 'ユーザー・投稿の元データから日別アクティビティの集計を作り直します'
+
+    def handle(self, *args, **options):
+        days = dashboard.rebuild_daily_activity()
+        dashboard.invalidate_stats()
+        self.stdout.write(self.style.SUCCESS(f'{days}日分の集計を作成しました'))
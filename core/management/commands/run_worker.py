@@ -0,0 +1,55 @@
+import signal
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core import jobs
+
+
+class Command(BaseCommand):
+    help = 'ジョブキューのワーカーを起動します（画像処理・通知配信などの遅延タスクを実行）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=10, help='1回に取得するジョブ数')
+        parser.add_argument('--sleep', type=float, default=1.0, help='キューが空のときの待機秒数')
+        parser.add_argument('--once', action='store_true', help='実行可能なジョブを処理したら終了する')
+        parser.add_argument(
+            '--purge-after', type=int, default=7,
+            help='完了済みジョブを削除するまでの日数（0で削除しない）',
+        )
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        purge_after = options['purge_after']
+        last_purge = 0.0
+        processed = 0
+
+        while not self.stopping:
+            close_old_connections()
+            claimed = jobs.claim_batch(limit=options['batch'])
+            for job in claimed:
+                ok = jobs.run_job(job)
+                processed += 1
+                if options['verbosity'] > 1:
+                    status = 'OK' if ok else 'ERROR'
+                    self.stdout.write(f'[{status}] {job.task} #{job.pk}')
+
+            if purge_after and time.monotonic() - last_purge > 3600:
+                jobs.purge_finished(timedelta(days=purge_after))
+                last_purge = time.monotonic()
+
+            if not claimed:
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+
+        self.stdout.write(self.style.SUCCESS(f'{processed}件のジョブを処理しました'))
+
+    def stop(self, signum, frame):
+        # 実行中のジョブを終えてから停止する
+        self.stopping = True
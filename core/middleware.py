@@ -1,14 +1,67 @@
-from django.utils import timezone
+import time
+
+from django.conf import settings
 from django.utils.deprecation import MiddlewareMixin
+from django.utils.functional import SimpleLazyObject
+
+from accounts.last_seen import record_activity
+from accounts.permissions import RoleCapabilities, load_profile
+from . import presence
 
 class UpdateLastSeenMiddleware(MiddlewareMixin):
     """
-    ログインユーザーの最終アクセス時刻を更新するミドルウェア
+    ログインユーザーの最終アクセス時刻とオンライン状態を記録するミドルウェア
+
+    書き込みは accounts.last_seen で間引き・一括化されるため、
+    リクエストごとにデータベースへUPDATEすることはない
     """
     
     def process_request(self, request):
         if request.user.is_authenticated:
-            # プロフィールが存在する場合のみ更新
-            if hasattr(request.user, 'profile'):
-                request.user.profile.update_last_seen()
+            # 記録が間引かれなかった場合のみプレゼンスも更新
+            if record_activity(request.user.pk):
+                presence.touch(request.user.pk)
+        return None
+
+
+class SessionRefreshMiddleware(MiddlewareMixin):
+    """
+    セッションの有効期限を間引いて延長するミドルウェア
+
+    SESSION_SAVE_EVERY_REQUEST を使うと毎リクエストでセッションを書き込むため、
+    前回の延長から SESSION_COOKIE_AGE * SESSION_REFRESH_FRACTION 秒以上経過した
+    場合のみセッションを更新し、有効期限（とCookie）を延ばす
+    """
+    REFRESHED_AT_KEY = '_refreshed_at'
+
+    def process_request(self, request):
+        session = getattr(request, 'session', None)
+        if session is None or session.is_empty():
+            return None
+
+        now = int(time.time())
+        refreshed_at = session.get(self.REFRESHED_AT_KEY, 0)
+        if now - refreshed_at >= settings.SESSION_COOKIE_AGE * settings.SESSION_REFRESH_FRACTION:
+            # 値を書き換えるとセッションが変更扱いになり、応答時に保存・Cookie再発行される
+            session[self.REFRESHED_AT_KEY] = now
+        return None
+
+
+class ProfileMiddleware(MiddlewareMixin):
+    """
+    request.profile（ログインユーザーのプロフィール）と request.capabilities（権限）を設定するミドルウェア
+
+    どちらも最初に参照されたときに読み込まれ、プロフィールはキャッシュにあれば
+    データベースを参照しない。読み込んだプロフィールは request.user.profile にも紐付ける
+    """
+
+    def process_request(self, request):
+        user = request.user
+        if not user.is_authenticated:
+            request.profile = None
+            request.capabilities = RoleCapabilities(user)
+            return None
+
+        request.profile = SimpleLazyObject(lambda: load_profile(user))
+        request.capabilities = SimpleLazyObject(lambda: RoleCapabilities(user, load_profile(user)))
         return None
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:32
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task', models.CharField(max_length=200, verbose_name='タスク名')),
+                ('args', models.JSONField(blank=True, default=list, verbose_name='位置引数')),
+                ('kwargs', models.JSONField(blank=True, default=dict, verbose_name='キーワード引数')),
+                ('status', models.CharField(choices=[('pending', '待機中'), ('running', '実行中'), ('done', '完了'), ('failed', '失敗')], default='pending', max_length=10, verbose_name='状態')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='試行回数')),
+                ('max_attempts', models.PositiveIntegerField(default=3, verbose_name='最大試行回数')),
+                ('run_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='実行予定時刻')),
+                ('locked_until', models.DateTimeField(blank=True, null=True, verbose_name='ロック期限')),
+                ('last_error', models.TextField(blank=True, verbose_name='最後のエラー')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['run_at', 'id'],
+                'indexes': [models.Index(fields=['status', 'run_at'], name='core_job_status_run_at_idx')],
+            },
+        ),
+    ]
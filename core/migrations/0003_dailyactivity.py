@@ -0,0 +1,54 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:45
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+def backfill_daily_activity(apps, schema_editor):
+    """既存のユーザー・投稿から日別の集計を作成する"""
+    User = apps.get_model('auth', 'User')
+    Post = apps.get_model('posts', 'Post')
+    DailyActivity = apps.get_model('core', 'DailyActivity')
+
+    tzinfo = timezone.get_current_timezone() if settings.USE_TZ else None
+    counts = {}
+    for field, model, date_field in (('signups', User, 'date_joined'), ('posts', Post, 'created_at')):
+        rows = (
+            model.objects.annotate(day=TruncDate(date_field, tzinfo=tzinfo))
+            .values('day').annotate(count=Count('id')).order_by()
+        )
+        for row in rows:
+            counts.setdefault(row['day'], {'signups': 0, 'posts': 0})[field] = row['count']
+
+    DailyActivity.objects.bulk_create([
+        DailyActivity(date=day, **values) for day, values in sorted(counts.items())
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_job'),
+        ('posts', '0005_post_hot_query_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True, verbose_name='日付')),
+                ('signups', models.IntegerField(default=0, verbose_name='新規登録数')),
+                ('posts', models.IntegerField(default=0, verbose_name='投稿数')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['date'],
+            },
+        ),
+        migrations.RunPython(backfill_daily_activity, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:02
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_likes(apps, schema_editor):
+    """一意制約の追加前に、重複したいいね通知を最も古い1件だけ残して削除する"""
+    Notification = apps.get_model('core', 'Notification')
+    duplicates = (
+        Notification.objects.filter(type='like')
+        .values('recipient_id', 'actor_id', 'post_id')
+        .annotate(first_id=Min('id'), count=Count('id'))
+        .filter(count__gt=1)
+    )
+    for row in duplicates:
+        Notification.objects.filter(
+            type='like', recipient_id=row['recipient_id'], actor_id=row['actor_id'], post_id=row['post_id'],
+        ).exclude(id=row['first_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_dailyactivity'),
+        ('posts', '0006_post_search_tokens'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='notification',
+            name='core_notif_recipient_idx',
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['recipient', '-created_at'], name='core_notif_recipient_idx'),
+        ),
+        migrations.RunPython(remove_duplicate_likes, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='notification',
+            constraint=models.UniqueConstraint(condition=models.Q(('type', 'like')), fields=('recipient', 'actor', 'post', 'type'), name='core_notif_unique_like'),
+        ),
+    ]
@@ -1,3 +1,88 @@
 from django.db import models
+from django.contrib.auth.models import User
+from django.utils import timezone
 
-# Create your models here.
+
+class Notification(models.Model):
+    """ユーザーへの通知（いいね・新規参加など、発生時に書き込む）"""
+    TYPE_CHOICES = [
+        ('like', 'いいね'),
+        ('user_joined', '新規参加'),
+        ('system', 'システム'),
+    ]
+
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications', verbose_name='受信者')
+    actor = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='+', verbose_name='発生元ユーザー')
+    post = models.ForeignKey('posts.Post', on_delete=models.CASCADE, null=True, blank=True, related_name='+', verbose_name='対象の投稿')
+    type = models.CharField(max_length=20, choices=TYPE_CHOICES, verbose_name='種類')
+    message = models.CharField(max_length=255, verbose_name='メッセージ')
+    read = models.BooleanField(default=False, verbose_name='既読')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            # 通知一覧（受信者で絞り込み、新しい順）に使う
+            models.Index(fields=['recipient', '-created_at'], name='core_notif_recipient_idx'),
+        ]
+        constraints = [
+            # いいねの付け外しを繰り返しても同じ通知を重複させない
+            models.UniqueConstraint(
+                fields=['recipient', 'actor', 'post', 'type'],
+                condition=models.Q(type='like'),
+                name='core_notif_unique_like',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.recipient.username}への通知: {self.message[:30]}"
+
+
+class Job(models.Model):
+    """バックグラウンドワーカー（run_worker コマンド）で実行する遅延タスク"""
+    STATUS_CHOICES = [
+        ('pending', '待機中'),
+        ('running', '実行中'),
+        ('done', '完了'),
+        ('failed', '失敗'),
+    ]
+
+    task = models.CharField(max_length=200, verbose_name='タスク名')
+    args = models.JSONField(default=list, blank=True, verbose_name='位置引数')
+    kwargs = models.JSONField(default=dict, blank=True, verbose_name='キーワード引数')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending', verbose_name='状態')
+    attempts = models.PositiveIntegerField(default=0, verbose_name='試行回数')
+    max_attempts = models.PositiveIntegerField(default=3, verbose_name='最大試行回数')
+    run_at = models.DateTimeField(default=timezone.now, verbose_name='実行予定時刻')
+    # 実行中ジョブの可視性タイムアウト。これを過ぎたらワーカーが落ちたとみなして再取得する
+    locked_until = models.DateTimeField(null=True, blank=True, verbose_name='ロック期限')
+    last_error = models.TextField(blank=True, verbose_name='最後のエラー')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['run_at', 'id']
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='core_job_status_run_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.task} ({self.get_status_display()})"
+
+
+class DailyActivity(models.Model):
+    """日ごとの新規登録数・投稿数の集計（管理ダッシュボードの時系列表示用）
+
+    シグナルで作成・削除のたびに加算・減算し、表示時に元の行を走査しない。
+    ずれた場合は manage.py rebuild_daily_activity で元データから再集計できる
+    """
+    date = models.DateField(unique=True, verbose_name='日付')
+    signups = models.IntegerField(default=0, verbose_name='新規登録数')
+    posts = models.IntegerField(default=0, verbose_name='投稿数')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['date']
+
+    def __str__(self):
+        return f"{self.date}: 登録{self.signups} / 投稿{self.posts}"
@@ -0,0 +1,82 @@
+"""
+通知の作成と未読件数キャッシュの管理
+"""
+from django.contrib.auth.models import User
+
+from . import events
+from .cache import CacheNamespace
+from .models import Notification
+
+UNREAD_COUNT_TIMEOUT = 60 * 60 * 24  # 未読件数キャッシュの保持時間（秒）
+
+unread_counts = CacheNamespace('notifications:unread', timeout=UNREAD_COUNT_TIMEOUT)
+
+
+def get_unread_count(user_id):
+    """未読件数を返す（キャッシュがなければ1回だけ数えてキャッシュ）"""
+    count = unread_counts.get(user_id)
+    if count is None:
+        count = Notification.objects.filter(recipient_id=user_id, read=False).count()
+        unread_counts.set(user_id, count)
+    return count
+
+
+def _increment_unread(user_id):
+    try:
+        unread_counts.incr(user_id)
+    except ValueError:
+        # キャッシュ未作成の場合は次回の取得時に数え直す
+        pass
+
+
+def notify_like(post, actor):
+    """投稿にいいねされたことを投稿者に通知"""
+    if post.author_id == actor.pk:
+        return None
+
+    # 一意制約（core_notif_unique_like）があるため、同時にいいねされても通知は1件だけ作られる
+    notification, created = Notification.objects.get_or_create(
+        recipient_id=post.author_id,
+        actor=actor,
+        post=post,
+        type='like',
+        defaults={'message': f'{actor.username} さんがあなたの投稿「{post.content[:20]}...」にいいねしました'},
+    )
+    if not created:
+        return None
+
+    _increment_unread(post.author_id)
+    events.send_to_user(post.author_id, 'notification', {
+        'type': notification.type,
+        'message': notification.message,
+    })
+    return notification
+
+
+def notify_user_joined(new_user):
+    """新しいユーザーの参加を他の全アクティブユーザーへ配信（書き込み時ファンアウト）"""
+    recipient_ids = list(
+        User.objects.filter(is_active=True).exclude(pk=new_user.pk).values_list('pk', flat=True)
+    )
+    Notification.objects.bulk_create([
+        Notification(
+            recipient_id=recipient_id,
+            actor=new_user,
+            type='user_joined',
+            message=f'{new_user.username} さんが参加しました',
+        )
+        for recipient_id in recipient_ids
+    ], batch_size=500)
+    unread_counts.delete_many(recipient_ids)
+    events.broadcast('notification', {
+        'type': 'user_joined',
+        'message': f'{new_user.username} さんが参加しました',
+    })
+    return len(recipient_ids)
+
+
+def mark_all_read(user_id):
+    """ユーザーの未読通知をすべて既読にする"""
+    updated = Notification.objects.filter(recipient_id=user_id, read=False).update(read=True)
+    unread_counts.set(user_id, 0)
+    return updated
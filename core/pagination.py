@@ -0,0 +1,64 @@
+import base64
+import json
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    """カーソル文字列が不正な場合の例外"""
+
+
+@dataclass
+class CursorPage:
+    """キーセットページネーションの1ページ分の結果"""
+    items: List
+    next_cursor: Optional[str]
+
+    @property
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+
+def encode_cursor(created_at: datetime, pk: int) -> str:
+    """(created_at, id) を外部に意味が漏れない不透明なカーソル文字列に変換"""
+    payload = json.dumps({'t': created_at.isoformat(), 'id': pk}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """カーソル文字列を (created_at, id) に復元"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        return datetime.fromisoformat(payload['t']), int(payload['id'])
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursor(cursor) from e
+
+
+def paginate_by_cursor(queryset, cursor: Optional[str] = None, page_size: int = 20) -> CursorPage:
+    """
+    (created_at, id) の降順でキーセットページネーションを行う
+
+    OFFSETを使わないため、テーブルがどれだけ大きくなっても
+    各ページの取得コストは一定に保たれる
+    """
+    queryset = queryset.order_by('-created_at', '-id')
+
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+        )
+
+    # 1件多く取得して次ページの有無を判定
+    items = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        next_cursor = encode_cursor(last.created_at, last.pk)
+
+    return CursorPage(items=items, next_cursor=next_cursor)
@@ -0,0 +1,242 @@
+"""
+オンラインユーザー（プレゼンス）管理
+
+ユーザーごとの最終アクセス時刻（スコア）を保持し、
+「誰がオンラインか」をデータベースに問い合わせずに返す
+"""
+import time
+from datetime import datetime, timezone
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+from . import events
+from .cache import CacheNamespace
+
+USER_PAYLOAD_TIMEOUT = 60 * 60  # ユーザー表示情報のキャッシュ時間（秒）
+BUCKET_SECONDS = 60  # CachePresenceBackend でアクセスを振り分ける時間枠の幅（秒）
+REDIS_KEY = 'presence:members'
+
+user_payloads = CacheNamespace('presence:user', timeout=USER_PAYLOAD_TIMEOUT)
+
+
+class PresenceBackend:
+    """プレゼンス保存先の基底クラス"""
+
+    def touch(self, user_id, score):
+        """ユーザーのスコアを更新し、新たにオンラインになった場合は True を返す"""
+        raise NotImplementedError
+
+    def remove(self, user_id):
+        """ユーザーを集合から外し、外した場合は True を返す"""
+        raise NotImplementedError
+
+    def members_since(self, min_score):
+        """min_score 以降にアクティブだった (user_id, score) をスコアの降順で返す"""
+        raise NotImplementedError
+
+
+class CachePresenceBackend(PresenceBackend):
+    """
+    Djangoのキャッシュ上にユーザーごとのキーで保持するバックエンド
+
+    スコアはユーザーごとのキー（有効期限 PRESENCE_ONLINE_WINDOW 秒）に保存し、
+    アクセスのあったユーザーIDは BUCKET_SECONDS 秒ごとの時間枠に連番のキーで追記する。
+    どの書き込みも他のユーザーのキーを読み書きしないため、同時に更新しても失われない。
+    touch は O(1)、members_since は期間内のアクセス件数に比例する
+    """
+    scores = CacheNamespace('presence:score')
+    buckets = CacheNamespace('presence:bucket')
+
+    def _window(self):
+        return settings.PRESENCE_ONLINE_WINDOW
+
+    def _bucket_timeout(self):
+        return self._window() + BUCKET_SECONDS * 2
+
+    def _append(self, bucket, user_id):
+        count_key = (bucket, 'count')
+        try:
+            number = self.buckets.incr(count_key)
+        except ValueError:
+            self.buckets.add(count_key, 0, timeout=self._bucket_timeout())
+            number = self.buckets.incr(count_key)
+        self.buckets.set((bucket, number), user_id, timeout=self._bucket_timeout())
+
+    def touch(self, user_id, score):
+        min_score = score - self._window()
+        if self.scores.add(user_id, score, timeout=self._window()):
+            newly_online = True
+        else:
+            previous = self.scores.get(user_id)
+            newly_online = previous is None or previous < min_score
+            self.scores.set(user_id, score, timeout=self._window())
+        self._append(int(score // BUCKET_SECONDS), user_id)
+        return newly_online
+
+    def remove(self, user_id):
+        removed = self.scores.get(user_id) is not None
+        self.scores.delete(user_id)
+        return removed
+
+    def members_since(self, min_score):
+        first = int(min_score // BUCKET_SECONDS)
+        last = int((min_score + self._window()) // BUCKET_SECONDS) + 1
+        buckets = range(first, last + 1)
+        counts = self.buckets.get_many([(bucket, 'count') for bucket in buckets])
+
+        slots = [
+            (bucket, number)
+            for bucket in buckets
+            for number in range(1, counts.get((bucket, 'count'), 0) + 1)
+        ]
+        user_ids = set(self.buckets.get_many(slots).values())
+
+        # 時間枠のキーは重複やログアウト済みのユーザーを含むため、最新のスコアで絞り込む
+        scores = self.scores.get_many(user_ids)
+        members = [(user_id, score) for user_id, score in scores.items() if score >= min_score]
+        return sorted(members, key=lambda member: member[1], reverse=True)
+
+
+class RedisPresenceBackend(PresenceBackend):
+    """Redis のソート済み集合（ZADD / ZRANGEBYSCORE）を使うバックエンド"""
+
+    def __init__(self):
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured('RedisPresenceBackend を使用するには redis パッケージが必要です')
+        if not settings.PRESENCE_REDIS_URL:
+            raise ImproperlyConfigured('RedisPresenceBackend を使用するには PRESENCE_REDIS_URL を設定してください')
+        self._client = redis.Redis.from_url(settings.PRESENCE_REDIS_URL)
+
+    def touch(self, user_id, score):
+        min_score = score - settings.PRESENCE_ONLINE_WINDOW
+        pipe = self._client.pipeline(transaction=True)
+        pipe.zscore(REDIS_KEY, user_id)
+        pipe.zadd(REDIS_KEY, {user_id: score})
+        # 期限切れのメンバーはここで掃除して集合を小さく保つ
+        pipe.zremrangebyscore(REDIS_KEY, '-inf', f'({min_score}')
+        previous, _, _ = pipe.execute()
+        return previous is None or previous < min_score
+
+    def remove(self, user_id):
+        return bool(self._client.zrem(REDIS_KEY, user_id))
+
+    def members_since(self, min_score):
+        members = self._client.zrevrangebyscore(REDIS_KEY, '+inf', min_score, withscores=True)
+        return [(int(user_id), score) for user_id, score in members]
+
+
+@lru_cache(maxsize=None)
+def get_backend():
+    return import_string(settings.PRESENCE_BACKEND)()
+
+
+def touch(user_id, now=None):
+    """
+    ユーザーをオンラインとして記録する
+
+    新たにオンラインになった場合は表示用データごと購読者へ通知し、
+    クライアントが一覧を取得し直さずに追加できるようにする
+    """
+    score = now if now is not None else time.time()
+    if get_backend().touch(user_id, score):
+        payload = get_user_payloads([user_id]).get(user_id)
+        if payload and payload['is_active']:
+            events.broadcast('presence', {
+                'user_id': user_id, 'online': True, 'user': _serialize(user_id, payload, score),
+            })
+
+
+def remove(user_id):
+    """ユーザーをオンライン一覧から外す（ログアウト時など）"""
+    if get_backend().remove(user_id):
+        events.broadcast('presence', {'user_id': user_id, 'online': False})
+
+
+def online_members(exclude=None, limit=None, now=None):
+    """オンラインの (user_id, score) を最近アクティブな順に返す"""
+    now = now if now is not None else time.time()
+    members = [
+        (user_id, score)
+        for user_id, score in get_backend().members_since(now - settings.PRESENCE_ONLINE_WINDOW)
+        if user_id != exclude
+    ]
+    return members[:limit] if limit is not None else members
+
+
+def invalidate_user(user_id):
+    """ユーザー名・アバター・ロール変更時に表示情報のキャッシュを破棄"""
+    user_payloads.delete(user_id)
+
+
+def invalidate_users(user_ids):
+    """invalidate_user の一括版"""
+    user_payloads.delete_many(user_ids)
+
+
+def _build_payloads(user_ids):
+    from django.contrib.auth.models import User
+
+    from accounts.avatars import default_avatar_url
+
+    payloads = {}
+    users = User.objects.filter(id__in=user_ids).select_related('profile')
+    for user in users:
+        profile = getattr(user, 'profile', None)
+        payloads[user.id] = {
+            'username': user.username,
+            'is_active': user.is_active,
+            'avatar_url': profile.get_avatar_small_url() if profile else default_avatar_url(),
+            'role_badge_class': profile.get_role_badge_class() if profile else 'badge-secondary',
+            'role_icon': profile.get_role_display_with_icon() if profile else '👤',
+        }
+    return payloads
+
+
+def get_user_payloads(user_ids):
+    """
+    ユーザー表示情報をキャッシュから取得する
+
+    キャッシュにないユーザーのみ1クエリでまとめて取得して補完する
+    """
+    payloads = user_payloads.get_many(user_ids)
+
+    missing = [user_id for user_id in user_ids if user_id not in payloads]
+    if missing:
+        built = _build_payloads(missing)
+        user_payloads.set_many(built)
+        payloads.update(built)
+    return payloads
+
+
+def _serialize(user_id, payload, score):
+    """オンライン一覧の1件分（API の応答とプレゼンスのイベントで共通）"""
+    return {
+        'user_id': user_id,
+        'username': payload['username'],
+        'avatar_url': payload['avatar_url'],
+        'role_badge_class': payload['role_badge_class'],
+        'role_icon': payload['role_icon'],
+        'last_seen': datetime.fromtimestamp(score, tz=timezone.utc).isoformat(),
+    }
+
+
+def get_online_users(exclude=None, limit=10):
+    """オンラインユーザーの表示用データを最近アクティブな順に返す"""
+    # 非アクティブユーザーを除外しても件数が足りるよう少し多めに取得
+    members = online_members(exclude=exclude, limit=limit * 2)
+    payloads = get_user_payloads([user_id for user_id, _ in members])
+
+    users = []
+    for user_id, score in members:
+        payload = payloads.get(user_id)
+        if not payload or not payload['is_active']:
+            continue
+        users.append(_serialize(user_id, payload, score))
+        if len(users) >= limit:
+            break
+    return users
@@ -0,0 +1,154 @@
+from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_out
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from accounts.avatars import generate_default_avatar
+from accounts.models import UserProfile
+from accounts.permissions import invalidate_profile, invalidate_profiles
+from accounts.signals import roles_changed
+from posts import fragments, images, search, timeline
+from posts.models import Post
+from posts.signals import post_liked
+from . import dashboard, jobs, notifications, presence, tasks
+
+
+def _is_login_update(update_fields):
+    """ログイン時の last_login だけの保存か（表示内容や集計には影響しない）"""
+    return update_fields is not None and set(update_fields) <= {'last_login'}
+
+
+# ユーザー情報が変わったらオンライン一覧用の表示情報を破棄
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_presence_user(sender, instance, update_fields=None, **kwargs):
+    if not _is_login_update(update_fields):
+        presence.invalidate_user(instance.pk)
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def invalidate_presence_profile(sender, instance, **kwargs):
+    presence.invalidate_user(instance.user_id)
+
+
+# request.profile 用にキャッシュしたプロフィールを破棄
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def invalidate_cached_profile(sender, instance, **kwargs):
+    invalidate_profile(instance.user_id)
+
+
+# 投稿カードのキャッシュ済み断片を無効化
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_card(sender, instance, **kwargs):
+    fragments.bump_post(instance.pk)
+
+
+# 全文検索の索引を投稿ごとに更新
+@receiver(post_save, sender=Post)
+def update_post_search_index(sender, instance, update_fields=None, **kwargs):
+    # 本文を含まない保存（画像処理の結果など）では索引は変わらない
+    if update_fields is None or 'content' in update_fields:
+        search.index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def remove_post_search_index(sender, instance, **kwargs):
+    search.remove_post(instance.pk)
+
+
+# 削除された投稿の画像レンディションをストレージから削除
+@receiver(post_delete, sender=Post)
+def delete_post_image_renditions(sender, instance, **kwargs):
+    names = [rendition['name'] for rendition in instance.image_renditions]
+    if names:
+        transaction.on_commit(lambda: images.delete_renditions(names))
+
+
+# 投稿者ごとの投稿一覧（先頭ページ）のキャッシュを破棄
+# 画像処理の結果（image_url）も含むため、保存のたびに破棄する
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_author_timeline(sender, instance, **kwargs):
+    timeline.invalidate(instance.author_id)
+
+
+# 投稿のないユーザーが削除された場合も、キャッシュ済みの空のページを残さない
+@receiver(post_delete, sender=User)
+def invalidate_deleted_user_timeline(sender, instance, **kwargs):
+    timeline.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_author_post_cards(sender, instance, update_fields=None, **kwargs):
+    if not _is_login_update(update_fields):
+        fragments.bump_user(instance.pk)
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def invalidate_author_post_cards_by_profile(sender, instance, **kwargs):
+    fragments.bump_user(instance.user_id)
+
+
+# ロールの一括変更（bulk_update）では post_save が送られないため、まとめて無効化
+@receiver(roles_changed)
+def invalidate_changed_roles(sender, user_ids, **kwargs):
+    presence.invalidate_users(user_ids)
+    invalidate_profiles(user_ids)
+    fragments.bump_users(user_ids)
+
+
+# 管理ダッシュボードの集計
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Post)
+def update_dashboard_on_save(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    if _is_login_update(update_fields):
+        return
+    if created:
+        if sender is User:
+            dashboard.record_activity('signups', instance.date_joined)
+        else:
+            dashboard.record_activity('posts', instance.created_at)
+    dashboard.invalidate_stats()
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Post)
+def update_dashboard_on_delete(sender, instance, **kwargs):
+    if sender is User:
+        dashboard.record_activity('signups', instance.date_joined, delta=-1)
+    else:
+        dashboard.record_activity('posts', instance.created_at, delta=-1)
+    dashboard.invalidate_stats()
+
+
+@receiver(user_logged_out)
+def remove_presence_on_logout(sender, request, user, **kwargs):
+    if user is not None:
+        presence.remove(user.pk)
+
+
+@receiver(post_liked)
+def create_like_notification(sender, post, user, **kwargs):
+    notifications.notify_like(post, user)
+
+
+@receiver(post_save, sender=User)
+def create_user_joined_notifications(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        # 全ユーザーへの書き込みになるためワーカーで実行する
+        jobs.enqueue(tasks.notify_user_joined, instance.pk)
+
+
+@receiver(post_save, sender=UserProfile)
+def generate_profile_avatar(sender, instance, created, raw=False, **kwargs):
+    # 小さなPNGを1枚書くだけなので、表示前に確実に用意できるようその場で生成する
+    if created and not raw:
+        generate_default_avatar(instance)
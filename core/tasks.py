@@ -0,0 +1,12 @@
+from django.contrib.auth.models import User
+
+from . import notifications
+from .jobs import task
+
+
+@task
+def notify_user_joined(user_id):
+    """新規参加通知を全アクティブユーザーへファンアウト"""
+    user = User.objects.filter(pk=user_id).first()
+    if user is not None:
+        notifications.notify_user_joined(user)
@@ -1,3 +1,1045 @@
-from django.test import TestCase
+import asyncio
+import math
+import random
+import re
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.contrib.sessions.backends.cached_db import SessionStore
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.db.models import Q
+from django.template.loader import render_to_string
+from django.test import TestCase, RequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from KokkoSofter.settings import cache_from_url
+from accounts.models import UserProfile
+from posts.fragments import attach_card_fragments
+from posts.models import Post
+from . import cache as cache_module, dashboard, events, geocoding, jobs, notifications, presence
+from .cache import CacheNamespace
+from .middleware import SessionRefreshMiddleware
+from .models import DailyActivity, Job, Notification
+from . import weather
+from .weather import WeatherService, weather_cache
+from .pagination import InvalidCursor, decode_cursor, encode_cursor, paginate_by_cursor
+
+
+class CursorPaginationTests(TestCase):
+    """カーソルの変換とキーセットページネーションを確認"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('author')
+        cls.posts = [Post.objects.create(author=cls.author, content=f'投稿{i}') for i in range(5)]
+        # created_at が同じ投稿も id で順序が決まる
+        Post.objects.filter(pk__in=[post.pk for post in cls.posts[1:3]]).update(created_at=cls.posts[1].created_at)
+
+    def test_encode_decode_roundtrip(self):
+        post = self.posts[0]
+        self.assertEqual(decode_cursor(encode_cursor(post.created_at, post.pk)), (post.created_at, post.pk))
+
+    def test_invalid_cursor(self):
+        valid = encode_cursor(self.posts[0].created_at, self.posts[0].pk)
+        for cursor in ['invalid', '', '!!!', valid[:-3], 'eyJ0IjoxfQ']:
+            with self.subTest(cursor=cursor):
+                with self.assertRaises(InvalidCursor):
+                    decode_cursor(cursor)
+
+    def test_pages_cover_all_posts_once(self):
+        ids = []
+        cursor = None
+        while True:
+            page = paginate_by_cursor(Post.objects.all(), cursor=cursor, page_size=2)
+            ids.extend(post.pk for post in page.items)
+            if not page.has_next:
+                break
+            cursor = page.next_cursor
+
+        expected = list(Post.objects.order_by('-created_at', '-id').values_list('pk', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_last_page_has_no_cursor(self):
+        page = paginate_by_cursor(Post.objects.all(), page_size=5)
+        self.assertEqual(len(page.items), 5)
+        self.assertIsNone(page.next_cursor)
+
+
+@override_settings(FEED_PAGE_SIZE=2)
+class FeedPageViewTests(TestCase):
+    """無限スクロール用エンドポイント（feed_page）を確認"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('viewer', password='password123')
+        self.posts = [Post.objects.create(author=self.user, content=f'投稿{i}') for i in range(3)]
+
+    def test_requires_login(self):
+        response = self.client.get(reverse('feed_page'))
+        self.assertEqual(response.status_code, 302)
+
+    def test_next_page(self):
+        self.client.force_login(self.user)
+        first = self.client.get('/')
+        cursor = first.context['next_cursor']
+        self.assertIsNotNone(cursor)
+
+        response = self.client.get(reverse('feed_page'), {'cursor': cursor})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([post.pk for post in response.context['posts']], [self.posts[0].pk])
+        self.assertIsNone(response.context['next_cursor'])
+        self.assertContains(response, '投稿0')
+        self.assertNotContains(response, 'feed-sentinel')
+
+    def test_invalid_cursor(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('feed_page'), {'cursor': 'invalid'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(FEED_PAGE_SIZE=10)
+class FeedQueryCountTests(TestCase):
+    """タイムライン描画のクエリ数が投稿数に依存しないことを確認"""
+
+    def setUp(self):
+        cache.clear()
+        self.viewer = User.objects.create_user('viewer', password='password123')
+        self.authors = [
+            User.objects.create_user(f'author{i}', password='password123')
+            for i in range(5)
+        ]
+
+    def create_posts(self, count):
+        for i in range(count):
+            post = Post.objects.create(author=self.authors[i % len(self.authors)], content=f'投稿{i}')
+            post.likes.add(*self.authors[:i % 3])
+
+    def render_feed_page(self):
+        request = RequestFactory().get('/api/feed/')
+        request.user = self.viewer
+        page = paginate_by_cursor(Post.objects.for_feed(self.viewer), page_size=10)
+        return render_to_string('posts/post_list_page.html', {
+            'posts': attach_card_fragments(page.items),
+            'next_cursor': page.next_cursor,
+        }, request=request)
+
+    def test_feed_page_renders_in_single_query(self):
+        self.create_posts(10)
+        with self.assertNumQueries(1):
+            self.render_feed_page()
+
+    def test_home_query_count_is_constant(self):
+        self.client.force_login(self.viewer)
+        # 最終アクセス時刻の記録など初回のみの書き込みを済ませておく
+        self.client.get('/')
+
+        self.create_posts(1)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get('/')
+
+        self.create_posts(9)
+        with CaptureQueriesContext(connection) as many:
+            self.client.get('/')
+
+        self.assertEqual(len(few), len(many))
+
+
+class HotQueryIndexTests(TestCase):
+    """よく使われるクエリが索引を使い、全件走査にならないことを EXPLAIN で確認"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create_user(f'user{i}') for i in range(30)]
+        Post.objects.bulk_create([
+            Post(author=cls.users[i % len(cls.users)], content=f'投稿{i}')
+            for i in range(300)
+        ])
+
+    def setUp(self):
+        if connection.vendor == 'postgresql':
+            # 小さなテーブルでは索引があっても Seq Scan が選ばれるため無効化して判定する
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset):
+        plan = queryset.explain()
+        if connection.vendor == 'sqlite':
+            full_scans = re.findall(r'SCAN (\w+)$', plan, flags=re.MULTILINE)
+            self.assertEqual(full_scans, [], plan)
+            self.assertNotIn('USE TEMP B-TREE FOR ORDER BY', plan)
+        elif connection.vendor == 'postgresql':
+            self.assertNotIn('Seq Scan', plan)
+            self.assertNotIn('Sort Key', plan)
+
+    def test_feed_first_page(self):
+        self.assertUsesIndex(Post.objects.for_feed(self.users[0]).order_by('-created_at', '-id')[:21])
+
+    def test_feed_next_page(self):
+        page = paginate_by_cursor(Post.objects.all(), page_size=20)
+        created_at, pk = decode_cursor(page.next_cursor)
+        queryset = Post.objects.for_feed(self.users[0]).order_by('-created_at', '-id').filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+        )
+        self.assertUsesIndex(queryset[:21])
+
+    def test_author_recent_posts(self):
+        self.assertUsesIndex(Post.objects.filter(author=self.users[1]).order_by('-created_at', '-id')[:21])
+
+    def test_online_users_range(self):
+        cutoff = timezone.now() - timedelta(minutes=5)
+        self.assertUsesIndex(UserProfile.objects.filter(last_seen__gte=cutoff))
+
+    def test_notification_list(self):
+        Notification.objects.bulk_create([
+            Notification(recipient=self.users[i % 3], type='system', message=f'通知{i}')
+            for i in range(30)
+        ])
+        self.assertUsesIndex(Notification.objects.filter(recipient=self.users[0])[:5])
+
+    def test_admin_recent_users(self):
+        self.assertUsesIndex(User.objects.order_by('-date_joined')[:5])
+
+
+class CacheFromUrlTests(TestCase):
+    """CACHE_URL からのキャッシュ設定の組み立てを確認"""
+
+    def test_backends(self):
+        self.assertEqual(cache_from_url('locmem://')['BACKEND'], 'django.core.cache.backends.locmem.LocMemCache')
+        self.assertEqual(cache_from_url('locmem://')['LOCATION'], 'kokkosofter')
+
+        redis = cache_from_url('redis://localhost:6379/0')
+        self.assertEqual(redis['BACKEND'], 'django.core.cache.backends.redis.RedisCache')
+        self.assertEqual(redis['LOCATION'], 'redis://localhost:6379/0')
+        self.assertEqual(cache_from_url('rediss://cache.example.com:6380/1')['LOCATION'], 'rediss://cache.example.com:6380/1')
+
+        memcached = cache_from_url('memcached://127.0.0.1:11211')
+        self.assertEqual(memcached['BACKEND'], 'django.core.cache.backends.memcached.PyMemcacheCache')
+        self.assertEqual(memcached['LOCATION'], '127.0.0.1:11211')
+
+        file_cache = cache_from_url('file:///var/tmp/kokkosofter_cache')
+        self.assertEqual(file_cache['BACKEND'], 'django.core.cache.backends.filebased.FileBasedCache')
+        self.assertEqual(file_cache['LOCATION'], '/var/tmp/kokkosofter_cache')
+
+        self.assertEqual(redis['KEY_PREFIX'], 'kokkosofter')
+
+    def test_unknown_scheme(self):
+        with self.assertRaises(ValueError):
+            cache_from_url('mongodb://localhost')
+
+    def test_tests_use_locmem(self):
+        # 本番の既定（Redis）ではなくテストランナーのプロセス内メモリを使う
+        self.assertFalse(cache_module.is_shared_cache())
+
+    def test_file_cache_is_not_shared(self):
+        # ファイルキャッシュは add / incr が不可分でないため共有キャッシュとして扱わない
+        with tempfile.TemporaryDirectory() as location:
+            caches = {'default': {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': location,
+            }}
+            with override_settings(CACHES=caches):
+                self.assertFalse(cache_module.is_shared_cache())
+
+    def test_redis_is_shared(self):
+        with override_settings(CACHES={'default': cache_from_url('redis://localhost:6379/0')}):
+            self.assertTrue(cache_module.is_shared_cache())
+
+
+class CacheNamespaceTests(TestCase):
+    """CacheNamespace のキーの組み立てとヒット・ミスの集計を確認"""
+
+    def setUp(self):
+        cache.clear()
+        cache_module.reset_stats()
+        self.namespace = CacheNamespace('test_namespace', timeout=60, version=2)
+        self.addCleanup(cache_module._namespaces.pop, 'test_namespace')
+
+    def test_key(self):
+        self.assertEqual(self.namespace.key(1), 'test_namespace:v2:1')
+        self.assertEqual(self.namespace.key((1, 'a')), 'test_namespace:v2:1:a')
+
+    def test_hit_and_miss_stats(self):
+        self.assertIsNone(self.namespace.get('missing'))
+        self.namespace.set('present', 'value')
+        self.assertEqual(self.namespace.get('present'), 'value')
+        self.assertEqual(self.namespace.get_many(['present', 'missing', 'other']), {'present': 'value'})
+
+        stats = cache_module.get_stats()['test_namespace']
+        self.assertEqual((stats['hits'], stats['misses']), (2, 3))
+        self.assertAlmostEqual(stats['hit_rate'], 0.4)
+
+        cache_module.reset_stats()
+        self.assertEqual(cache_module.get_stats()['test_namespace'], {'hits': 0, 'misses': 0, 'hit_rate': None})
+
+    def test_stats_flushed_to_shared_cache(self):
+        # STATS_FLUSH_EVERY 回ごとにプロセス内の集計を書き出す
+        for _ in range(cache_module.STATS_FLUSH_EVERY):
+            self.namespace.get('missing')
+        self.assertEqual(cache.get('cache_stats:test_namespace:misses'), cache_module.STATS_FLUSH_EVERY)
+        self.assertIsNone(cache.get('cache_stats:test_namespace:hits'))
+
+    def test_cached_none_is_a_hit(self):
+        self.namespace.set('none', None)
+        self.assertIsNone(self.namespace.get('none', default='default'))
+        self.assertEqual(cache_module.get_stats()['test_namespace']['hits'], 1)
+
+
+@override_settings(SESSION_COOKIE_AGE=1000, SESSION_REFRESH_FRACTION=0.1)
+class SessionRefreshMiddlewareTests(TestCase):
+    """セッションの有効期限の延長が SESSION_COOKIE_AGE * SESSION_REFRESH_FRACTION 秒ごとに間引かれることを確認"""
+
+    def setUp(self):
+        cache.clear()
+        self.middleware = SessionRefreshMiddleware(lambda request: None)
+        self.now = 1_000_000
+
+    def process(self, session, now):
+        request = RequestFactory().get('/')
+        request.session = session
+        with mock.patch('core.middleware.time.time', return_value=now):
+            self.middleware.process_request(request)
+        return session
+
+    def load(self, session_key):
+        # 別リクエストとして読み込み直す（modified は False から始まる）
+        session = SessionStore(session_key)
+        session.load()
+        return session
+
+    def test_refresh_interval(self):
+        session = SessionStore()
+        session['user'] = 1
+        session.create()
+
+        session = self.process(self.load(session.session_key), self.now)
+        self.assertTrue(session.modified)
+        self.assertEqual(session[SessionRefreshMiddleware.REFRESHED_AT_KEY], self.now)
+        session.save()
+
+        # 間隔（1000 * 0.1 = 100秒）未満では変更しない
+        self.assertFalse(self.process(self.load(session.session_key), self.now + 99).modified)
+
+        session = self.process(self.load(session.session_key), self.now + 100)
+        self.assertTrue(session.modified)
+        self.assertEqual(session[SessionRefreshMiddleware.REFRESHED_AT_KEY], self.now + 100)
+
+    def test_empty_session_not_modified(self):
+        self.assertFalse(self.process(SessionStore(), self.now).modified)
+
+    def test_session_saved_only_when_refreshing(self):
+        user = User.objects.create_user('alice')
+        self.client.force_login(user)
+
+        with mock.patch.object(SessionStore, 'save', autospec=True, side_effect=SessionStore.save) as save:
+            with mock.patch('core.middleware.time.time', return_value=self.now):
+                self.client.get(reverse('get_notifications'))
+                self.assertEqual(save.call_count, 1)
+                self.client.get(reverse('get_notifications'))
+                self.assertEqual(save.call_count, 1)
+
+            with mock.patch('core.middleware.time.time', return_value=self.now + 100):
+                response = self.client.get(reverse('get_notifications'))
+            self.assertEqual(save.call_count, 2)
+        # 保存したときは Cookie も再発行され、ブラウザ側の有効期限も延びる
+        self.assertIn(settings.SESSION_COOKIE_NAME, response.cookies)
+
+
+@override_settings(PRESENCE_ONLINE_WINDOW=300)
+class CachePresenceBackendTests(TestCase):
+    """キャッシュ上のプレゼンス（オンラインユーザー）の更新と取得を確認"""
+
+    def setUp(self):
+        cache.clear()
+        self.backend = presence.CachePresenceBackend()
+        self.now = 1_000_000.0
+
+    def test_touch_reports_newly_online(self):
+        self.assertTrue(self.backend.touch(1, self.now))
+        self.assertFalse(self.backend.touch(1, self.now + 60))
+        # オンラインとみなす期間を過ぎてからのアクセスは新たなオンライン
+        self.assertTrue(self.backend.touch(1, self.now + 60 + 301))
+
+    def test_members_since_orders_by_score(self):
+        self.backend.touch(1, self.now - 400)
+        self.backend.touch(2, self.now - 100)
+        self.backend.touch(3, self.now - 10)
+        self.backend.touch(2, self.now)
+
+        members = self.backend.members_since(self.now - 300)
+        self.assertEqual(members, [(2, self.now), (3, self.now - 10)])
+
+    def test_updates_from_other_workers_are_kept(self):
+        # 別プロセスのバックエンドからの更新が互いを上書きしない
+        other = presence.CachePresenceBackend()
+        self.backend.touch(1, self.now)
+        other.touch(2, self.now + 1)
+        self.backend.touch(3, self.now + 2)
+        self.assertEqual([user_id for user_id, _ in other.members_since(self.now - 300)], [3, 2, 1])
+
+    def test_remove(self):
+        self.backend.touch(1, self.now)
+        self.assertTrue(self.backend.remove(1))
+        self.assertFalse(self.backend.remove(1))
+        self.assertEqual(self.backend.members_since(self.now - 300), [])
+
+    def test_online_members(self):
+        presence.touch(1, now=self.now)
+        presence.touch(2, now=self.now + 5)
+        self.assertEqual(presence.online_members(exclude=2, now=self.now + 10), [(1, self.now)])
+        self.assertEqual(presence.online_members(now=self.now + 301), [(2, self.now + 5)])
+
+    def test_touch_broadcasts_user_payload(self):
+        user = User.objects.create_user('alice')
+        with mock.patch.object(events, 'broadcast') as broadcast:
+            presence.touch(user.pk, now=self.now)
+            presence.touch(user.pk, now=self.now + 10)
+            presence.remove(user.pk)
+
+        # 新たにオンラインになったときだけ、クライアントが一覧に追加できる表示データを送る
+        self.assertEqual(broadcast.call_count, 2)
+        event, data = broadcast.call_args_list[0].args
+        self.assertEqual(event, 'presence')
+        self.assertEqual(data['user_id'], user.pk)
+        self.assertTrue(data['online'])
+        self.assertEqual(data['user']['username'], 'alice')
+        self.assertEqual(data['user']['user_id'], user.pk)
+        self.assertEqual(data['user']['last_seen'], datetime.fromtimestamp(self.now, tz=dt_timezone.utc).isoformat())
+        self.assertEqual(broadcast.call_args_list[1].args, ('presence', {'user_id': user.pk, 'online': False}))
+
+    def test_online_users_api(self):
+        alice = User.objects.create_user('alice')
+        bob = User.objects.create_user('bob')
+        presence.touch(alice.pk)
+        presence.touch(bob.pk)
+
+        self.client.force_login(bob)
+        data = self.client.get(reverse('get_online_users')).json()
+        self.assertEqual([user['user_id'] for user in data['users']], [alice.pk])
+        self.assertEqual(data['online_window'], settings.PRESENCE_ONLINE_WINDOW)
+        self.assertIn('server_time', data)
+
+    @override_settings(PRESENCE_REDIS_URL='')
+    def test_redis_backend_requires_url(self):
+        with self.assertRaises(ImproperlyConfigured):
+            presence.RedisPresenceBackend()
+
+
+class LikeNotificationTests(TestCase):
+    """いいね通知の作成（重複しないこと・未読件数の更新）を確認"""
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user('author')
+        self.liker = User.objects.create_user('liker')
+        self.post = Post.objects.create(author=self.author, content='投稿')
+
+    def like_notifications(self):
+        return Notification.objects.filter(recipient=self.author, type='like')
+
+    def test_notified_once_per_actor_and_post(self):
+        self.assertEqual(notifications.get_unread_count(self.author.pk), 0)
+        self.assertIsNotNone(notifications.notify_like(self.post, self.liker))
+        self.assertIsNone(notifications.notify_like(self.post, self.liker))
+
+        self.assertEqual(self.like_notifications().count(), 1)
+        self.assertEqual(notifications.get_unread_count(self.author.pk), 1)
+
+    def test_like_toggle_does_not_duplicate(self):
+        self.post.toggle_like(self.liker)
+        self.post.toggle_like(self.liker)
+        self.post.toggle_like(self.liker)
+        self.assertEqual(self.like_notifications().count(), 1)
+
+    def test_own_post_is_not_notified(self):
+        self.assertIsNone(notifications.notify_like(self.post, self.author))
+        self.assertFalse(self.like_notifications().exists())
+
+    def test_unique_constraint(self):
+        notifications.notify_like(self.post, self.liker)
+        with self.assertRaises(IntegrityError):
+            Notification.objects.create(
+                recipient=self.author, actor=self.liker, post=self.post, type='like', message='重複',
+            )
+
+
+class InProcessBrokerTests(TestCase):
+    """プロセス内ブローカーの購読・配信を確認"""
+
+    def test_publish_reaches_subscribed_channels_only(self):
+        async def scenario():
+            broker = events.InProcessBroker()
+            subscription = await broker.subscribe(['broadcast', 'user:1'])
+            broker.publish('user:2', 'notification', {'id': 2})
+            broker.publish('user:1', 'notification', {'id': 1})
+            first = await subscription.get(timeout=1)
+            second = await subscription.get(timeout=0.05)
+            await subscription.close()
+            return first, second, broker._subscribers
+
+        first, second, subscribers = asyncio.run(scenario())
+        self.assertEqual(first, {'event': 'notification', 'data': {'id': 1}})
+        self.assertIsNone(second)
+        self.assertEqual(dict(subscribers), {})
+
+    def test_publish_from_other_thread(self):
+        async def scenario():
+            broker = events.InProcessBroker()
+            subscription = await broker.subscribe(['broadcast'])
+            thread = threading.Thread(target=broker.publish, args=('broadcast', 'presence', {'online': True}))
+            thread.start()
+            message = await subscription.get(timeout=1)
+            thread.join()
+            await subscription.close()
+            return message
+
+        self.assertEqual(asyncio.run(scenario()), {'event': 'presence', 'data': {'online': True}})
+
+    @override_settings(EVENT_STREAM_QUEUE_SIZE=2)
+    def test_slow_subscriber_drops_events(self):
+        async def scenario():
+            broker = events.InProcessBroker()
+            subscription = await broker.subscribe(['broadcast'])
+            for i in range(5):
+                broker.publish('broadcast', 'like', {'n': i})
+            await asyncio.sleep(0)
+            received = []
+            while (message := await subscription.get(timeout=0.05)) is not None:
+                received.append(message['data']['n'])
+            await subscription.close()
+            return received
+
+        self.assertEqual(asyncio.run(scenario()), [0, 1])
+
+    @override_settings(EVENT_BROKER='core.events.InProcessBroker')
+    def test_asgi_requires_redis_broker(self):
+        with self.assertRaises(ImproperlyConfigured):
+            events.check_asgi_broker()
+
+    @override_settings(EVENT_BROKER='core.events.RedisBroker', EVENT_BROKER_URL='')
+    def test_asgi_requires_broker_url(self):
+        events.get_broker.cache_clear()
+        try:
+            with self.assertRaises(ImproperlyConfigured):
+                events.check_asgi_broker()
+        finally:
+            events.get_broker.cache_clear()
+
+
+class EventStreamViewTests(TestCase):
+    """Server-Sent Events エンドポイントを確認"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', password='password123')
+
+    def test_wsgi_request_is_rejected(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('event_stream'))
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(response.json()['success'])
+
+    def test_login_required(self):
+        response = self.client.get(reverse('event_stream'))
+        self.assertEqual(response.status_code, 302)
+
+    async def test_stream_delivers_user_and_broadcast_events(self):
+        events.get_broker.cache_clear()
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('event_stream'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        content = aiter(response.streaming_content)
+        self.assertTrue((await anext(content)).startswith(b'retry: '))
+
+        # 購読の開始を待ってから送信する
+        next_chunk = asyncio.ensure_future(anext(content))
+        await asyncio.sleep(0.01)
+        events.send_to_user(self.user.pk + 1, 'notification', {'message': '他人宛て'})
+        events.send_to_user(self.user.pk, 'notification', {'message': 'いいねされました'})
+        chunk = (await asyncio.wait_for(next_chunk, 1)).decode()
+        self.assertEqual(chunk, 'event: notification\ndata: {"message": "いいねされました"}\n\n')
+
+        next_chunk = asyncio.ensure_future(anext(content))
+        events.broadcast('presence', {'user_id': 1, 'online': True})
+        chunk = (await asyncio.wait_for(next_chunk, 1)).decode()
+        self.assertTrue(chunk.startswith('event: presence\n'))
+        await content.aclose()
+
+
+class LiveEventsScriptTests(TestCase):
+    """live-events.js（/api/events/ への接続）は EVENT_STREAM_ENABLED のときだけ読み込むことを確認"""
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_user('alice'))
+
+    @override_settings(EVENT_STREAM_ENABLED=False)
+    def test_not_loaded_when_disabled(self):
+        self.assertNotContains(self.client.get(reverse('home')), 'js/live-events.js')
+
+    @override_settings(EVENT_STREAM_ENABLED=True)
+    def test_loaded_when_enabled(self):
+        self.assertContains(self.client.get(reverse('home')), 'js/live-events.js')
+
+
+class WeatherCacheTests(TestCase):
+    """天気APIのキャッシュ（single-flight と stale-while-revalidate）を確認"""
+
+    def setUp(self):
+        cache.clear()
+        self.service = WeatherService()
+        self.calls = []
+        self.release = threading.Event()
+        self.release.set()
+
+        def fetch(lat, lon, deadline=None):
+            self.calls.append((lat, lon, deadline))
+            self.release.wait(1)
+            return {'temp': len(self.calls)}
+
+        patcher = mock.patch.object(self.service, '_fetch_current_weather', side_effect=fetch)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_cached_after_first_fetch(self):
+        self.assertEqual(self.service._cached_fetch('current:35.7:139.7', 600), {'temp': 1})
+        self.assertEqual(self.service._cached_fetch('current:35.7:139.7', 600), {'temp': 1})
+        self.assertEqual(self.calls, [(35.7, 139.7, None)])
+
+    def test_concurrent_misses_share_one_fetch(self):
+        self.release.clear()
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(self.service._cached_fetch('current:35.7:139.7', 600)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(results, [{'temp': 1}] * 5)
+
+    @override_settings(WEATHER_REQUEST_DEADLINE=4.0)
+    def test_stale_value_is_returned_and_refreshed_in_background(self):
+        weather_cache.set('current:35.7:139.7', {'value': {'temp': 0}, 'fresh_until': time.time() - 1}, timeout=600)
+        expired_deadline = time.monotonic() - 10
+
+        with mock.patch('core.weather.threading.Thread') as thread_class:
+            value = self.service._cached_fetch('current:35.7:139.7', 600, expired_deadline)
+            # 再取得中は2回目のリクエストで再度スレッドを起動しない
+            self.service._cached_fetch('current:35.7:139.7', 600, expired_deadline)
+        self.assertEqual(value, {'temp': 0})
+        self.assertEqual(thread_class.call_count, 1)
+
+        # 再取得はキーから組み立て直し、きっかけのリクエストの期限を使わない
+        self.service._refresh(*thread_class.call_args.kwargs['args'])
+        (lat, lon, deadline), = self.calls
+        self.assertEqual((lat, lon), (35.7, 139.7))
+        self.assertGreater(deadline, time.monotonic())
+        self.assertEqual(weather_cache.get('current:35.7:139.7')['value'], {'temp': 1})
+        self.assertIsNone(weather_cache.get('current:35.7:139.7:refresh'))
+
+    def test_failed_fetch_is_not_cached(self):
+        self.service._fetch_current_weather.side_effect = lambda lat, lon, deadline=None: None
+        self.assertIsNone(self.service._cached_fetch('current:35.7:139.7', 600))
+        self.assertIsNone(weather_cache.get('current:35.7:139.7'))
+
+
+class WeatherDeadlineTests(TestCase):
+    """上流APIの呼び出しが期限（WEATHER_REQUEST_DEADLINE）に収まることを確認"""
+
+    def setUp(self):
+        cache.clear()
+        self.session = mock.Mock()
+        for target, kwargs in (('get_http_session', {'return_value': self.session}), ('time.sleep', {})):
+            patcher = mock.patch(f'core.weather.{target}', **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def respond(self, *status_codes):
+        self.session.get.side_effect = [mock.Mock(status_code=code) for code in status_codes]
+
+    def test_request_timeout_is_capped_by_deadline(self):
+        connect, read = weather._request_timeout(time.monotonic() + 2, 10)
+        self.assertLessEqual(read, 2)
+        self.assertLessEqual(connect, read)
+        self.assertEqual(weather._request_timeout(time.monotonic() - 1, 10), (0.1, 0.1))
+
+    def test_retries_transient_errors(self):
+        self.respond(503, 502, 200)
+        response = weather.http_get('https://example.com', {}, None, 10)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.session.get.call_count, 3)
+
+    def test_retry_count_limited(self):
+        self.respond(503, 503, 503, 200)
+        self.assertEqual(weather.http_get('https://example.com', {}, None, 10).status_code, 503)
+        self.assertEqual(self.session.get.call_count, weather.MAX_RETRIES + 1)
+
+    def test_no_retry_past_deadline(self):
+        self.respond(503, 200)
+        response = weather.http_get('https://example.com', {}, time.monotonic() + 0.5, 10)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.session.get.call_count, 1)
+
+        self.session.get.side_effect = weather.requests.exceptions.ConnectionError()
+        with self.assertRaises(weather.requests.exceptions.ConnectionError):
+            weather.http_get('https://example.com', {}, time.monotonic() + 0.5, 10)
+
+    @override_settings(WEATHER_REQUEST_DEADLINE=0.2, GEOCODE_USE_NOMINATIM=False)
+    def test_slow_upstream_falls_back_within_deadline(self):
+        service = WeatherService()
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def slow_fetch(lat, lon, deadline=None):
+            release.wait(2)
+            return None
+
+        with mock.patch.object(service, '_fetch_current_weather', side_effect=slow_fetch):
+            started = time.monotonic()
+            result = service.get_weather_by_location(35.68, 139.76)
+        # 上流の応答を待たずに、期限内で代替の天気情報を返す
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(result['temperature'], '--°C')
+        self.assertNotEqual(result['city'], '')
+
+    def test_follower_waits_only_until_deadline(self):
+        service = WeatherService()
+        release = threading.Event()
+        self.addCleanup(release.set)
+        started_leader = threading.Event()
+
+        def slow_fetch():
+            started_leader.set()
+            release.wait(5)
+            return {'temperature': '20°C'}
+
+        leader = threading.Thread(target=service._single_flight, args=('current:35.7:139.8', 60, slow_fetch))
+        leader.start()
+        self.addCleanup(leader.join)
+        started_leader.wait(1)
+
+        follower_fetch = mock.Mock()
+        started = time.monotonic()
+        result = service._single_flight('current:35.7:139.8', 60, follower_fetch, time.monotonic() + 0.2)
+        # 先行呼び出しの完了（WEATHER_SINGLE_FLIGHT_WAIT）まで待たず、期限で諦める
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertIsNone(result)
+        follower_fetch.assert_not_called()
+
+        # キャッシュに値があれば、それを返す
+        weather_cache.set('current:35.7:139.8', {'value': {'temperature': '18°C'}, 'fresh_until': 0})
+        result = service._single_flight('current:35.7:139.8', 60, follower_fetch, time.monotonic() + 0.1)
+        self.assertEqual(result, {'temperature': '18°C'})
+
+        release.set()
+
+
+class KDTreeTests(TestCase):
+    """k-d 木の最近傍探索が全件走査と一致することを確認"""
+
+    def test_nearest_matches_brute_force_3d(self):
+        rng = random.Random(1)
+        points = [tuple(rng.uniform(0, 100) for _ in range(3)) for _ in range(500)]
+        tree = geocoding.KDTree(points)
+        for _ in range(200):
+            target = tuple(rng.uniform(-10, 110) for _ in range(3))
+            expected = min(range(len(points)), key=lambda i: math.dist(points[i], target))
+            self.assertEqual(tree.nearest(target)[0], expected)
+
+    def test_nearest_matches_brute_force(self):
+        rng = random.Random(0)
+        points = [(rng.uniform(0, 100), rng.uniform(0, 100)) for _ in range(500)]
+        tree = geocoding.KDTree(points)
+        for _ in range(200):
+            target = (rng.uniform(-10, 110), rng.uniform(-10, 110))
+            expected = min(range(len(points)), key=lambda i: math.dist(points[i], target))
+            index, distance = tree.nearest(target)
+            self.assertEqual(index, expected)
+            self.assertAlmostEqual(distance, math.dist(points[expected], target))
+
+    def test_empty_tree(self):
+        self.assertEqual(geocoding.KDTree([]).nearest((0, 0)), (None, math.inf))
+
+
+class MunicipalityIndexTests(TestCase):
+    """同梱データによる逆ジオコーディングを確認"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.index = geocoding.get_index()
+        with open(geocoding.DATA_FILE, encoding='utf-8', newline='') as f:
+            cls.rows = list(geocoding.csv.DictReader(f))
+
+    def test_covers_all_municipalities(self):
+        # 全市町村（北方領土の6村を含む）と東京23区、政令指定都市は区単位
+        self.assertEqual(len(self.rows), 1902)
+        self.assertEqual(len({row['prefecture'] for row in self.rows}), 47)
+        self.assertFalse([row for row in self.rows if row['city'] in ('札幌市', '横浜市', '大阪市')])
+
+    def test_lookup_near_office(self):
+        self.assertEqual(self.index.lookup(35.6940, 139.7536), {'prefecture': '東京都', 'city': '千代田区'})
+        self.assertEqual(self.index.lookup(26.2125, 127.6811), {'prefecture': '沖縄県', 'city': '那覇市'})
+        self.assertEqual(self.index.lookup(43.0554, 141.3410), {'prefecture': '北海道', 'city': '札幌市中央区'})
+
+    def test_lookup_across_prefecture_border(self):
+        # 多摩川を挟んだ地点は、それぞれ近い側の都県の区になる
+        self.assertEqual(self.index.lookup(35.5615, 139.7160)['prefecture'], '東京都')
+        self.assertEqual(self.index.lookup(35.5308, 139.7029)['prefecture'], '神奈川県')
+
+    def haversine_km(self, lat1, lon1, lat2, lon2):
+        phi1, phi2 = math.radians(lat1), math.radians(lat2)
+        a = (math.sin((phi2 - phi1) / 2) ** 2
+             + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+        return 2 * 6371.0 * math.asin(math.sqrt(a))
+
+    def assert_matches_haversine_brute_force(self, lat, lon):
+        distances = [
+            self.haversine_km(lat, lon, float(row['lat']), float(row['lon'])) for row in self.rows
+        ]
+        nearest = min(range(len(self.rows)), key=distances.__getitem__)
+        result = self.index.lookup(lat, lon)
+        if distances[nearest] > geocoding.MAX_DISTANCE_KM:
+            self.assertIsNone(result, (lat, lon))
+        else:
+            self.assertEqual(
+                result, {'prefecture': self.rows[nearest]['prefecture'], 'city': self.rows[nearest]['city']}, (lat, lon),
+            )
+
+    def test_lookup_matches_brute_force(self):
+        # 球面上の距離（ハバーサイン）で全件走査した最寄りと一致する
+        rng = random.Random(0)
+        for _ in range(200):
+            self.assert_matches_haversine_brute_force(rng.uniform(24, 46), rng.uniform(122, 146))
+        # 役所・役場の近く（隣接する市区町村との境界付近）
+        for row in rng.sample(self.rows, 300):
+            self.assert_matches_haversine_brute_force(
+                float(row['lat']) + rng.uniform(-0.05, 0.05), float(row['lon']) + rng.uniform(-0.05, 0.05),
+            )
+
+    def test_distance_is_not_sheared_by_longitude(self):
+        # 経度が同じで緯度が1度違う2点は約111km（経度の大きさによって伸びない）
+        a, b = geocoding._to_xyz(35, 139), geocoding._to_xyz(36, 139)
+        self.assertAlmostEqual(geocoding._chord_to_km(math.dist(a, b)), 111.2, delta=0.5)
+
+    def test_outside_japan(self):
+        self.assertIsNone(self.index.lookup(30.0, 140.0))
+        self.assertIsNone(self.index.lookup(37.5665, 126.9780))
+
+
+job_calls = []
+
+
+@jobs.task(name='core.tests.record_call')
+def record_call(value):
+    job_calls.append(value)
+
+
+@jobs.task(name='core.tests.always_fail')
+def always_fail():
+    raise RuntimeError('失敗しました')
+
+
+@override_settings(TASK_QUEUE_EAGER=False, TASK_MAX_ATTEMPTS=3, TASK_RETRY_BACKOFF=10, TASK_VISIBILITY_TIMEOUT=300)
+class JobQueueTests(TestCase):
+    """データベースのジョブキュー（取得・再試行・失敗・即時実行）を確認"""
+
+    def setUp(self):
+        job_calls.clear()
+        # enqueue した直後のジョブが実行可能になる時刻
+        self.now = timezone.now() + timedelta(seconds=1)
+
+    def test_enqueue_unknown_task(self):
+        with self.assertRaises(jobs.UnknownTask):
+            jobs.enqueue('core.tests.missing')
+
+    def test_claim_is_exclusive(self):
+        job = jobs.enqueue(record_call, 1)
+        claimed = jobs.claim(job.pk, self.now)
+        self.assertEqual((claimed.status, claimed.attempts), ('running', 1))
+        # 他のワーカーは実行中のジョブを取得できない
+        self.assertIsNone(jobs.claim(job.pk, self.now))
+        self.assertEqual(jobs.claim_batch(now=self.now), [])
+
+    def test_running_job_is_reclaimed_after_visibility_timeout(self):
+        job = jobs.enqueue(record_call, 1)
+        jobs.claim(job.pk, self.now)
+        self.assertIsNone(jobs.claim(job.pk, self.now + timedelta(seconds=299)))
+        reclaimed = jobs.claim(job.pk, self.now + timedelta(seconds=301))
+        self.assertEqual(reclaimed.attempts, 2)
+
+    def test_claim_batch_order_and_delay(self):
+        later = jobs.enqueue(record_call, 'later', delay=timedelta(minutes=5))
+        first = jobs.enqueue(record_call, 'first')
+        second = jobs.enqueue(record_call, 'second')
+        claimed = jobs.claim_batch(limit=1, now=self.now) + jobs.claim_batch(now=self.now)
+        self.assertEqual([job.pk for job in claimed], [first.pk, second.pk])
+        for job in claimed:
+            jobs.run_job(job)
+        self.assertEqual([job.pk for job in jobs.claim_batch(now=self.now + timedelta(minutes=6))], [later.pk])
+
+    def test_success(self):
+        job = jobs.enqueue(record_call, 'ok')
+        self.assertTrue(jobs.run_job(jobs.claim(job.pk)))
+        self.assertEqual(job_calls, ['ok'])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_until), ('done', None))
+
+    def test_retry_with_exponential_backoff(self):
+        job = jobs.enqueue(always_fail)
+
+        self.assertFalse(jobs.run_job(jobs.claim(job.pk)))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('pending', 1))
+        self.assertIn('RuntimeError', job.last_error)
+        self.assertAlmostEqual((job.run_at - timezone.now()).total_seconds(), 10, delta=2)
+        # 待機時間が過ぎるまでは取得されない
+        self.assertIsNone(jobs.claim(job.pk))
+
+        jobs.run_job(jobs.claim(job.pk, job.run_at))
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 2)
+        self.assertAlmostEqual((job.run_at - timezone.now()).total_seconds(), 20, delta=2)
+
+    def test_failed_after_max_attempts(self):
+        job = jobs.enqueue(always_fail, max_attempts=2)
+        jobs.run_job(jobs.claim(job.pk))
+        job.refresh_from_db()
+        jobs.run_job(jobs.claim(job.pk, job.run_at))
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.locked_until), ('failed', 2, None))
+        # 失敗したジョブは再取得されない
+        self.assertIsNone(jobs.claim(job.pk, self.now + timedelta(days=1)))
+
+    def test_not_run_without_worker(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            job = jobs.enqueue(record_call, 'queued')
+        self.assertEqual(job_calls, [])
+        self.assertEqual(Job.objects.get(pk=job.pk).status, 'pending')
+
+    @override_settings(TASK_QUEUE_EAGER=True)
+    def test_eager_runs_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            job = jobs.enqueue(record_call, 'eager')
+            self.assertEqual(job_calls, [])
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(job_calls, ['eager'])
+        self.assertEqual(Job.objects.get(pk=job.pk).status, 'done')
+
+    def test_run_worker_once(self):
+        jobs.enqueue(record_call, 'a')
+        jobs.enqueue(record_call, 'b')
+        out = StringIO()
+        with mock.patch('core.management.commands.run_worker.signal.signal'):
+            call_command('run_worker', '--once', '--purge-after=0', stdout=out)
+        self.assertEqual(job_calls, ['a', 'b'])
+        self.assertIn('2件', out.getvalue())
+
+    def test_purge_finished(self):
+        done = jobs.enqueue(record_call, 'old')
+        jobs.run_job(jobs.claim(done.pk))
+        pending = jobs.enqueue(record_call, 'pending')
+        Job.objects.filter(pk=done.pk).update(updated_at=self.now - timedelta(days=8))
+
+        self.assertEqual(jobs.purge_finished(timedelta(days=7)), 1)
+        self.assertEqual(list(Job.objects.values_list('pk', flat=True)), [pending.pk])
+
+
+class DashboardTests(TestCase):
+    """管理ダッシュボードの統計（集計クエリとキャッシュの無効化）と日別集計を確認"""
+
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser('admin', is_staff=True)
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob', is_active=False)
+        self.post = Post.objects.create(author=self.alice, content='投稿')
+
+    def test_stats_single_aggregate_and_cached(self):
+        with CaptureQueriesContext(connection) as queries:
+            stats = dashboard.get_stats()
+        self.assertEqual(stats, {
+            'total_users': 3, 'active_users': 2, 'staff_users': 1, 'superusers': 1, 'total_posts': 1,
+        })
+        # ユーザーの4項目は1回の条件付き集計で求める（投稿数と合わせて2クエリ）
+        user_queries = [q['sql'] for q in queries.captured_queries if '"auth_user"' in q['sql']]
+        self.assertEqual(len(user_queries), 1)
+        self.assertEqual(len(queries.captured_queries), 2)
+
+        with self.assertNumQueries(0):
+            dashboard.get_stats()
+
+    def test_stats_invalidated_on_save_and_delete(self):
+        dashboard.get_stats()
+        User.objects.create_user('carol')
+        self.assertEqual(dashboard.get_stats()['total_users'], 4)
+
+        self.bob.is_active = True
+        self.bob.save()
+        self.assertEqual(dashboard.get_stats()['active_users'], 4)
+
+        Post.objects.create(author=self.bob, content='投稿2')
+        self.assertEqual(dashboard.get_stats()['total_posts'], 2)
+
+        self.post.delete()
+        self.assertEqual(dashboard.get_stats()['total_posts'], 1)
+
+        self.bob.delete()
+        self.assertEqual(dashboard.get_stats()['total_users'], 3)
+
+    def test_login_does_not_invalidate(self):
+        dashboard.get_stats()
+        self.alice.last_login = timezone.now()
+        self.alice.save(update_fields=['last_login'])
+        with self.assertNumQueries(0):
+            dashboard.get_stats()
+
+    def test_daily_activity_recorded_by_signals(self):
+        today = timezone.localdate()
+        row = DailyActivity.objects.get(date=today)
+        self.assertEqual((row.signups, row.posts), (3, 1))
+
+        Post.objects.create(author=self.bob, content='投稿2')
+        self.post.delete()
+        self.bob.delete()  # bob の投稿も削除される
+        row.refresh_from_db()
+        self.assertEqual((row.signups, row.posts), (2, 0))
+
+        activity = dashboard.get_daily_activity(3)
+        self.assertEqual([day['date'] for day in activity], [today - timedelta(days=2), today - timedelta(days=1), today])
+        self.assertEqual(activity[0], {'date': today - timedelta(days=2), 'signups': 0, 'posts': 0})
+        self.assertEqual(activity[-1], {'date': today, 'signups': 2, 'posts': 0})
+
+    def test_rebuild_command(self):
+        yesterday = timezone.now() - timedelta(days=1)
+        # update() はシグナルを送らないため、日別集計とずれた状態になる
+        User.objects.filter(pk=self.alice.pk).update(date_joined=yesterday)
+        Post.objects.filter(pk=self.post.pk).update(created_at=yesterday)
+        DailyActivity.objects.create(date=timezone.localdate() - timedelta(days=10), signups=5)
+
+        out = StringIO()
+        call_command('rebuild_daily_activity', stdout=out)
+        self.assertIn('2日分', out.getvalue())
+
+        self.assertEqual(
+            {row.date: (row.signups, row.posts) for row in DailyActivity.objects.all()},
+            {timezone.localdate(yesterday): (1, 1), timezone.localdate(): (2, 0)},
+        )
@@ -3,7 +3,10 @@ from . import views
 
 urlpatterns = [
     path('', views.home, name='home'),
+    path('api/feed/', views.feed_page, name='feed_page'),
     path('api/weather/', views.get_weather, name='get_weather'),
     path('api/online-users/', views.get_online_users, name='get_online_users'),
     path('api/notifications/', views.get_notifications, name='get_notifications'),
+    path('api/notifications/read/', views.mark_notifications_read, name='mark_notifications_read'),
+    path('api/events/', views.event_stream, name='event_stream'),
 ]
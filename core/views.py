@@ -1,17 +1,58 @@
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import JsonResponse, HttpResponseBadRequest, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.conf import settings
 from django.views.decorators.http import require_http_methods
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.utils import timezone
+from django.utils.timesince import timesince
 from datetime import timedelta
+from posts.fragments import attach_card_fragments
 from posts.models import Post
-from .weather import WeatherService
+from .weather import weather_service
+from .pagination import paginate_by_cursor, InvalidCursor
+from . import events, notifications, presence
+from .models import Notification
 import json
 
 def home(request):
-    posts = Post.objects.order_by('-created_at')
-    return render(request, 'home.html', {'posts': posts})
+    context = {}
+    if request.user.is_authenticated:
+        try:
+            page = paginate_by_cursor(
+                Post.objects.for_feed(request.user),
+                cursor=request.GET.get('cursor'),
+                page_size=settings.FEED_PAGE_SIZE,
+            )
+        except InvalidCursor:
+            # 不正なカーソルは先頭ページとして扱う
+            page = paginate_by_cursor(Post.objects.for_feed(request.user), page_size=settings.FEED_PAGE_SIZE)
+        context = {
+            'posts': attach_card_fragments(page.items),
+            'next_cursor': page.next_cursor,
+        }
+    return render(request, 'home.html', context)
+
+@login_required
+@require_http_methods(["GET"])
+def feed_page(request):
+    """
+    無限スクロール用に次ページの投稿カードをHTML断片で返すエンドポイント
+    """
+    try:
+        page = paginate_by_cursor(
+            Post.objects.for_feed(request.user),
+            cursor=request.GET.get('cursor'),
+            page_size=settings.FEED_PAGE_SIZE,
+        )
+    except InvalidCursor:
+        return HttpResponseBadRequest('カーソルが無効です')
+
+    return render(request, 'posts/post_list_page.html', {
+        'posts': attach_card_fragments(page.items),
+        'next_cursor': page.next_cursor,
+    })
 
 @require_http_methods(["POST"])
 def get_weather(request):
@@ -23,7 +64,6 @@ def get_weather(request):
         lat = float(data.get('lat'))
         lon = float(data.get('lon'))
         
-        weather_service = WeatherService()
         weather_data = weather_service.get_weather_by_location(lat, lon)
         
         if weather_data:
@@ -55,29 +95,16 @@ def get_online_users(request):
     オンラインユーザー一覧を取得するAPIエンドポイント
     """
     try:
-        # 過去5分以内にアクティブだったユーザーをオンラインとみなす
-        online_threshold = timezone.now() - timedelta(minutes=5)
-        
-        # プロフィールのlast_seenを使用してオンラインユーザーを取得
-        online_users = User.objects.filter(
-            profile__last_seen__gte=online_threshold,
-            is_active=True
-        ).exclude(id=request.user.id).select_related('profile')[:10]  # 最大10人まで表示
-        
-        users_data = []
-        for user in online_users:
-            users_data.append({
-                'username': user.username,
-                'avatar_url': user.profile.get_avatar_url() if hasattr(user, 'profile') else '/static/images/default-avatar.png',
-                'role_badge_class': user.profile.get_role_badge_class() if hasattr(user, 'profile') else 'badge-secondary',
-                'role_icon': user.profile.get_role_display_with_icon() if hasattr(user, 'profile') else '👤',
-                'last_seen': user.profile.last_seen.isoformat() if hasattr(user, 'profile') else None
-            })
-        
+        # プレゼンス情報（キャッシュ）から直近にアクティブだったユーザーを取得
+        users_data = presence.get_online_users(exclude=request.user.id, limit=10)  # 最大10人まで表示
+
         return JsonResponse({
             'success': True,
             'users': users_data,
-            'total_count': len(users_data)
+            'total_count': len(users_data),
+            # クライアント側で last_seen から期限切れのユーザーを外すために使う
+            'online_window': settings.PRESENCE_ONLINE_WINDOW,
+            'server_time': timezone.now().isoformat(),
         })
         
     except Exception as e:
@@ -86,6 +113,12 @@ def get_online_users(request):
             'error': 'オンラインユーザー情報を取得できませんでした'
         }, status=500)
 
+def _time_ago(value):
+    """通知表示用の相対時刻（1分未満は「たった今」）"""
+    if timezone.now() - value < timedelta(minutes=1):
+        return 'たった今'
+    return f'{timesince(value)}前'
+
 @login_required
 @require_http_methods(["GET"])
 def get_notifications(request):
@@ -93,37 +126,25 @@ def get_notifications(request):
     通知一覧を取得するAPIエンドポイント
     """
     try:
-        # 実際の通知システムが実装されるまでは、最近の投稿からサンプル通知を生成
-        notifications_data = []
-        
-        # 最近の投稿から通知を生成（例：いいねやコメント）
-        recent_posts = Post.objects.filter(author=request.user).order_by('-created_at')[:3]
-        
-        for post in recent_posts:
-            if post.likes.count() > 0:
-                notifications_data.append({
-                    'message': f'あなたの投稿「{post.content[:20]}...」にいいねがつきました',
-                    'type': 'like',
-                    'time_ago': '5分前',
-                    'read': False
-                })
-        
-        # 新しいユーザーの参加通知
-        new_users = User.objects.filter(
-            date_joined__gte=timezone.now() - timedelta(days=1)
-        ).exclude(id=request.user.id)[:2]
-        
-        for user in new_users:
-            notifications_data.append({
-                'message': f'{user.username} さんが参加しました',
-                'type': 'user_joined',
-                'time_ago': '1時間前',
-                'read': False
-            })
+        # (recipient, created_at) インデックスを使った1回の読み取り
+        recent = Notification.objects.filter(recipient=request.user).only(
+            'type', 'message', 'read', 'created_at'
+        )[:5]
+
+        notifications_data = [
+            {
+                'message': notification.message,
+                'type': notification.type,
+                'time_ago': _time_ago(notification.created_at),
+                'read': notification.read,
+            }
+            for notification in recent
+        ]
         
         return JsonResponse({
             'success': True,
-            'notifications': notifications_data[:5]  # 最大5件まで表示
+            'notifications': notifications_data,  # 最大5件まで表示
+            'unread_count': notifications.get_unread_count(request.user.id),
         })
         
     except Exception as e:
@@ -131,3 +152,52 @@ def get_notifications(request):
             'success': False,
             'error': '通知情報を取得できませんでした'
         }, status=500)
+
+@login_required
+@require_http_methods(["POST"])
+def mark_notifications_read(request):
+    """
+    通知をすべて既読にするAPIエンドポイント
+    """
+    updated = notifications.mark_all_read(request.user.id)
+    return JsonResponse({
+        'success': True,
+        'updated_count': updated,
+    })
+
+@login_required
+@require_http_methods(["GET"])
+async def event_stream(request):
+    """
+    いいね・通知・プレゼンスの更新を Server-Sent Events で配信するエンドポイント
+
+    接続を保持し続けるためASGIサーバー上でのみ提供する。
+    WSGIの場合は503を返し、クライアントはポーリングにフォールバックする
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({
+            'success': False,
+            'error': 'リアルタイム配信はASGIサーバーでのみ利用できます'
+        }, status=503)
+
+    user = await request.auser()
+    channels = [events.BROADCAST_CHANNEL, events.user_channel(user.pk)]
+
+    async def stream():
+        subscription = await events.get_broker().subscribe(channels)
+        try:
+            yield f'retry: {settings.EVENT_STREAM_RETRY_MS}\n\n'
+            while True:
+                message = await subscription.get(timeout=settings.EVENT_STREAM_KEEPALIVE)
+                if message is None:
+                    # プロキシに切断されないよう定期的にコメント行を送る
+                    yield ': keepalive\n\n'
+                    continue
+                yield f"event: {message['event']}\ndata: {json.dumps(message['data'], ensure_ascii=False)}\n\n"
+        finally:
+            await subscription.close()
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Nginxのバッファリングを無効化
+    return response
@@ -1,12 +1,96 @@
 import requests
 import json
 import os
-from typing import Dict, Optional
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Callable, Dict, Optional, Tuple
 from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .cache import CacheNamespace
+from .geocoding import reverse_geocode
+
+_session_lock = threading.Lock()
+_session: Optional[requests.Session] = None
+
+# 天気と逆ジオコーディングを並行して呼び出すためのスレッドプール
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='weather')
+
+# 天気・逆ジオコーディングの応答キャッシュ（TTLは種類ごとに指定）
+weather_cache = CacheNamespace('weather')
+
+# 一時的なエラーの再試行設定（回数は残りの予算に収まる範囲に制限する）
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+MAX_RETRIES = 2
+RETRY_BACKOFF = 0.3  # 再試行までの基準待機秒数（試行ごとに倍増）
+RETRY_MIN_TIMEOUT = 1.0  # 再試行1回に最低限残っているべき秒数
+
+
+def get_http_session() -> requests.Session:
+    """
+    プロセス内で共有するHTTPセッションを取得
+
+    接続プールとKeep-Aliveで DNS解決・TLSハンドシェイクを使い回す。
+    再試行は期限を考慮できるよう http_get で行うため、ここでは無効にする
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=Retry(total=0, raise_on_status=False))
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers['User-Agent'] = 'KokkoSofter Weather App'
+                _session = session
+    return _session
+
+
+def _request_timeout(deadline: Optional[float], default: float) -> Tuple[float, float]:
+    """(接続, 読み取り) タイムアウトを残りの予算に収まるよう調整"""
+    read_timeout = default
+    if deadline is not None:
+        read_timeout = max(0.1, min(default, deadline - time.monotonic()))
+    return min(settings.WEATHER_CONNECT_TIMEOUT, read_timeout), read_timeout
+
+
+def _can_retry(deadline: Optional[float], attempt: int) -> bool:
+    """バックオフ後に RETRY_MIN_TIMEOUT 秒以上の試行が期限内に収まるか"""
+    if attempt >= MAX_RETRIES:
+        return False
+    if deadline is None:
+        return True
+    return time.monotonic() + RETRY_BACKOFF * (2 ** attempt) + RETRY_MIN_TIMEOUT <= deadline
+
+
+def http_get(url: str, params: Dict, deadline: Optional[float], default_timeout: float) -> requests.Response:
+    """
+    期限付きで GET する
+
+    接続エラー・タイムアウト・RETRY_STATUSES の応答はバックオフ付きで再試行するが、
+    次の試行が期限を超える場合は再試行せず、最後の応答（または例外）を返す
+    """
+    attempt = 0
+    while True:
+        try:
+            response = get_http_session().get(url, params=params, timeout=_request_timeout(deadline, default_timeout))
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if not _can_retry(deadline, attempt):
+                raise
+        else:
+            if response.status_code not in RETRY_STATUSES or not _can_retry(deadline, attempt):
+                return response
+        time.sleep(RETRY_BACKOFF * (2 ** attempt))
+        attempt += 1
+
 
 class WeatherService:
     """
     OpenWeatherMap APIを使用した高精度天気情報取得サービス
+
+    応答は丸めた座標をキーにキャッシュし、同じキーへの同時リクエストは
+    1回の上流呼び出しにまとめる（single-flight）
     """
     
     def __init__(self):
@@ -14,32 +98,40 @@ class WeatherService:
         self.api_key = getattr(settings, 'OPENWEATHER_API_KEY', '40c2e9c8a8ea9c1bba456b9fa3e8b7dd')  # 環境変数から取得
         self.base_url = "https://api.openweathermap.org/data/2.5"
         self.geocoding_url = "https://api.openweathermap.org/geo/1.0"
+
+        # プロセス内で実行中の上流呼び出し（キー → Future）
+        self._inflight: Dict[str, Future] = {}
+        self._inflight_lock = threading.Lock()
         
     def get_weather_by_location(self, lat: float, lon: float) -> Optional[Dict]:
         """
         緯度経度から高精度な天気情報を取得
         """
+        # 上流が遅くてもワーカーを占有し続けないよう全体の期限を設ける
+        deadline = time.monotonic() + settings.WEATHER_REQUEST_DEADLINE
         try:
-            # 現在の天気を取得
-            weather_url = f"{self.base_url}/weather"
-            params = {
-                'lat': lat,
-                'lon': lon,
-                'appid': self.api_key,
-                'units': 'metric',  # 摂氏温度
-                'lang': 'ja'        # 日本語
-            }
-            
-            response = requests.get(weather_url, params=params, timeout=10)
-            
-            if response.status_code != 200:
-                print(f"OpenWeatherMap API error: {response.status_code}")
+            # キャッシュ効率のため座標をグリッドに丸めてから問い合わせる
+            grid_lat, grid_lon = self._snap_to_grid(lat, lon)
+
+            # 天気と場所名（逆ジオコーディング）を並行して取得
+            weather_future = _executor.submit(
+                self._cached_fetch, f'current:{grid_lat}:{grid_lon}', settings.WEATHER_CACHE_TTL, deadline,
+            )
+            location_future = _executor.submit(self._get_location_name, lat, lon, deadline)
+
+            try:
+                data = weather_future.result(timeout=max(0, deadline - time.monotonic()))
+            except FutureTimeoutError:
+                print("Weather API request timed out")
                 return self._get_fallback_weather(lat, lon)
             
-            data = response.json()
+            if data is None:
+                return self._get_fallback_weather(lat, lon)
             
-            # 場所名を取得（逆ジオコーディング）
-            location_info = self._get_location_name(lat, lon)
+            try:
+                location_info = location_future.result(timeout=max(0, deadline - time.monotonic()))
+            except FutureTimeoutError:
+                location_info = self._estimate_location_by_coords(lat, lon)
             
             # データを整形
             weather_info = {
@@ -70,9 +162,51 @@ class WeatherService:
             print(f"Weather service error: {e}")
             return None
     
-    def _get_location_name(self, lat: float, lon: float) -> Dict[str, str]:
+    def _fetch_current_weather(self, lat: float, lon: float, deadline: Optional[float] = None) -> Optional[Dict]:
+        """
+        OpenWeatherMap から現在の天気を取得（失敗時は None）
+        """
+        weather_url = f"{self.base_url}/weather"
+        params = {
+            'lat': lat,
+            'lon': lon,
+            'appid': self.api_key,
+            'units': 'metric',  # 摂氏温度
+            'lang': 'ja'        # 日本語
+        }
+        
+        response = http_get(weather_url, params, deadline, 10)
+        
+        if response.status_code != 200:
+            print(f"OpenWeatherMap API error: {response.status_code}")
+            return None
+        
+        return response.json()
+
+    def _get_location_name(self, lat: float, lon: float, deadline: Optional[float] = None) -> Dict[str, str]:
         """
-        緯度経度から地名を取得（逆ジオコーディング）
+        緯度経度から地名を取得
+
+        同梱データによるオフライン逆ジオコーディングを基本とし、
+        GEOCODE_USE_NOMINATIM が有効な場合のみ Nominatim の結果で補完する
+        """
+        local = self._estimate_location_by_coords(lat, lon)
+        if not settings.GEOCODE_USE_NOMINATIM:
+            return local
+
+        grid_lat, grid_lon = self._snap_to_grid(lat, lon)
+        try:
+            location = self._cached_fetch(f'geocode:{grid_lat}:{grid_lon}', settings.GEOCODE_CACHE_TTL, deadline)
+            if location:
+                return location
+        except Exception as e:
+            print(f"Geocoding error: {e}")
+        
+        return local
+
+    def _reverse_geocode(self, lat: float, lon: float, deadline: Optional[float] = None) -> Optional[Dict[str, str]]:
+        """
+        Nominatim で逆ジオコーディング（失敗時は None）
         """
         try:
             # OpenStreetMap Nominatimを使用（無料）
@@ -85,11 +219,7 @@ class WeatherService:
                 'zoom': 10
             }
             
-            headers = {
-                'User-Agent': 'KokkoSofter Weather App'
-            }
-            
-            response = requests.get(nominatim_url, params=params, headers=headers, timeout=5)
+            response = http_get(nominatim_url, params, deadline, 5)
             
             if response.status_code == 200:
                 data = response.json()
@@ -119,30 +249,108 @@ class WeatherService:
         except Exception as e:
             print(f"Geocoding error: {e}")
         
-        # フォールバック：大まかな地域判定
-        return self._estimate_location_by_coords(lat, lon)
+        return None
+
+    def _snap_to_grid(self, lat: float, lon: float) -> Tuple[float, float]:
+        """座標をキャッシュ用のグリッド（WEATHER_CACHE_GRID 度単位）に丸める"""
+        grid = settings.WEATHER_CACHE_GRID
+        return round(round(lat / grid) * grid, 4), round(round(lon / grid) * grid, 4)
+
+    def _fetcher(self, key: str, deadline: Optional[float]) -> Callable[[], Optional[Dict]]:
+        """キャッシュキー（種類:緯度:経度）から上流APIの呼び出しを組み立てる"""
+        kind, lat, lon = key.split(':')
+        lat, lon = float(lat), float(lon)
+        if kind == 'current':
+            return lambda: self._fetch_current_weather(lat, lon, deadline)
+        if kind == 'geocode':
+            return lambda: self._reverse_geocode(lat, lon, deadline)
+        raise ValueError(f'Unknown weather cache key: {key}')
+
+    def _cached_fetch(self, key: str, ttl: int, deadline: Optional[float] = None) -> Optional[Dict]:
+        """
+        キャッシュ付きで上流APIを呼び出す
+
+        - 新鮮なキャッシュがあればそのまま返す
+        - 期限切れ（stale）のキャッシュがあればそれを返しつつ、裏で1回だけ再取得する
+        - キャッシュがなければ同じキーの呼び出しを1回にまとめて取得する
+        None（取得失敗）はキャッシュしない
+        """
+        entry = weather_cache.get(key)
+        now = time.time()
+
+        if entry is not None:
+            if entry['fresh_until'] <= now and weather_cache.add(f'{key}:refresh', True, timeout=settings.WEATHER_REFRESH_LOCK_TIMEOUT):
+                threading.Thread(target=self._refresh, args=(key, ttl), daemon=True).start()
+            return entry['value']
+
+        return self._single_flight(key, ttl, self._fetcher(key, deadline), deadline)
+
+    def _store(self, key: str, ttl: int, value: Optional[Dict]) -> None:
+        if value is None:
+            return
+        # 期限切れ後も WEATHER_STALE_TTL の間は stale 値として使えるよう長めに保持
+        weather_cache.set(key, {'value': value, 'fresh_until': time.time() + ttl}, timeout=ttl + settings.WEATHER_STALE_TTL)
+
+    def _refresh(self, key: str, ttl: int) -> None:
+        """
+        stale になったキーを裏で再取得する
+
+        きっかけになったリクエストの期限は引き継がず、キーから呼び出しを組み立て直して
+        再取得用に新しい期限を設ける
+        """
+        deadline = time.monotonic() + settings.WEATHER_REQUEST_DEADLINE
+        try:
+            self._single_flight(key, ttl, self._fetcher(key, deadline), deadline)
+        except Exception as e:
+            print(f"Weather cache refresh error: {e}")
+        finally:
+            weather_cache.delete(f'{key}:refresh')
+
+    def _single_flight(
+        self, key: str, ttl: int, fetch: Callable[[], Optional[Dict]], deadline: Optional[float] = None,
+    ) -> Optional[Dict]:
+        """
+        同じキーへの同時呼び出しを、プロセス内では1回の上流呼び出しにまとめる
+
+        後続の呼び出しは先行呼び出しの結果を待つが、自分の期限（deadline）を過ぎては待たず、
+        キャッシュにある値（なければ None）を返す
+        """
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            is_leader = future is None
+            if is_leader:
+                future = Future()
+                self._inflight[key] = future
+
+        if not is_leader:
+            wait = settings.WEATHER_SINGLE_FLIGHT_WAIT
+            if deadline is not None:
+                wait = max(0, min(wait, deadline - time.monotonic()))
+            try:
+                return future.result(timeout=wait)
+            except FutureTimeoutError:
+                entry = weather_cache.get(key)
+                return entry['value'] if entry is not None else None
+
+        try:
+            value = fetch()
+            self._store(key, ttl, value)
+            future.set_result(value)
+            return value
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
     
     def _estimate_location_by_coords(self, lat: float, lon: float) -> Dict[str, str]:
         """
-        座標から大まかな地域を推定
-        """
-        # 日本の主要地域の座標範囲
-        regions = [
-            {'name': '北海道', 'city': '札幌', 'lat_min': 41.0, 'lat_max': 46.0, 'lon_min': 139.0, 'lon_max': 146.0},
-            {'name': '東京都', 'city': '東京', 'lat_min': 35.5, 'lat_max': 36.0, 'lon_min': 139.0, 'lon_max': 140.0},
-            {'name': '大阪府', 'city': '大阪', 'lat_min': 34.4, 'lat_max': 35.0, 'lon_min': 135.0, 'lon_max': 136.0},
-            {'name': '愛知県', 'city': '名古屋', 'lat_min': 34.8, 'lat_max': 35.5, 'lon_min': 136.5, 'lon_max': 137.5},
-            {'name': '福岡県', 'city': '福岡', 'lat_min': 33.2, 'lat_max': 34.0, 'lon_min': 130.0, 'lon_max': 131.0},
-            {'name': '沖縄県', 'city': '那覇', 'lat_min': 24.0, 'lat_max': 27.0, 'lon_min': 123.0, 'lon_max': 132.0},
-        ]
-        
-        for region in regions:
-            if (region['lat_min'] <= lat <= region['lat_max'] and 
-                region['lon_min'] <= lon <= region['lon_max']):
-                return {
-                    'prefecture': region['name'],
-                    'city': region['city']
-                }
+        座標から地域を推定（同梱データの空間インデックスで最寄りの市区町村を検索）
+        """
+        location = reverse_geocode(lat, lon)
+        if location:
+            return location
         
         return {'prefecture': '日本', 'city': '不明'}
     
@@ -166,3 +374,7 @@ class WeatherService:
             'icon': '01d',
             'coord': {'lat': lat, 'lon': lon}
         }
+
+
+# リクエストごとに生成せず、プロセス内で共有するインスタンス
+weather_service = WeatherService()
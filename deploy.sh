@@ -627,6 +627,31 @@ if [ "$ENVIRONMENT" = "production" ]; then
     configure_domain
 fi
 
+# キャッシュ（Redis）の設定（本番環境のLinux/Unixのみ）
+# 本番環境（DEBUG=False）の既定の CACHE_URL は redis://localhost:6379/0 で、
+# Redis が起動していないと全リクエストがエラーになるため、ここで用意する
+if [ "$ENVIRONMENT" = "production" ] && [ "$OS_TYPE" != "windows" ]; then
+    print_info "Redis（gunicorn の全ワーカーで共有するキャッシュ）をセットアップ中..."
+    if ! command -v redis-server &> /dev/null; then
+        if command -v apt-get &> /dev/null; then
+            sudo apt-get install -y redis-server
+        else
+            print_error "redis-server が見つかりません。Redis をインストールしてから再実行してください"
+            exit 1
+        fi
+    fi
+    sudo systemctl enable --now redis-server
+    if ! redis-cli ping &> /dev/null; then
+        print_error "Redis に接続できません（sudo systemctl status redis-server で確認してください）"
+        exit 1
+    fi
+
+    if ! grep -q "^CACHE_URL=" .env; then
+        echo "CACHE_URL=redis://localhost:6379/0" >> .env
+    fi
+    print_success "✅ Redis を有効化し、.env に CACHE_URL を設定しました"
+fi
+
 # 必要なディレクトリの作成（本番環境のLinux/Unixのみ）
 if [ "$ENVIRONMENT" = "production" ] && [ "$OS_TYPE" != "windows" ]; then
     print_info "必要なディレクトリを作成中..."
@@ -736,10 +761,10 @@ if [ "$ENVIRONMENT" = "production" ] && [ "$OS_TYPE" != "windows" ]; then
     
     # systemdサービス設定
     print_info "systemdサービスを設定中..."
-    sudo cp kokkosofter.service /etc/systemd/system/
+    sudo cp kokkosofter.service kokkosofter-worker.service /etc/systemd/system/
     sudo systemctl daemon-reload
-    sudo systemctl enable kokkosofter
-    sudo systemctl start kokkosofter
+    sudo systemctl enable kokkosofter kokkosofter-worker
+    sudo systemctl start kokkosofter kokkosofter-worker
     
     print_success "本番環境のデプロイが完了しました！"
     
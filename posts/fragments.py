@@ -0,0 +1,101 @@
+"""
+投稿カードの描画結果（HTML断片）のキャッシュ
+
+カードのうち閲覧者によって変わらない部分（投稿者情報・本文・画像・投稿日時）を
+投稿ごとにキャッシュし、いいね状態や削除メニューなど閲覧者ごとの部分だけを
+毎回描画する。キャッシュキーには投稿と投稿者のバージョンを含め、
+シグナルでバージョンを更新することで古い断片を参照しなくなる
+"""
+import time
+
+from django.conf import settings
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from core.cache import CacheNamespace
+
+# キャッシュする断片と、その描画に使うテンプレート
+FRAGMENT_TEMPLATES = {
+    'header': 'posts/card/header.html',
+    'content': 'posts/card/content.html',
+    'stats': 'posts/card/stats.html',
+}
+
+
+versions_cache = CacheNamespace('post_card:version', timeout=None)
+# 断片のテンプレートを変更したときは version を上げ、古い描画結果を読まないようにする
+fragments_cache = CacheNamespace('post_card', version=3)
+
+
+def _post_version_key(post_id):
+    return f'post:{post_id}'
+
+
+def _user_version_key(user_id):
+    return f'user:{user_id}'
+
+
+def _new_version():
+    # キャッシュから消えたバージョンが古い値に戻らないよう、連番ではなく時刻を使う
+    return time.time_ns()
+
+
+def bump_post(post_id):
+    """投稿の内容が変わったときに呼び、その投稿の断片を無効化する"""
+    versions_cache.set(_post_version_key(post_id), _new_version())
+
+
+def bump_user(user_id):
+    """投稿者のユーザー情報・プロフィールが変わったときに呼び、その人の全投稿の断片を無効化する"""
+    versions_cache.set(_user_version_key(user_id), _new_version())
+
+
+def bump_users(user_ids):
+    """bump_user の一括版（ロールの一括変更などで使う）"""
+    version = _new_version()
+    versions_cache.set_many({_user_version_key(user_id): version for user_id in user_ids})
+
+
+def _get_versions(posts):
+    keys = {_post_version_key(post.pk) for post in posts} | {_user_version_key(post.author_id) for post in posts}
+    versions = versions_cache.get_many(keys)
+
+    missing = {key: _new_version() for key in keys if key not in versions}
+    if missing:
+        versions_cache.set_many(missing)
+        versions.update(missing)
+    return versions
+
+
+def attach_card_fragments(posts):
+    """
+    各投稿に card_fragments（断片名 → HTML）を付与する
+
+    キャッシュの読み込みはバージョンと断片の get_many 2回で済み、
+    キャッシュにない投稿だけをテンプレートで描画する
+    """
+    posts = list(posts)
+    if not posts:
+        return posts
+
+    versions = _get_versions(posts)
+    keys = {
+        post.pk: (post.pk, versions[_post_version_key(post.pk)], versions[_user_version_key(post.author_id)])
+        for post in posts
+    }
+    cached = fragments_cache.get_many(keys.values())
+
+    rendered = {}
+    for post in posts:
+        fragments = cached.get(keys[post.pk])
+        if fragments is None:
+            fragments = {
+                name: render_to_string(template, {'post': post})
+                for name, template in FRAGMENT_TEMPLATES.items()
+            }
+            rendered[keys[post.pk]] = fragments
+        post.card_fragments = {name: mark_safe(html) for name, html in fragments.items()}
+
+    if rendered:
+        fragments_cache.set_many(rendered, timeout=settings.POST_CARD_CACHE_TIMEOUT)
+    return posts
@@ -0,0 +1,78 @@
+"""
+投稿画像の処理パイプライン
+
+アップロードされた原本はそのまま残し、EXIF を除去して向きを正規化した
+複数幅の WebP/JPEG レンディションとぼかしプレースホルダーを別に生成する
+"""
+import base64
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageFilter
+
+from core.imaging import RENDITION_FORMATS, encode, flatten, open_normalized
+
+PLACEHOLDER_WIDTH = 16
+
+
+def _resize(image, width):
+    if image.width <= width:
+        return image
+    height = round(image.height * width / image.width)
+    return image.resize((width, height), Image.Resampling.LANCZOS)
+
+
+def build_placeholder(image):
+    """数百バイト程度のぼかしプレースホルダーを data URI で返す"""
+    tiny = flatten(_resize(image, PLACEHOLDER_WIDTH)).filter(ImageFilter.GaussianBlur(1))
+    buffer = BytesIO()
+    tiny.save(buffer, 'JPEG', quality=50)
+    return 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode()
+
+
+def delete_renditions(names):
+    """レンディションのファイルをストレージから削除する"""
+    for name in names:
+        default_storage.delete(name)
+
+
+def process_post_image(post):
+    """
+    投稿画像を処理してレンディション情報を Post に保存する
+
+    - 原本は変更せずに残す（EXIF を除去するのはレンディションのみ）
+    - RENDITION_WIDTHS の各幅（原本より大きい幅は除く）で WebP/JPEG を生成する
+    - 再処理した場合は以前のレンディションを削除する
+    """
+    if not post.image:
+        return
+
+    image = open_normalized(post.image)
+    stem = os.path.splitext(os.path.basename(post.image.name))[0]
+    directory = f'post_images/renditions/{post.pk}'
+    previous = [rendition['name'] for rendition in post.image_renditions]
+
+    widths = sorted({w for w in settings.POST_IMAGE_RENDITION_WIDTHS if w < image.width} | {
+        min(image.width, max(settings.POST_IMAGE_RENDITION_WIDTHS))
+    })
+
+    renditions = []
+    for width in widths:
+        resized = _resize(image, width)
+        for fmt, (_, extension, _) in RENDITION_FORMATS.items():
+            name = default_storage.save(
+                f'{directory}/{stem}-{width}w.{extension}', ContentFile(encode(resized, fmt))
+            )
+            renditions.append({'width': resized.width, 'format': fmt, 'name': name})
+
+    post.image_width = image.width
+    post.image_height = image.height
+    post.image_renditions = renditions
+    post.image_placeholder = build_placeholder(image)
+    post.save(update_fields=['image_width', 'image_height', 'image_renditions', 'image_placeholder'])
+
+    # 新しいレンディションを保存してから古いものを消す（処理に失敗しても表示が壊れない）
+    delete_renditions(set(previous) - {rendition['name'] for rendition in renditions})
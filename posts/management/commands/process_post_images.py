@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from posts.images import process_post_image
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'レンディション未生成の投稿画像を処理します（既存データの移行用）'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='生成済みの投稿も含めてすべて再処理する',
+        )
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(image='').exclude(image__isnull=True)
+        if not options['all']:
+            posts = posts.filter(image_renditions=[])
+
+        processed = 0
+        for post in posts.iterator():
+            try:
+                process_post_image(post)
+                processed += 1
+            except Exception as e:
+                self.stderr.write(f'投稿 {post.pk} の画像処理に失敗しました: {e}')
+
+        self.stdout.write(self.style.SUCCESS(f'{processed}件の投稿画像を処理しました'))
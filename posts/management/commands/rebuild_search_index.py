@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from posts import search
+
+
+class Command(BaseCommand):
+    help = '全投稿の検索用トークンを再計算し、全文検索の索引を作り直します'
+
+    def handle(self, *args, **options):
+        count = search.rebuild_index()
+        self.stdout.write(self.style.SUCCESS(f'{count}件の投稿の索引を作成しました'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = '投稿の like_count を中間テーブルの実件数から再計算して修復します'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='更新せず、ずれている投稿の件数だけを表示する',
+        )
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            drifted = Post.objects.with_actual_like_count().exclude(
+                like_count=F('actual_like_count')
+            ).count()
+            self.stdout.write(f'like_count がずれている投稿: {drifted}件')
+            return
+
+        updated = Post.objects.recount_likes()
+        self.stdout.write(self.style.SUCCESS(f'{updated}件の投稿のいいね数を修復しました'))
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:21
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_like_count(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    counts = (
+        Post.likes.through.objects.filter(post_id=OuterRef('pk'))
+        .values('post_id').annotate(total=Count('*')).values('total')
+    )
+    Post.objects.update(like_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0002_post_likes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='いいね数'),
+        ),
+        migrations.RunPython(backfill_like_count, migrations.RunPython.noop),
+    ]
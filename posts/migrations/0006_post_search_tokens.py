@@ -0,0 +1,82 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:50
+
+import re
+import unicodedata
+
+from django.db import migrations, models
+
+# マイグレーションはアプリのコードを import せず、作成時点の posts.search の定義を固定して持つ
+# （後から posts.search を変更しても、このマイグレーションの結果は変わらない）
+FTS_TABLE = 'posts_post_fts'
+SEARCH_CONFIG = 'simple'
+GIN_INDEX_NAME = 'posts_post_search_gin_idx'
+
+_WORD_RE = re.compile(r'[^\W_]+')
+
+
+def _word_tokens(word):
+    if len(word) == 1:
+        return [word]
+    return [word[i:i + 2] for i in range(len(word) - 1)] + [word[-1]]
+
+
+def tokenize(text):
+    normalized = unicodedata.normalize('NFKC', text or '').lower()
+    return ' '.join(
+        token
+        for word in _WORD_RE.findall(normalized)
+        for token in _word_tokens(word)
+    )
+
+
+def fill_search_tokens(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    posts = list(Post.objects.only('id', 'content'))
+    for post in posts:
+        post.search_tokens = tokenize(post.content)
+    Post.objects.bulk_update(posts, ['search_tokens'], batch_size=500)
+
+
+def create_search_index(apps, schema_editor):
+    """データベースごとの全文検索用の索引を作成する"""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        from django.contrib.postgres.indexes import GinIndex
+        from django.contrib.postgres.search import SearchVector
+
+        # 検索時の SearchVector と同じ式にして、この索引が使われるようにする
+        Post = apps.get_model('posts', 'Post')
+        schema_editor.add_index(Post, GinIndex(
+            SearchVector('search_tokens', config=SEARCH_CONFIG), name=GIN_INDEX_NAME,
+        ))
+    elif vendor == 'sqlite':
+        schema_editor.execute(f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(tokens)')
+        schema_editor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, tokens) "
+            f"SELECT id, search_tokens FROM posts_post WHERE search_tokens != ''"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {GIN_INDEX_NAME}')
+    elif vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0005_post_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='search_tokens',
+            field=models.TextField(blank=True, editable=False),
+        ),
+        migrations.RunPython(fill_search_tokens, migrations.RunPython.noop),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -1,19 +1,145 @@
-from django.db import models
+from django.core.files.storage import default_storage
+from django.db import models, transaction
+from django.db.models import Count, Exists, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 
+from . import search
+from .signals import post_liked
+
+
+class PostQuerySet(models.QuerySet):
+    def for_feed(self, user=None):
+        """
+        タイムライン表示用のクエリセット
+
+        投稿者とプロフィールをJOINで同時に取得し、閲覧ユーザーの
+        いいね済み状態も同じクエリで判定する（いいね数は like_count 列）
+        """
+        queryset = self.select_related('author', 'author__profile')
+        if user is not None and user.is_authenticated:
+            liked = Post.likes.through.objects.filter(post_id=OuterRef('pk'), user_id=user.pk)
+            queryset = queryset.annotate(is_liked=Exists(liked))
+        else:
+            queryset = queryset.annotate(is_liked=Value(False))
+        return queryset
+
+    def with_actual_like_count(self):
+        """中間テーブルから実際に数えたいいね数を actual_like_count として付与"""
+        return self.annotate(actual_like_count=_actual_like_count())
+
+    def recount_likes(self):
+        """
+        like_count が実際の件数とずれている投稿だけを一括で修復し、
+        更新した件数を返す
+        """
+        drifted = self.with_actual_like_count().exclude(like_count=F('actual_like_count'))
+        return Post.objects.filter(pk__in=drifted.values('pk')).update(
+            like_count=_actual_like_count()
+        )
+
+
+def _actual_like_count():
+    counts = (
+        Post.likes.through.objects.filter(post_id=OuterRef('pk'))
+        .values('post_id').annotate(total=Count('*')).values('total')
+    )
+    return Coalesce(Subquery(counts), 0)
+
+
 class Post(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # タイムライン（created_at, id の降順でのキーセットページネーション）
+            models.Index(fields=['-created_at', '-id'], name='posts_post_feed_idx'),
+            # ユーザーごとの最近の投稿
+            models.Index(fields=['author', '-created_at', '-id'], name='posts_post_author_recent_idx'),
+        ]
+
     def __str__(self):
         return self.content[:30]
 
     likes = models.ManyToManyField(User, related_name='liked_posts', blank=True)
+    # likes の件数を非正規化して保持（toggle_like と recount_likes コマンドで更新）
+    like_count = models.PositiveIntegerField(default=0, verbose_name='いいね数')
     image = models.ImageField(upload_to='post_images/', blank=True, null=True)
+    # 画像処理パイプライン（posts.images）の出力
+    image_width = models.PositiveIntegerField(null=True, blank=True)
+    image_height = models.PositiveIntegerField(null=True, blank=True)
+    image_renditions = models.JSONField(default=list, blank=True)
+    image_placeholder = models.TextField(blank=True)
+    # 全文検索用のトークン列（本文の文字2-gram。posts.search）
+    search_tokens = models.TextField(blank=True, editable=False)
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'content' in update_fields:
+            self.search_tokens = search.tokenize(self.content)
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'search_tokens'}
+        super().save(*args, **kwargs)
     
     def get_image_url(self):
-        """投稿画像のURLを取得"""
-        if self.image:
-            return self.image.url
-        return None
+        """
+        表示用の投稿画像のURLを取得
+
+        原本は EXIF（位置情報等）を含むため、レンディションがあれば最大幅の JPEG を返す
+        """
+        if not self.image:
+            return None
+        jpegs = [rendition for rendition in self.image_renditions if rendition['format'] == 'jpeg']
+        if jpegs:
+            return default_storage.url(max(jpegs, key=lambda rendition: rendition['width'])['name'])
+        return self.image.url
+
+    def get_image_srcset(self, fmt):
+        """指定フォーマットのレンディションから srcset 属性値を組み立てる"""
+        return ', '.join(
+            f"{default_storage.url(rendition['name'])} {rendition['width']}w"
+            for rendition in self.image_renditions
+            if rendition['format'] == fmt
+        )
+
+    @property
+    def image_webp_srcset(self):
+        return self.get_image_srcset('webp')
+
+    @property
+    def image_jpeg_srcset(self):
+        return self.get_image_srcset('jpeg')
+
+    def toggle_like(self, user):
+        """
+        いいねを切り替え、(いいね済みか, 最新のいいね数) を返す
+
+        中間テーブルへの書き込みと like_count の F() 式による加減算を
+        同一トランザクションで行うため、同時クリックでも件数がずれない
+
+        中間テーブルを直接更新するため m2m_changed シグナルは送信されない。
+        いいねへの反応は posts.signals.post_liked を受け取って行うこと。
+        また likes.add() / likes.remove() を直接使うと like_count がずれるため、
+        いいねの追加・削除は必ずこのメソッドを通す（ずれた場合は recount_likes で修復）
+        """
+        through = Post.likes.through
+        created = False
+        with transaction.atomic():
+            deleted, _ = through.objects.filter(post_id=self.pk, user_id=user.pk).delete()
+            if deleted:
+                Post.objects.filter(pk=self.pk).update(like_count=F('like_count') - 1)
+                liked = False
+            else:
+                _, created = through.objects.get_or_create(post_id=self.pk, user_id=user.pk)
+                if created:
+                    Post.objects.filter(pk=self.pk).update(like_count=F('like_count') + 1)
+                liked = True
+            self.like_count = Post.objects.values_list('like_count', flat=True).get(pk=self.pk)
+
+        if created:
+            post_liked.send(sender=Post, post=self, user=user)
+        return liked, self.like_count
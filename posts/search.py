@@ -0,0 +1,160 @@
+"""
+投稿本文の全文検索
+
+日本語は単語の区切りがないため、本文を文字2-gram（バイグラム）に分割した
+トークン列を Post.search_tokens に保存し、データベースごとの転置索引で検索する。
+
+- PostgreSQL: to_tsvector('simple', search_tokens) の GIN 式インデックス
+- SQLite: FTS5 仮想テーブル posts_post_fts（rowid = 投稿ID）
+- その他: 本文の部分一致（索引なし）
+
+索引は投稿の保存・削除シグナルで1件ずつ更新する（core.signals）。
+manage.py rebuild_search_index で全件を作り直せる
+"""
+import re
+import unicodedata
+
+from django.db import connection, transaction
+
+FTS_TABLE = 'posts_post_fts'
+SEARCH_CONFIG = 'simple'
+MAX_RESULTS = 1000  # 検索結果として扱う最大件数（関連度の高い順）
+
+_WORD_RE = re.compile(r'[^\W_]+')  # 文字・数字の連続（記号・空白・_ で区切る）
+
+
+def _normalize(text):
+    # 全角英数字・半角カナなどを揃え、大文字小文字を区別しない
+    return unicodedata.normalize('NFKC', text or '').lower()
+
+
+def _word_tokens(word):
+    """単語（連続した文字列）をバイグラムに分割し、末尾の1文字も加える"""
+    if len(word) == 1:
+        return [word]
+    # 末尾の1文字を加えておくと、1文字の検索語を前方一致で探したときに末尾の文字も見つかる
+    return [word[i:i + 2] for i in range(len(word) - 1)] + [word[-1]]
+
+
+def tokenize(text):
+    """索引に保存するトークン列（空白区切り）"""
+    return ' '.join(
+        token
+        for word in _WORD_RE.findall(_normalize(text))
+        for token in _word_tokens(word)
+    )
+
+
+def query_terms(query):
+    """
+    検索語を (トークンのリスト, 前方一致か) に変換する
+
+    2文字以上の語はバイグラムのすべてを含む投稿（AND）を探す。
+    1文字だけの語はその文字で始まるトークンの前方一致で探す
+    """
+    terms = []
+    for word in _WORD_RE.findall(_normalize(query)):
+        if len(word) == 1:
+            terms.append((word, True))
+        else:
+            terms.extend((word[i:i + 2], False) for i in range(len(word) - 1))
+    return list(dict.fromkeys(terms))
+
+
+def _vendor():
+    return connection.vendor
+
+
+# --- 索引の更新 -------------------------------------------------------------
+
+def index_post(post):
+    """投稿1件の索引を更新する（PostgreSQL は式インデックスのため不要）"""
+    if _vendor() != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [post.pk])
+        if post.search_tokens:
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE} (rowid, tokens) VALUES (%s, %s)',
+                [post.pk, post.search_tokens],
+            )
+
+
+def remove_post(post_id):
+    if _vendor() != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [post_id])
+
+
+def rebuild_index(batch_size=500):
+    """全投稿のトークンを再計算し、索引を作り直す。処理した件数を返す"""
+    from .models import Post
+
+    count = 0
+    with transaction.atomic():
+        changed = []
+        for post in Post.objects.only('id', 'content', 'search_tokens').iterator(chunk_size=batch_size):
+            tokens = tokenize(post.content)
+            if post.search_tokens != tokens:
+                post.search_tokens = tokens
+                changed.append(post)
+            count += 1
+        Post.objects.bulk_update(changed, ['search_tokens'], batch_size=batch_size)
+
+        if _vendor() == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute(f'DELETE FROM {FTS_TABLE}')
+                cursor.execute(
+                    f"INSERT INTO {FTS_TABLE} (rowid, tokens) "
+                    f"SELECT id, search_tokens FROM posts_post WHERE search_tokens != ''"
+                )
+    return count
+
+
+# --- 検索 -------------------------------------------------------------------
+
+def _fts5_match(terms):
+    # トークンは文字・数字のみだが、FTS5の演算子（AND/OR/NOT など）として解釈されないよう引用する
+    return ' '.join(f'"{token}"*' if prefix else f'"{token}"' for token, prefix in terms)
+
+
+def _tsquery(terms):
+    return ' & '.join(f"'{token}':*" if prefix else f"'{token}'" for token, prefix in terms)
+
+
+def search_post_ids(query, limit=MAX_RESULTS):
+    """検索語に一致する投稿IDを関連度の高い順に返す（同程度なら新しい順）"""
+    from .models import Post
+
+    terms = query_terms(query)
+    if not terms:
+        return []
+
+    vendor = _vendor()
+    if vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+                f'ORDER BY bm25({FTS_TABLE}), rowid DESC LIMIT %s',
+                [_fts5_match(terms), limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    if vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+
+        vector = SearchVector('search_tokens', config=SEARCH_CONFIG)
+        search_query = SearchQuery(_tsquery(terms), config=SEARCH_CONFIG, search_type='raw')
+        return list(
+            Post.objects.annotate(search=vector, rank=SearchRank(vector, search_query))
+            .filter(search=search_query)
+            .order_by('-rank', '-created_at', '-id')
+            .values_list('id', flat=True)[:limit]
+        )
+
+    # 全文索引のないデータベースでは部分一致で代用する
+    queryset = Post.objects.all()
+    for word in query.split():
+        queryset = queryset.filter(content__icontains=word)
+    return list(queryset.order_by('-created_at', '-id').values_list('id', flat=True)[:limit])
@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# いいねが新しく付いたときに送信される（sender=Post, post, user）
+# Post.toggle_like は中間テーブルを直接更新するため、m2m_changed の代わりにこれを使う
+post_liked = Signal()
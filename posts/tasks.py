@@ -0,0 +1,12 @@
+from core.jobs import task
+
+from .images import process_post_image
+from .models import Post
+
+
+@task
+def process_image(post_id):
+    """投稿画像のレンディションを生成（投稿が削除済みなら何もしない）"""
+    post = Post.objects.filter(pk=post_id).first()
+    if post is not None and post.image:
+        process_post_image(post)
@@ -1,3 +1,385 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.signals import m2m_changed
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from PIL import Image
+
+from . import fragments, images, search, timeline
+from .signals import post_liked
+from .models import Post
+
+
+class PostLikeTests(TestCase):
+    """いいねの切り替えと like_count（非正規化したいいね数）の整合性を確認"""
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user('author')
+        self.users = [User.objects.create_user(f'user{i}') for i in range(3)]
+        self.post = Post.objects.create(author=self.author, content='投稿')
+
+    def test_toggle_like(self):
+        self.assertEqual(self.post.toggle_like(self.users[0]), (True, 1))
+        self.assertEqual(self.post.toggle_like(self.users[1]), (True, 2))
+        self.assertEqual(self.post.toggle_like(self.users[0]), (False, 1))
+
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 1)
+        self.assertEqual(list(self.post.likes.all()), [self.users[1]])
+
+    def test_count_uses_database_value(self):
+        # 別のインスタンス（別リクエスト）からのいいねも F() 式で加算される
+        other = Post.objects.get(pk=self.post.pk)
+        self.post.toggle_like(self.users[0])
+        self.assertEqual(other.toggle_like(self.users[1]), (True, 2))
+        self.assertEqual(Post.objects.get(pk=self.post.pk).like_count, 2)
+
+    def test_post_liked_signal_only_on_new_like(self):
+        liked, changed = [], []
+
+        def on_liked(sender, post, user, **kwargs):
+            liked.append(user)
+
+        def on_m2m_changed(sender, action, **kwargs):
+            changed.append(action)
+
+        post_liked.connect(on_liked)
+        m2m_changed.connect(on_m2m_changed, sender=Post.likes.through)
+        try:
+            self.post.toggle_like(self.users[0])
+            self.post.toggle_like(self.users[0])
+        finally:
+            post_liked.disconnect(on_liked)
+            m2m_changed.disconnect(on_m2m_changed, sender=Post.likes.through)
+        # m2m_changed は送信されず、post_liked はいいねを付けたときだけ送信される
+        self.assertEqual(liked, [self.users[0]])
+        self.assertEqual(changed, [])
+
+    def test_recount_likes_command(self):
+        self.post.toggle_like(self.users[0])
+        # likes.add() を直接使うと like_count がずれる
+        self.post.likes.add(self.users[1], self.users[2])
+        synced = Post.objects.create(author=self.author, content='ずれていない投稿')
+        synced.toggle_like(self.users[0])
+
+        out = StringIO()
+        call_command('recount_likes', '--dry-run', stdout=out)
+        self.assertIn('1件', out.getvalue())
+        self.assertEqual(Post.objects.get(pk=self.post.pk).like_count, 1)
+
+        out = StringIO()
+        call_command('recount_likes', stdout=out)
+        self.assertIn('1件', out.getvalue())
+        self.assertEqual(Post.objects.get(pk=self.post.pk).like_count, 3)
+        self.assertEqual(Post.objects.get(pk=synced.pk).like_count, 1)
+
+
+class PostSearchTests(TestCase):
+    """全文検索（文字2-gramの索引）と索引の更新を確認"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('alice', password='password123')
+        self.tokyo = Post.objects.create(author=self.user, content='東京タワーに行きました')
+        self.kyoto = Post.objects.create(author=self.user, content='京都の紅葉がきれいでした')
+        self.english = Post.objects.create(author=self.user, content='Django Search works')
+
+    def test_tokenize(self):
+        self.assertEqual(search.tokenize('東京タワー'), '東京 京タ タワ ワー ー')
+        # 全角英字・大文字も同じトークンになる
+        self.assertEqual(search.tokenize('ＤＢ'), search.tokenize('db'))
+
+    def test_search_japanese_substring(self):
+        self.assertEqual(search.search_post_ids('タワー'), [self.tokyo.pk])
+        self.assertCountEqual(search.search_post_ids('京'), [self.kyoto.pk, self.tokyo.pk])
+        self.assertEqual(search.search_post_ids('search'), [self.english.pk])
+        self.assertEqual(search.search_post_ids('大阪'), [])
+        self.assertEqual(search.search_post_ids('  '), [])
+
+    def test_index_follows_edit_and_delete(self):
+        self.tokyo.content = '大阪城に行きました'
+        self.tokyo.save()
+        self.assertEqual(search.search_post_ids('タワー'), [])
+        self.assertEqual(search.search_post_ids('大阪'), [self.tokyo.pk])
+
+        self.tokyo.delete()
+        self.assertEqual(search.search_post_ids('大阪'), [])
+
+    def test_rebuild_index(self):
+        Post.objects.filter(pk=self.english.pk).update(search_tokens='')
+        self.assertEqual(search.rebuild_index(), 3)
+        self.assertEqual(search.search_post_ids('django'), [self.english.pk])
+
+    def test_search_view(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('posts:search'), {'q': '紅葉'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([post.pk for post in response.context['posts']], [self.kyoto.pk])
+        self.assertContains(response, '京都の紅葉がきれいでした')
+        self.assertFalse(response.context['capped'])
+        self.assertContains(response, '検索結果: 1件')
+
+    def test_search_view_labels_capped_count(self):
+        self.client.force_login(self.user)
+        with mock.patch.object(search, 'MAX_RESULTS', 1):
+            response = self.client.get(reverse('posts:search'), {'q': '京'})
+        self.assertTrue(response.context['capped'])
+        self.assertEqual(response.context['page_obj'].paginator.count, 1)
+        self.assertContains(response, '1件以上')
+
+        with mock.patch.object(search, 'MAX_RESULTS', 2):
+            response = self.client.get(reverse('posts:search'), {'q': '京'})
+        self.assertFalse(response.context['capped'])
+
+
+class PostCardFragmentTests(TestCase):
+    """投稿カード断片のキャッシュと、投稿・プロフィール・ユーザーの変更による無効化を確認"""
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user('alice')
+        self.post = Post.objects.create(author=self.author, content='最初の本文')
+        self.other_post = Post.objects.create(author=User.objects.create_user('bob'), content='別の投稿')
+
+    def render(self):
+        posts = Post.objects.select_related('author__profile').order_by('pk')
+        return {post.pk: post.card_fragments for post in fragments.attach_card_fragments(posts)}
+
+    def test_cached_until_changed(self):
+        self.render()
+        # 2回目はテンプレートを描画せずキャッシュから返す（プロフィールの遅延読み込みも起きない）
+        posts = list(Post.objects.select_related('author').order_by('pk'))
+        with self.assertNumQueries(0):
+            fragments.attach_card_fragments(posts)
+        self.assertIn('最初の本文', posts[0].card_fragments['content'])
+
+    def test_post_change_invalidates_only_that_post(self):
+        before = self.render()
+        self.post.content = '編集後の本文'
+        self.post.save()
+
+        after = self.render()
+        self.assertIn('編集後の本文', after[self.post.pk]['content'])
+        self.assertNotIn('最初の本文', after[self.post.pk]['content'])
+        self.assertEqual(after[self.other_post.pk], before[self.other_post.pk])
+
+    def test_profile_change_invalidates_author_posts(self):
+        self.render()
+        profile = self.author.profile
+        profile.bio = '新しい自己紹介'
+        profile.save()
+
+        self.assertIn('新しい自己紹介', self.render()[self.post.pk]['header'])
+
+    def test_user_change_invalidates_author_posts(self):
+        self.render()
+        self.author.first_name = '花子'
+        self.author.save()
+
+        self.assertIn('花子', self.render()[self.post.pk]['header'])
+
+    def test_login_does_not_invalidate(self):
+        self.render()
+        self.author.save(update_fields=['last_login'])
+        posts = list(Post.objects.select_related('author').order_by('pk'))
+        with self.assertNumQueries(0):
+            fragments.attach_card_fragments(posts)
+
+
+@override_settings(FEED_PAGE_SIZE=3)
+class UserTimelineTests(TestCase):
+    """ユーザーごとの投稿一覧（カーソルでのページ送りと先頭ページのキャッシュ）を確認"""
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user('alice', password='password123')
+        self.other = User.objects.create_user('bob', password='password123')
+        self.posts = [Post.objects.create(author=self.author, content=f'投稿{i}') for i in range(5)]
+        Post.objects.create(author=self.other, content='別のユーザーの投稿')
+
+    def ids(self, page):
+        return [item['id'] for item in page.items]
+
+    def test_cursor_pagination(self):
+        first = timeline.get_page(self.author.pk)
+        self.assertEqual(self.ids(first), [post.pk for post in reversed(self.posts[2:])])
+        second = timeline.get_page(self.author.pk, cursor=first.next_cursor)
+        self.assertEqual(self.ids(second), [self.posts[1].pk, self.posts[0].pk])
+        self.assertIsNone(second.next_cursor)
+
+        preview = timeline.get_page(self.author.pk, limit=2)
+        self.assertEqual(self.ids(preview), [self.posts[4].pk, self.posts[3].pk])
+        self.assertEqual(self.ids(timeline.get_page(self.author.pk, cursor=preview.next_cursor)), [
+            self.posts[2].pk, self.posts[1].pk, self.posts[0].pk,
+        ])
+
+    def test_first_page_cached_until_author_posts_change(self):
+        timeline.get_page(self.author.pk)
+        with self.assertNumQueries(0):
+            timeline.get_page(self.author.pk)
+
+        # 他のユーザーの投稿ではキャッシュを破棄しない
+        Post.objects.create(author=self.other, content='別の投稿')
+        with self.assertNumQueries(0):
+            timeline.get_page(self.author.pk)
+
+        new_post = Post.objects.create(author=self.author, content='新しい投稿')
+        self.assertEqual(self.ids(timeline.get_page(self.author.pk))[0], new_post.pk)
+
+        new_post.delete()
+        self.assertEqual(self.ids(timeline.get_page(self.author.pk))[0], self.posts[4].pk)
+
+    def test_first_page_invalidated_by_image_processing(self):
+        post = self.posts[4]
+        Post.objects.filter(pk=post.pk).update(image='post_images/photo.png')
+        timeline.invalidate(self.author.pk)
+        self.assertTrue(timeline.get_page(self.author.pk).items[0]['image_url'].endswith('photo.png'))
+
+        # 画像処理は本文を含まない update_fields で保存するが、image_url が変わるため破棄する
+        post.refresh_from_db()
+        post.image_renditions = [{'width': 640, 'format': 'jpeg', 'name': 'post_images/renditions/photo-640w.jpg'}]
+        post.save(update_fields=['image_renditions'])
+        self.assertTrue(timeline.get_page(self.author.pk).items[0]['image_url'].endswith('photo-640w.jpg'))
+
+    def test_unknown_author(self):
+        with self.assertRaises(User.DoesNotExist):
+            timeline.get_page(99999)
+        self.assertIsNone(timeline.first_page_cache.get(99999))
+
+        # 投稿のない既存ユーザーは空のページをキャッシュする
+        empty = User.objects.create_user('carol')
+        self.assertEqual(timeline.get_page(empty.pk).items, [])
+        with self.assertNumQueries(0):
+            timeline.get_page(empty.pk)
+
+        empty.delete()
+        with self.assertRaises(User.DoesNotExist):
+            timeline.get_page(empty.pk)
+
+    def test_api_and_page(self):
+        self.client.force_login(self.other)
+        response = self.client.get(reverse('posts:user_posts_api', args=[self.author.pk]), {'limit': 2})
+        data = response.json()
+        self.assertTrue(data['success'])
+        self.assertEqual([item['id'] for item in data['posts']], [self.posts[4].pk, self.posts[3].pk])
+
+        response = self.client.get(reverse('posts:user_posts_api', args=[self.author.pk]), {'cursor': 'invalid'})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get(reverse('posts:user_posts_api', args=[99999]))
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.json()['success'])
+
+        response = self.client.get(reverse('posts:user_timeline', args=['alice']))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['posts']), 3)
+        self.assertContains(response, '投稿4')
+
+    def test_page_uses_cached_first_page(self):
+        self.client.force_login(self.other)
+        url = reverse('posts:user_timeline', args=['alice'])
+        self.client.get(url)
+
+        # 先頭ページの投稿IDはキャッシュから取得し、投稿は主キーで読み込む
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        post_queries = [q['sql'] for q in queries.captured_queries if 'FROM "posts_post"' in q['sql']]
+        self.assertEqual(len(post_queries), 1)
+        self.assertIn('"posts_post"."id" IN', post_queries[0])
+        self.assertEqual(
+            [post.pk for post in response.context['posts']],
+            [post.pk for post in reversed(self.posts[2:])],
+        )
+        self.assertFalse(response.context['posts'][0].is_liked)
+
+        response = self.client.get(url, {'cursor': response.context['next_cursor']})
+        self.assertEqual([post.pk for post in response.context['posts']], [self.posts[1].pk, self.posts[0].pk])
+
+        # 不正なカーソルは先頭ページを表示する
+        response = self.client.get(url, {'cursor': 'invalid'})
+        self.assertEqual(len(response.context['posts']), 3)
+
+
+class PostImageTests(TestCase):
+    """投稿画像のレンディション生成と後片付けを確認"""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root, POST_IMAGE_RENDITION_WIDTHS=(320, 640))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+        self.user = User.objects.create_user('alice')
+
+    def create_post(self, name, fmt, mode, size=(800, 600), **save_options):
+        buffer = BytesIO()
+        Image.new(mode, size, (200, 100, 50, 0) if mode == 'RGBA' else (200, 100, 50)).save(buffer, fmt, **save_options)
+        self.original_bytes = buffer.getvalue()
+        return Post.objects.create(
+            author=self.user, content='画像付き', image=SimpleUploadedFile(name, self.original_bytes),
+        )
+
+    def open_rendition(self, post, fmt, width):
+        rendition = next(r for r in post.image_renditions if r['format'] == fmt and r['width'] == width)
+        with default_storage.open(rendition['name']) as f:
+            image = Image.open(f)
+            image.load()
+        return image
+
+    def test_original_is_kept_and_renditions_strip_exif(self):
+        exif = Image.Exif()
+        exif[0x010F] = 'Camera'  # Make
+        post = self.create_post('photo.jpg', 'JPEG', 'RGB', exif=exif.tobytes())
+        original_name = post.image.name
+        images.process_post_image(post)
+
+        post.refresh_from_db()
+        self.assertEqual(post.image.name, original_name)
+        with default_storage.open(original_name) as f:
+            self.assertEqual(f.read(), self.original_bytes)
+
+        self.assertEqual(sorted({r['width'] for r in post.image_renditions}), [320, 640])
+        self.assertEqual((post.image_width, post.image_height), (800, 600))
+        self.assertFalse(self.open_rendition(post, 'jpeg', 640).getexif())
+        self.assertTrue(post.image_placeholder.startswith('data:image/jpeg;base64,'))
+        # 表示には EXIF を除いた最大幅のレンディションを使う
+        self.assertTrue(post.get_image_url().endswith('-640w.jpg'))
+
+    def test_webp_keeps_transparency(self):
+        post = self.create_post('logo.png', 'PNG', 'RGBA')
+        images.process_post_image(post)
+        self.assertEqual(self.open_rendition(post, 'webp', 320).mode, 'RGBA')
+        self.assertEqual(self.open_rendition(post, 'jpeg', 320).mode, 'RGB')
+
+    def test_reprocess_removes_old_renditions(self):
+        post = self.create_post('photo.jpg', 'JPEG', 'RGB')
+        images.process_post_image(post)
+        old = [r['name'] for r in post.image_renditions]
+
+        call_command('process_post_images', '--all', stdout=StringIO())
+        post.refresh_from_db()
+        new = [r['name'] for r in post.image_renditions]
+        self.assertFalse(set(old) & set(new))
+        self.assertFalse([name for name in old if default_storage.exists(name)])
+        self.assertTrue(all(default_storage.exists(name) for name in new))
+
+    def test_delete_post_removes_renditions(self):
+        post = self.create_post('photo.jpg', 'JPEG', 'RGB')
+        images.process_post_image(post)
+        names = [r['name'] for r in post.image_renditions]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            post.delete()
+        self.assertFalse([name for name in names if default_storage.exists(name)])
@@ -0,0 +1,78 @@
+"""
+ユーザーごとの投稿一覧（プロフィールのタイムライン）
+
+(author, created_at, id) の索引（posts_post_author_recent_idx）を使った
+キーセットページネーションで取得する。プロフィールのポップオーバーや投稿一覧ページ
+から頻繁に読まれる先頭ページは投稿者ごとにキャッシュし、その投稿者の投稿の
+保存（画像処理の結果を含む）・削除シグナルで破棄する
+"""
+from datetime import datetime
+
+from django.conf import settings
+from django.contrib.auth.models import User
+
+from core.cache import CacheNamespace
+from core.pagination import CursorPage, encode_cursor, paginate_by_cursor
+from .models import Post
+
+# いいね数は、この有効期限の間は古い値のまま返ることがある
+first_page_cache = CacheNamespace('user_timeline', timeout=60 * 10)
+
+
+def serialize_post(post):
+    """JSON 応答用の投稿データ"""
+    return {
+        'id': post.pk,
+        'content': post.content,
+        'created_at': post.created_at.isoformat(),
+        'like_count': post.like_count,
+        'image_url': post.get_image_url(),
+    }
+
+
+def author_posts(author_id):
+    return Post.objects.filter(author_id=author_id)
+
+
+def _check_author(author_id):
+    # 投稿のない投稿者と存在しないユーザーを区別する（空のページのときだけ問い合わせる）
+    if not User.objects.filter(pk=author_id).exists():
+        raise User.DoesNotExist(f'User {author_id} does not exist')
+
+
+def get_page(author_id, cursor=None, limit=None):
+    """
+    投稿者の投稿を新しい順に1ページ分返す（items は serialize_post の辞書）
+
+    先頭ページ（cursor なし）はキャッシュから返す。limit を指定すると
+    ページの先頭 limit 件だけを返す（ポップオーバー用）。不正なカーソルは InvalidCursor、
+    存在しないユーザーは User.DoesNotExist（空のページをキャッシュしない）
+    """
+    if cursor:
+        page = paginate_by_cursor(author_posts(author_id), cursor=cursor, page_size=settings.FEED_PAGE_SIZE)
+        if not page.items:
+            _check_author(author_id)
+        items, next_cursor = [serialize_post(post) for post in page.items], page.next_cursor
+    else:
+        cached = first_page_cache.get(author_id)
+        if cached is None:
+            page = paginate_by_cursor(author_posts(author_id), page_size=settings.FEED_PAGE_SIZE)
+            if not page.items:
+                _check_author(author_id)
+            cached = {
+                'items': [serialize_post(post) for post in page.items],
+                'next_cursor': page.next_cursor,
+            }
+            first_page_cache.set(author_id, cached)
+        items, next_cursor = cached['items'], cached['next_cursor']
+
+    if limit is not None and len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        next_cursor = encode_cursor(datetime.fromisoformat(last['created_at']), last['id'])
+    return CursorPage(items=items, next_cursor=next_cursor)
+
+
+def invalidate(author_id):
+    """投稿者の投稿が増減・変更されたとき（と投稿者の削除時）に先頭ページのキャッシュを破棄する"""
+    first_page_cache.delete(author_id)
@@ -5,6 +5,9 @@ app_name = 'posts'
 
 urlpatterns = [
     path('create/', views.create_post, name='create'),
+    path('search/', views.search_posts, name='search'),
+    path('user/<str:username>/', views.user_timeline, name='user_timeline'),
+    path('api/users/<int:user_id>/posts/', views.user_posts_api, name='user_posts_api'),
     path('like/<int:post_id>/', views.post_like_toggle, name='post_like_toggle'),
     path('delete/<int:post_id>/', views.delete_post, name='delete_post'),
     path('admin-posts/', views.admin_posts, name='admin_posts'),
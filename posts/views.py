@@ -1,10 +1,17 @@
+from django.conf import settings
+from django.core.paginator import Paginator
 from django.shortcuts import render, redirect, get_object_or_404
+from django.contrib.auth.models import User
 from django.http import JsonResponse
+from django.views.decorators.http import require_http_methods, require_POST
 from django.contrib.auth.decorators import login_required
-from django.views.decorators.http import require_POST
 from django.contrib import messages
 from .forms import PostForm
+from core import events, jobs
+from core.pagination import InvalidCursor
+from .fragments import attach_card_fragments
 from .models import Post
+from . import search, tasks, timeline
 
 @login_required
 def create_post(request):
@@ -14,6 +21,9 @@ def create_post(request):
             post = form.save(commit=False)
             post.author = request.user
             post.save()
+            if post.image:
+                # レンディション生成はワーカーで行い、レスポンスを待たせない
+                jobs.enqueue(tasks.process_image, post.pk)
             return redirect('/')
     else:
         form = PostForm()
@@ -22,17 +32,11 @@ def create_post(request):
 @login_required
 @require_POST
 def post_like_toggle(request, post_id):  # ここをurls.pyの名前に合わせて統一
-    post = get_object_or_404(Post, id=post_id)
-    user = request.user
-
-    if post.likes.filter(id=user.id).exists():
-        post.likes.remove(user)
-        liked = False
-    else:
-        post.likes.add(user)
-        liked = True
+    post = get_object_or_404(Post.objects.only('id', 'author_id', 'content', 'like_count'), id=post_id)
+    liked, like_count = post.toggle_like(request.user)
 
-    like_count = post.likes.count()
+    # 他のタブ・ユーザーのいいね数表示をリアルタイムに更新
+    events.broadcast('like', {'post_id': post.id, 'like_count': like_count})
 
     return JsonResponse({'liked': liked, 'like_count': like_count})
 
@@ -52,6 +56,78 @@ def delete_post(request, post_id):
     except Exception as e:
         return JsonResponse({'success': False, 'error': '削除に失敗しました。'}, status=500)
 
+@login_required
+def search_posts(request):
+    """投稿の全文検索（関連度順・ページ番号でのページネーション）"""
+    query = request.GET.get('q', '').strip()
+    page_obj = None
+    posts = []
+    capped = False
+    if query:
+        # 一致した投稿IDを関連度順に取得し、表示するページの分だけ投稿を読み込む
+        # 上限を超えたかを判定できるよう1件多く取得し、件数は「上限件以上」と表示する
+        post_ids = search.search_post_ids(query, limit=search.MAX_RESULTS + 1)
+        capped = len(post_ids) > search.MAX_RESULTS
+        paginator = Paginator(post_ids[:search.MAX_RESULTS], settings.FEED_PAGE_SIZE)
+        page_obj = paginator.get_page(request.GET.get('page'))
+        found = Post.objects.for_feed(request.user).in_bulk(page_obj.object_list)
+        posts = attach_card_fragments(found[pk] for pk in page_obj.object_list if pk in found)
+
+    context = {
+        'query': query,
+        'posts': posts,
+        'page_obj': page_obj,
+        'capped': capped,
+    }
+    return render(request, 'posts/search.html', context)
+
+@login_required
+def user_timeline(request, username):
+    """
+    ユーザーごとの投稿一覧ページ
+
+    表示する投稿IDは timeline.get_page から取得し（先頭ページはキャッシュ）、
+    閲覧者ごとのいいね状態を含めた投稿はそのページの分だけ主キーで読み込む
+    """
+    author = get_object_or_404(User.objects.select_related('profile'), username=username)
+    try:
+        page = timeline.get_page(author.pk, cursor=request.GET.get('cursor'))
+    except InvalidCursor:
+        page = timeline.get_page(author.pk)
+
+    post_ids = [item['id'] for item in page.items]
+    found = Post.objects.for_feed(request.user).in_bulk(post_ids)
+    context = {
+        'author': author,
+        'posts': attach_card_fragments(found[pk] for pk in post_ids if pk in found),
+        'next_cursor': page.next_cursor,
+    }
+    return render(request, 'posts/user_timeline.html', context)
+
+@login_required
+@require_http_methods(["GET"])
+def user_posts_api(request, user_id):
+    """
+    ユーザーの投稿一覧（JSON）。プロフィールのポップオーバーなどから使う
+
+    ?cursor= で次ページ、?limit= で先頭から返す件数を指定できる。
+    先頭ページはキャッシュから返すため、データベースを参照しないことが多い
+    """
+    try:
+        limit = request.GET.get('limit')
+        limit = min(max(int(limit), 1), settings.FEED_PAGE_SIZE) if limit else None
+        page = timeline.get_page(user_id, cursor=request.GET.get('cursor'), limit=limit)
+    except (ValueError, InvalidCursor):
+        return JsonResponse({'success': False, 'error': 'パラメータが正しくありません'}, status=400)
+    except User.DoesNotExist:
+        return JsonResponse({'success': False, 'error': 'ユーザーが見つかりません'}, status=404)
+
+    return JsonResponse({
+        'success': True,
+        'posts': page.items,
+        'next_cursor': page.next_cursor,
+    })
+
 @login_required
 def admin_posts(request):
     """管理者用投稿管理ページ"""
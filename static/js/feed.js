@@ -0,0 +1,81 @@
+// タイムライン無限スクロール機能
+
+class FeedLoader {
+  constructor() {
+    this.container = null;
+    this.observer = null;
+    this.isLoading = false;
+  }
+
+  init() {
+    this.container = document.querySelector('.post-container');
+    if (!this.container || !('IntersectionObserver' in window)) return;
+
+    this.observer = new IntersectionObserver((entries) => {
+      entries.forEach(entry => {
+        if (entry.isIntersecting) {
+          this.loadNext(entry.target);
+        }
+      });
+    }, { rootMargin: '400px 0px' });
+
+    this.observeSentinel();
+  }
+
+  observeSentinel() {
+    const sentinel = this.container.querySelector('.feed-sentinel');
+    if (sentinel) {
+      this.observer.observe(sentinel);
+    }
+  }
+
+  async loadNext(sentinel) {
+    if (this.isLoading) return;
+    this.isLoading = true;
+
+    const cursor = sentinel.getAttribute('data-next-cursor');
+    const moreLink = sentinel.querySelector('.feed-more-link');
+    const loading = sentinel.querySelector('.feed-loading');
+    if (moreLink) moreLink.classList.add('hidden');
+    if (loading) loading.classList.remove('hidden');
+
+    try {
+      const response = await fetch(`/api/feed/?cursor=${encodeURIComponent(cursor)}`, {
+        method: 'GET',
+        headers: {
+          'X-Requested-With': 'XMLHttpRequest',
+        },
+      });
+
+      if (!response.ok) throw new Error('Network response was not ok');
+      const html = await response.text();
+
+      // 番兵を新しいページ（次の番兵を含む）で置き換える
+      this.observer.unobserve(sentinel);
+      const template = document.createElement('template');
+      template.innerHTML = html.trim();
+      sentinel.replaceWith(template.content);
+
+      if (window.refreshImageViewer) {
+        window.refreshImageViewer();
+      }
+      this.observeSentinel();
+    } catch (error) {
+      console.error('Failed to load feed:', error);
+      if (moreLink) moreLink.classList.remove('hidden');
+      if (loading) loading.classList.add('hidden');
+    } finally {
+      this.isLoading = false;
+    }
+  }
+}
+
+// グローバルインスタンス
+const feedLoader = new FeedLoader();
+
+// 初期化
+if (document.readyState === 'loading') {
+  document.addEventListener('DOMContentLoaded', () => feedLoader.init());
+} else {
+  feedLoader.init();
+}
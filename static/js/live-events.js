@@ -0,0 +1,59 @@
+// リアルタイム更新（Server-Sent Events）
+
+class LiveEventClient {
+  constructor() {
+    this.source = null;
+    this.connected = false;
+    this.opened = false;
+  }
+
+  init() {
+    if (!('EventSource' in window)) return;
+
+    this.source = new EventSource('/api/events/');
+
+    this.source.addEventListener('open', () => {
+      this.opened = true;
+      this.connected = true;
+      window.dispatchEvent(new CustomEvent('live:connected'));
+    });
+
+    this.source.addEventListener('error', () => {
+      // 一度も接続できないまま失敗した場合（503 など）は再接続を繰り返さず、ポーリングに任せる
+      if (!this.connected && !this.opened) {
+        this.source.close();
+        window.dispatchEvent(new CustomEvent('live:disconnected'));
+        return;
+      }
+      // CLOSED の場合は再接続されない（ASGI以外で動作している等）のでポーリングに任せる
+      if (this.connected || this.source.readyState === EventSource.CLOSED) {
+        this.connected = false;
+        window.dispatchEvent(new CustomEvent('live:disconnected'));
+      }
+    });
+
+    this.source.addEventListener('like', (e) => this.handleLike(JSON.parse(e.data)));
+    this.source.addEventListener('notification', (e) => {
+      window.dispatchEvent(new CustomEvent('live:notification', { detail: JSON.parse(e.data) }));
+    });
+    this.source.addEventListener('presence', (e) => {
+      window.dispatchEvent(new CustomEvent('live:presence', { detail: JSON.parse(e.data) }));
+    });
+  }
+
+  handleLike(data) {
+    document.querySelectorAll(`.post-like-btn[data-post-id="${data.post_id}"] .like-count`).forEach(el => {
+      el.textContent = data.like_count;
+    });
+  }
+}
+
+// グローバルインスタンス
+const liveEventClient = new LiveEventClient();
+
+// 初期化
+if (document.readyState === 'loading') {
+  document.addEventListener('DOMContentLoaded', () => liveEventClient.init());
+} else {
+  liveEventClient.init();
+}
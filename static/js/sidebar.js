@@ -111,6 +111,16 @@ class RightSidebarWidget {
     this.notificationsLoadingEl = null;
     this.notificationsErrorEl = null;
     this.notificationsRetryBtn = null;
+
+    this.pollTimer = null;
+    this.expireTimer = null;
+    this.live = false;
+
+    // オンラインユーザー（user_id → 表示データ）。イベントで追加・削除し、期限切れは外す
+    this.onlineUsers = new Map();
+    this.onlineWindowMs = 300000;
+    this.clockOffsetMs = 0;
+    this.currentUserId = null;
   }
 
   init() {
@@ -119,6 +129,9 @@ class RightSidebarWidget {
     this.onlineUsersLoadingEl = document.getElementById('online-users-loading');
     this.onlineUsersErrorEl = document.getElementById('online-users-error');
     this.onlineUsersRetryBtn = document.getElementById('online-users-retry');
+    if (this.onlineUsersListEl && this.onlineUsersListEl.dataset.currentUserId) {
+      this.currentUserId = Number(this.onlineUsersListEl.dataset.currentUserId);
+    }
 
     // 通知要素
     this.notificationsListEl = document.getElementById('notifications-list');
@@ -143,11 +156,70 @@ class RightSidebarWidget {
     this.loadOnlineUsers();
     this.loadNotifications();
 
-    // 定期更新（1分ごと）
-    setInterval(() => {
-      this.loadOnlineUsers();
+    // 定期更新。接続しただけではイベントが届く保証がないため、
+    // リアルタイム配信から実際にイベントを受け取るまでは1分ごとのポーリングを続ける
+    this.setPolling(false);
+
+    // 最終アクセスからオンライン判定の時間が過ぎたユーザーを一覧から外す
+    this.expireTimer = setInterval(() => this.expireOnlineUsers(), 30000);
+
+    window.addEventListener('live:disconnected', () => {
+      if (this.live) this.setPolling(false);
+    });
+    window.addEventListener('live:presence', (e) => {
+      if (!this.live) this.setPolling(true);
+      this.mergePresence(e.detail);
+    });
+    window.addEventListener('live:notification', () => {
+      if (!this.live) this.setPolling(true);
       this.loadNotifications();
-    }, 60000);
+    });
+  }
+
+  setPolling(live) {
+    if (this.pollTimer) clearInterval(this.pollTimer);
+    this.live = live;
+    if (live) {
+      // 通知はイベントだけで更新する。プレゼンスはオフラインになったことは通知されず、
+      // 最終アクセス時刻も更新されないため、オンライン判定の時間の半分ごとに取得し直す
+      this.pollTimer = setInterval(() => this.loadOnlineUsers(), this.onlineWindowMs / 2);
+    } else {
+      this.pollTimer = setInterval(() => {
+        this.loadOnlineUsers();
+        this.loadNotifications();
+      }, 60000);
+    }
+  }
+
+  // プレゼンスのイベント（{user_id, online, user}）を一覧に反映する（APIを取得し直さない）
+  mergePresence(data) {
+    if (!data || data.user_id === this.currentUserId) return;
+    if (data.online && data.user) {
+      this.onlineUsers.set(data.user_id, data.user);
+    } else if (!data.online) {
+      this.onlineUsers.delete(data.user_id);
+    }
+    this.renderOnlineUsers();
+  }
+
+  expireOnlineUsers() {
+    // last_seen はサーバーの時刻なので、取得時に求めた時計のずれで補正する
+    const serverNow = Date.now() - this.clockOffsetMs;
+    let expired = false;
+    for (const [userId, user] of this.onlineUsers) {
+      if (Date.parse(user.last_seen) + this.onlineWindowMs < serverNow) {
+        this.onlineUsers.delete(userId);
+        expired = true;
+      }
+    }
+    if (expired) this.renderOnlineUsers();
+  }
+
+  renderOnlineUsers() {
+    const users = [...this.onlineUsers.values()]
+      .sort((a, b) => Date.parse(b.last_seen) - Date.parse(a.last_seen))
+      .slice(0, 10);
+    this.displayOnlineUsers(users);
   }
 
   async loadOnlineUsers() {
@@ -171,7 +243,10 @@ class RightSidebarWidget {
       this.hideOnlineUsersLoading();
 
       if (result.success && result.users) {
-        this.displayOnlineUsers(result.users);
+        if (result.online_window) this.onlineWindowMs = result.online_window * 1000;
+        if (result.server_time) this.clockOffsetMs = Date.now() - Date.parse(result.server_time);
+        this.onlineUsers = new Map(result.users.map(user => [user.user_id, user]));
+        this.renderOnlineUsers();
       } else {
         this.showOnlineUsersError(result.error || 'オンラインユーザー情報を取得できませんでした');
       }